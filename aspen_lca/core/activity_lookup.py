@@ -0,0 +1,118 @@
+# core/activity_lookup.py
+
+from __future__ import annotations
+
+from functools import reduce
+from operator import or_
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from bw2data.backends import ActivityDataset as AD, ExchangeDataset as ED
+
+from core.cache import cached_by_database
+
+# Limite prudente di variabili per statement SQLite (vecchie build: 999)
+_SQLITE_MAX_VARS = 900
+
+ActivityKey = Tuple[str, str]
+
+
+def mapping_pair(entry: Any) -> Tuple[Optional[str], Optional[str]]:
+    """Estrae (database, code) da una voce di mappatura: vecchia tupla (db, code) o nuovo dict."""
+    if isinstance(entry, (tuple, list)) and len(entry) >= 2:
+        return entry[0], entry[1]
+    if isinstance(entry, dict):
+        return entry.get("database"), entry.get("code")
+    return None, None
+
+
+def mapped_pairs(mapping: Dict[str, Any]) -> List[ActivityKey]:
+    """Coppie (database, code) uniche e valide presenti in una mappatura {Flow: voce}."""
+    pairs = set()
+    for entry in (mapping or {}).values():
+        db_name, code = mapping_pair(entry)
+        if db_name and code:
+            pairs.add((str(db_name), str(code)))
+    return sorted(pairs)
+
+
+def _chunks(pairs: List[ActivityKey]) -> Iterable[List[ActivityKey]]:
+    chunk: List[ActivityKey] = []
+    for pair in pairs:
+        chunk.append(pair)
+        if len(chunk) >= _SQLITE_MAX_VARS:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _where_clause(pairs: List[ActivityKey]):
+    by_db: Dict[str, List[str]] = {}
+    for db_name, code in pairs:
+        by_db.setdefault(db_name, []).append(code)
+    return reduce(or_, [(AD.database == db_name) & (AD.code << codes) for db_name, codes in by_db.items()])
+
+
+def resolve_activities(pairs: Iterable[ActivityKey]) -> Dict[ActivityKey, Dict[str, Any]]:
+    """
+    Risolve in blocco i metadati di più attività Brightway con una sola query SQL
+    (spezzata solo oltre il limite di variabili di SQLite).
+    Ritorna {(database, code): {"id","database","code","name","location","categories","unit","type","reference product"}};
+    le coppie non trovate sono assenti dal dizionario.
+    """
+    unique = sorted({(str(d), str(c)) for d, c in pairs if d and c})
+    found: Dict[ActivityKey, Dict[str, Any]] = {}
+    for chunk in _chunks(unique):
+        query = AD.select(AD.id, AD.database, AD.code, AD.name, AD.location, AD.type, AD.data).where(_where_clause(chunk))
+        for row in query:
+            found[(row.database, row.code)] = _row_meta(row)
+    return found
+
+
+def resolve_activity_ids(ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+    """Come resolve_activities, ma a partire dagli id interi Brightway (righe/colonne delle matrici)."""
+    unique = sorted({int(i) for i in ids})
+    found: Dict[int, Dict[str, Any]] = {}
+    for start in range(0, len(unique), _SQLITE_MAX_VARS):
+        chunk = unique[start:start + _SQLITE_MAX_VARS]
+        query = AD.select(AD.id, AD.database, AD.code, AD.name, AD.location, AD.type, AD.data).where(AD.id << chunk)
+        for row in query:
+            found[row.id] = _row_meta(row)
+    return found
+
+
+def _row_meta(row) -> Dict[str, Any]:
+    data = row.data or {}
+    return {
+        "id": row.id,
+        "database": row.database,
+        "code": row.code,
+        "name": row.name or data.get("name", "-"),
+        "location": row.location or data.get("location", "-"),
+        "categories": list(data.get("categories", []) or []),
+        "unit": data.get("unit", ""),
+        "type": row.type,
+        "reference product": data.get("reference product", ""),
+    }
+
+
+@cached_by_database(max_entries=16)
+def production_sign_index(db_name: str) -> Dict[str, float]:
+    """
+    Indice riutilizzabile {code: segno} della produzione di riferimento di ogni attività di db_name
+    (exchange di produzione con input == output), calcolato con una sola query sugli exchanges.
+    Per i servizi di trattamento rifiuti ecoinvent il segno è tipicamente negativo.
+    """
+    query = ED.select(ED.output_code, ED.data).where(
+        (ED.output_database == db_name)
+        & (ED.type == "production")
+        & (ED.input_database == ED.output_database)
+        & (ED.input_code == ED.output_code)
+    )
+    index: Dict[str, float] = {}
+    for row in query:
+        if row.output_code in index:
+            continue
+        amount = float((row.data or {}).get("amount", 0.0))
+        index[row.output_code] = float((amount > 0) - (amount < 0))
+    return index
@@ -0,0 +1,276 @@
+# core/background.py
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.linalg import splu, spsolve
+import bw2data as bd
+import bw2calc as bc
+from bw2data.backends import ActivityDataset, ExchangeDataset
+
+from core.activity_lookup import resolve_activities
+from core.cache import cached_by_database
+from core.shared_matrices import collega_matrici, lega_lease, pubblica_matrici, raccogli_inutilizzati
+
+# Sistema di background condiviso a livello di processo (tutte le sessioni): matrici e fattorizzazione LU
+# dei database di background, in cache per impronta (progetto, database, data di modifica).
+# Il processo foreground (una sola colonna) viene risolto per blocchi senza rifattorizzare nulla.
+# Le matrici sono pubblicate una volta nell'archivio condiviso su disco (core.shared_matrices): gli altri
+# processi (worker di progetto, Monte Carlo, altre istanze del server) le aprono in memory-map.
+
+
+@dataclass
+class BackgroundSystem:
+    databases: Tuple[str, ...]
+    technosphere: sp.csc_matrix
+    biosphere: sp.csr_matrix
+    product_index: Dict[int, int]
+    activity_index: Dict[int, int]
+    biosphere_ids: np.ndarray
+    lu: Any = field(repr=False)
+    # Cartella dell'archivio condiviso da cui le matrici sono aperte (None se non pubblicate)
+    store: Optional[Path] = None
+
+    def solve(self, rhs: np.ndarray, trans: str = "N") -> np.ndarray:
+        """Risolve A x = rhs (o A^T x = rhs con trans='T'); rhs può avere più colonne."""
+        if self.lu is None:
+            return np.zeros_like(np.asarray(rhs, dtype=np.float64))
+        return self.lu.solve(np.asarray(rhs, dtype=np.float64), trans=trans)
+
+
+def background_databases(db_names: Iterable[str], exclude: Iterable[str] = ()) -> List[str]:
+    """
+    Chiusura delle dipendenze ('depends' nei metadati) dei database dati, in ordine stabile.
+    exclude: database mai inclusi (es. il database foreground, che cambia a ogni build dell'inventario).
+    """
+    exclude = set(exclude)
+    seen: List[str] = []
+    stack = [d for d in db_names if d]
+    while stack:
+        name = stack.pop()
+        if name in seen or name in exclude or name not in bd.databases:
+            continue
+        seen.append(name)
+        stack.extend(bd.databases[name].get("depends", []) or [])
+    return sorted(seen)
+
+
+def technosphere_node_id(databases: Iterable[str]) -> Optional[int]:
+    """Id di un nodo di tecnosfera dei database dati (None se contengono solo flussi di biosfera)."""
+    return ActivityDataset.select(ActivityDataset.id).where(
+        (ActivityDataset.database << list(databases)) & (ActivityDataset.type << list(bd.labels.lci_node_types))
+    ).scalar()
+
+
+def _empty_background(databases: Tuple[str, ...]) -> BackgroundSystem:
+    # Nessuna attività di tecnosfera (input solo di biosfera): niente da fattorizzare, solve() ritorna zeri
+    return BackgroundSystem(
+        databases=databases,
+        technosphere=sp.csc_matrix((0, 0)),
+        biosphere=sp.csr_matrix((0, 0)),
+        product_index={},
+        activity_index={},
+        biosphere_ids=np.zeros(0, dtype=np.int64),
+        lu=None,
+    )
+
+
+@cached_by_database(databases=lambda databases: databases, max_entries=2)
+def background_system(databases: Tuple[str, ...]) -> BackgroundSystem:
+    """
+    Matrici dei database di background con la loro fattorizzazione LU, calcolata una sola volta per processo.
+    Le matrici vengono aperte dall'archivio condiviso se già pubblicate, altrimenti assemblate, pubblicate
+    (con pulizia degli archivi obsoleti) e riaperte in memory-map. Il lease dell'archivio segue la vita della
+    voce in cache. La voce resta in cache finché l'impronta di nessuno dei database cambia.
+    Senza attività di tecnosfera (es. foreground con soli flussi di biosfera) il sistema è vuoto (lu=None).
+    """
+    databases = tuple(sorted(databases))
+    any_id = technosphere_node_id(databases) if databases else None
+    if any_id is None:
+        return _empty_background(databases)
+    attached = collega_matrici(databases)
+    if attached is None:
+        lca = bc.LCA({any_id: 1.0}, data_objs=[bd.Database(name).datapackage() for name in databases])
+        lca.load_lci_data()
+        reversed_bio = lca.dicts.biosphere.reversed
+        built = {
+            "technosphere": lca.technosphere_matrix.tocsc(),
+            "biosphere": lca.biosphere_matrix.tocsr(),
+            "product_index": dict(lca.dicts.product),
+            "activity_index": dict(lca.dicts.activity),
+            "biosphere_ids": np.array([reversed_bio[i] for i in range(lca.biosphere_matrix.shape[0])], dtype=np.int64),
+        }
+        pubblica_matrici(databases, **built)
+        raccogli_inutilizzati(keep=databases)
+        # Riaperto dall'archivio: stessa copia in page cache degli altri processi; in memoria se non disponibile
+        attached = collega_matrici(databases) or dict(built, lease=None, path=None)
+
+    technosphere = attached["technosphere"]
+    bg = BackgroundSystem(
+        databases=databases,
+        technosphere=technosphere,
+        biosphere=attached["biosphere"],
+        product_index=attached["product_index"],
+        activity_index=attached["activity_index"],
+        biosphere_ids=attached["biosphere_ids"],
+        # copia temporanea: SuperLU non lavora su array in sola lettura
+        lu=splu(technosphere.copy()) if technosphere.shape[0] else None,
+        store=attached["path"],
+    )
+    if attached["lease"] is not None:
+        lega_lease(bg, attached["lease"])
+    return bg
+
+
+def stored_exchanges(process_key: Tuple[str, str]) -> List[Dict[str, Any]]:
+    """Exchanges salvati di un processo, come specifiche {type, input, amount} (una sola query)."""
+    return stored_exchanges_many(process_key[0], [process_key[1]]).get(tuple(process_key), [])
+
+
+def stored_exchanges_many(db_name: str, codes: Iterable[str]) -> Dict[Tuple[str, str], List[Dict[str, Any]]]:
+    """Come stored_exchanges per più processi dello stesso database, con una sola query: {(db, code): [...]}."""
+    query = ExchangeDataset.select(ExchangeDataset.type, ExchangeDataset.input_database, ExchangeDataset.input_code,
+                                   ExchangeDataset.output_code, ExchangeDataset.data).where(
+        (ExchangeDataset.output_database == db_name) & (ExchangeDataset.output_code << list(codes))
+    )
+    out: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+    for row in query:
+        out.setdefault((db_name, row.output_code), []).append(
+            {"type": row.type, "input": (row.input_database, row.input_code), "amount": float((row.data or {}).get("amount", 0.0))}
+        )
+    return out
+
+
+def flatten_foreground(exchanges: List[Dict[str, Any]], process_key: Tuple[str, str]) -> List[Dict[str, Any]]:
+    """
+    Foreground a più processi (es. i processi di blocco Aspen consumati dal processo di flowsheet, nello stesso
+    database): il piccolo sistema A_ff dei processi foreground raggiungibili è risolto a parte e ridotto a una
+    sola colonna equivalente per 1 unità di process_key (produzione 1 + input esterni scalati per la supply di
+    ciascun processo). Il database foreground resta fuori dal background: nessuna rifattorizzazione a ogni build.
+    Con un solo processo ritorna gli exchanges invariati.
+    """
+    process_key = tuple(process_key)
+    fg_db = process_key[0]
+    columns: Dict[Tuple[str, str], List[Dict[str, Any]]] = {process_key: exchanges}
+    pending = {tuple(ex["input"]) for ex in exchanges if ex["input"][0] == fg_db} - set(columns)
+    while pending:
+        fetched = stored_exchanges_many(fg_db, [k[1] for k in pending])
+        columns.update((k, exs) for k, exs in fetched.items() if exs)
+        pending = {tuple(ex["input"]) for exs in fetched.values() for ex in exs if ex["input"][0] == fg_db} - set(columns)
+    if len(columns) == 1:
+        return exchanges
+
+    negative = set(bd.labels.technosphere_negative_edge_types)
+    order = list(columns)
+    index = {k: j for j, k in enumerate(order)}
+    rows, cols, data = [], [], []
+    for j, key in enumerate(order):
+        for ex in columns[key]:
+            i = index.get(tuple(ex["input"]))
+            if i is not None:
+                rows.append(i)
+                cols.append(j)
+                data.append(-ex["amount"] if ex["type"] in negative else ex["amount"])
+    A_ff = sp.csc_matrix((data, (rows, cols)), shape=(len(order), len(order)))
+    demand = np.zeros(len(order))
+    demand[index[process_key]] = 1.0
+    supply = np.atleast_1d(spsolve(A_ff, demand))
+    if not np.all(np.isfinite(supply)):
+        raise ValueError("The foreground system is singular (check the production exchanges); cannot solve.")
+
+    flat = [{"type": bd.labels.production_edge_default, "input": process_key, "amount": 1.0}]
+    for key, s in zip(order, supply):
+        for ex in columns[key]:
+            if tuple(ex["input"]) not in index:
+                flat.append(dict(ex, amount=ex["amount"] * float(s)))
+    return flat
+
+
+def foreground_column(
+    exchanges: List[Dict[str, Any]],
+    process_key: Tuple[str, str],
+    bg: BackgroundSystem,
+    targets: Optional[Dict[Tuple[str, str], Dict[str, Any]]] = None,
+) -> Dict[str, Any]:
+    """
+    Scompone la colonna del processo foreground:
+    a_ff (produzione del proprio prodotto), a_bf (vettore sulle righe prodotto del background),
+    b_f (dict {id flusso biosfera: amount}). Gli input non presenti nel background vengono segnalati.
+    positions: per ogni exchange collegato, (exchange, "product" | "biosphere", riga o id flusso, valore).
+    """
+    negative = set(bd.labels.technosphere_negative_edge_types)
+    process_key = tuple(process_key)
+    if targets is None:
+        targets = resolve_activities(ex["input"] for ex in exchanges if tuple(ex["input"]) != process_key)
+
+    a_ff = 0.0
+    a_bf = np.zeros(bg.technosphere.shape[0])
+    b_f: Dict[int, float] = {}
+    positions: List[Tuple[Dict[str, Any], str, int, float]] = []
+    warnings: List[str] = []
+    for ex in exchanges:
+        key = tuple(ex["input"])
+        value = -ex["amount"] if ex["type"] in negative else ex["amount"]
+        if key == process_key:
+            a_ff += value
+            continue
+        meta = targets.get(key)
+        if meta is None:
+            warnings.append(f"Exchange input {key} not found; skipped.")
+            continue
+        if ex["type"] == "biosphere":
+            b_f[meta["id"]] = b_f.get(meta["id"], 0.0) + ex["amount"]
+            positions.append((ex, "biosphere", meta["id"], ex["amount"]))
+        elif meta["id"] in bg.product_index:
+            a_bf[bg.product_index[meta["id"]]] += value
+            positions.append((ex, "product", bg.product_index[meta["id"]], value))
+        else:
+            warnings.append(f"Exchange input {key} is not part of the background system; skipped.")
+    return {"a_ff": a_ff, "a_bf": a_bf, "b_f": b_f, "positions": positions, "warnings": warnings}
+
+
+def solve_foreground(column: Dict[str, Any], bg: BackgroundSystem, amount: float = 1.0, split: bool = False) -> Dict[str, Any]:
+    """
+    Risolve il sistema a blocchi [[A_bb, a_bf], [0, a_ff]] [x_b; x_f] = [0; amount] riusando la LU di A_bb.
+    Il complemento di Schur della colonna foreground è a_ff (il background non consuma il foreground),
+    quindi x_f = amount / a_ff e x_b = A_bb^-1 (-a_bf x_f): una sola back-substitution.
+    split=True: stessa solve con un termine noto per riga prodotto domandata (x_b è la somma delle colonne),
+    così i contributi per exchange non richiedono nuove risoluzioni ("split_rows", "split_supply").
+    Ritorna {"x_f", "supply" (x_b), "biosphere_ids", "inventory"} con l'inventario sull'unione dei flussi.
+    """
+    a_ff = column["a_ff"]
+    if not a_ff:
+        raise ValueError("The foreground process has no production exchange; cannot solve.")
+    x_f = amount / a_ff
+    extra: Dict[str, Any] = {}
+    if split:
+        rows = np.flatnonzero(column["a_bf"])
+        rhs = np.zeros((bg.technosphere.shape[0], len(rows)))
+        rhs[rows, np.arange(len(rows))] = -column["a_bf"][rows] * x_f
+        X = bg.solve(rhs) if len(rows) else rhs
+        x_b = X.sum(axis=1)
+        extra = {"split_rows": rows, "split_supply": X}
+    else:
+        x_b = bg.solve(-column["a_bf"] * x_f)
+    g = bg.biosphere @ x_b
+
+    ids = bg.biosphere_ids
+    extra_ids, extra_amounts = [], []
+    bio_pos = {int(i): p for p, i in enumerate(ids)} if column["b_f"] else {}
+    g = np.array(g, dtype=np.float64)
+    for flow_id, value in column["b_f"].items():
+        p = bio_pos.get(int(flow_id))
+        if p is None:
+            extra_ids.append(int(flow_id))
+            extra_amounts.append(value * x_f)
+        else:
+            g[p] += value * x_f
+    if extra_ids:
+        ids = np.concatenate([ids, np.array(extra_ids, dtype=np.int64)])
+        g = np.concatenate([g, np.array(extra_amounts)])
+    return {"x_f": x_f, "supply": x_b, "biosphere_ids": ids, "inventory": g, **extra}
@@ -0,0 +1,127 @@
+# core/cache.py
+
+from __future__ import annotations
+
+import functools
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Tuple
+
+import bw2data as bd
+
+# Cache condivisa a livello di processo (tutte le sessioni Streamlit) per dati derivati
+# dai database Brightway. Nessuna scadenza temporale: una voce resta valida finché
+# l'impronta (progetto, database, data di modifica, generazione) non cambia.
+
+_LOCK = threading.RLock()
+_STORES: Dict[str, "OrderedDict[Hashable, Tuple[Hashable, Any]]"] = {}
+# Contatore di generazione per (progetto, database): incrementato dagli hook di invalidazione
+_GENERATIONS: Dict[Tuple[str, str], int] = {}
+
+
+def database_fingerprint(db_name: str) -> Tuple[Any, ...]:
+    """Impronta di un database: (progetto, nome, 'modified' dai metadati, generazione locale)."""
+    project = bd.projects.current
+    try:
+        modified = bd.databases[db_name].get("modified")
+    except KeyError:
+        modified = None
+    with _LOCK:
+        generation = _GENERATIONS.get((project, db_name), 0)
+    return (project, db_name, modified, generation)
+
+
+def invalidate_database(db_name: Optional[str] = None) -> None:
+    """
+    Hook di invalidazione esplicita: scarta le voci che dipendono da db_name
+    (o da tutti i database del progetto corrente se db_name è None).
+    Da chiamare dopo scritture sul database (build inventory, import ecoinvent).
+    """
+    project = bd.projects.current
+    with _LOCK:
+        if db_name is None:
+            names = {name for (proj, name) in _GENERATIONS if proj == project} | set(bd.databases)
+        else:
+            names = {db_name}
+        for name in names:
+            _GENERATIONS[(project, name)] = _GENERATIONS.get((project, name), 0) + 1
+        for store in _STORES.values():
+            stale = [
+                key for key, (fp, _) in store.items()
+                if any(part[0] == project and part[1] in names for part in fp)
+            ]
+            for key in stale:
+                del store[key]
+
+
+def clear_cache(namespace: Optional[str] = None) -> None:
+    """Svuota una cache (o tutte)."""
+    with _LOCK:
+        if namespace is None:
+            _STORES.clear()
+        else:
+            _STORES.pop(namespace, None)
+
+
+def _first_arg_database(*args, **kwargs) -> Iterable[str]:
+    return [kwargs.get("db_name", args[0] if args else None)]
+
+
+def method_fingerprint(method: Tuple) -> Tuple[Any, ...]:
+    """Impronta di un metodo LCIA: (progetto, ("method", *tupla), num_cfs, modified se presente)."""
+    meta = bd.methods.get(tuple(method), {}) or {}
+    return (bd.projects.current, ("method",) + tuple(method), meta.get("num_cfs"), meta.get("modified"))
+
+
+def cached_by_fingerprint(
+    fingerprint: Callable[..., Hashable],
+    namespace: Optional[str] = None,
+    max_entries: int = 128,
+):
+    """
+    Decoratore generico: memoizza il risultato per argomenti + impronta calcolata da
+    `fingerprint(*args, **kwargs)` (una tupla di impronte come quelle di database_fingerprint).
+    Le voci più vecchie oltre max_entries vengono scartate (LRU).
+    """
+    def decorator(func: Callable):
+        ns = namespace or f"{func.__module__}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            fp = fingerprint(*args, **kwargs)
+            with _LOCK:
+                store = _STORES.setdefault(ns, OrderedDict())
+                hit = store.get(key)
+                if hit is not None and hit[0] == fp:
+                    store.move_to_end(key)
+                    return hit[1]
+            value = func(*args, **kwargs)
+            with _LOCK:
+                store = _STORES.setdefault(ns, OrderedDict())
+                store[key] = (fp, value)
+                store.move_to_end(key)
+                while len(store) > max_entries:
+                    store.popitem(last=False)
+            return value
+
+        wrapper.clear = lambda: clear_cache(ns)
+        return wrapper
+
+    return decorator
+
+
+def cached_by_database(
+    namespace: Optional[str] = None,
+    databases: Callable[..., Iterable[str]] = _first_arg_database,
+    max_entries: int = 128,
+):
+    """
+    Decoratore: memoizza il risultato per argomenti + impronta dei database coinvolti.
+    `databases(*args, **kwargs)` ritorna i nomi dei database da cui dipende il risultato
+    (default: il primo argomento). Le voci più vecchie oltre max_entries vengono scartate (LRU).
+    """
+    def fingerprint(*args, **kwargs):
+        return tuple(database_fingerprint(d) for d in sorted({d for d in databases(*args, **kwargs) if d}))
+
+    return cached_by_fingerprint(fingerprint, namespace=namespace, max_entries=max_entries)
@@ -0,0 +1,96 @@
+# core/characterization.py
+
+from __future__ import annotations
+
+from typing import Any, Dict, Iterable, List, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+import bw2data as bd
+
+from core.activity_lookup import resolve_activities
+from core.cache import cached_by_fingerprint, method_fingerprint
+
+# Matrice di caratterizzazione impilata: una riga per categoria, una colonna per flusso di biosfera
+# (id Brightway ordinati). Tutti i punteggi = una sola moltiplicazione sparsa con l'inventario.
+
+
+def _cf_amount(cf: Any) -> float:
+    # CF semplice o dict con incertezza ({"amount": ...})
+    return float(cf.get("amount", 0.0)) if isinstance(cf, dict) else float(cf)
+
+
+def _methods_fingerprint(methods: Tuple[Tuple, ...]) -> Tuple:
+    return tuple(method_fingerprint(m) for m in methods)
+
+
+@cached_by_fingerprint(lambda method: (method_fingerprint(method),), max_entries=256)
+def method_characterization(method: Tuple) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    CF di un singolo metodo come (id flussi, amount), con i flussi espressi come chiave (database, code)
+    risolti in id con una sola query. I CF regionalizzati (terzo elemento location) vengono tenuti come globali.
+    """
+    raw: List[Tuple[Any, float]] = []
+    keys = set()
+    for entry in bd.Method(method).load():
+        flow, cf = entry[0], entry[1]
+        if isinstance(flow, (tuple, list)):
+            flow = tuple(flow)
+            keys.add(flow)
+        raw.append((flow, _cf_amount(cf)))
+
+    key_ids = {k: meta["id"] for k, meta in resolve_activities(keys).items()} if keys else {}
+    flows, data = [], []
+    for flow, amount in raw:
+        flow_id = key_ids.get(flow) if isinstance(flow, tuple) else int(flow)
+        if flow_id is None:
+            continue
+        flows.append(flow_id)
+        data.append(amount)
+    return np.array(flows, dtype=np.int64), np.array(data, dtype=np.float64)
+
+
+@cached_by_fingerprint(_methods_fingerprint, max_entries=32)
+def stacked_characterization(methods: Tuple[Tuple, ...]) -> Dict[str, Any]:
+    """
+    Impila i CF di tutti i metodi in un'unica matrice CSR (n_metodi × n_flussi); i CF di ogni metodo
+    sono in cache separatamente (method_characterization), quindi cambiare selezione non ricarica nulla.
+    Ritorna {"methods": [...], "flow_ids": np.ndarray ordinato, "matrix": csr_matrix}.
+    """
+    parts = [method_characterization(m) for m in methods]
+    rows = np.concatenate([np.full(len(ids), i, dtype=np.int64) for i, (ids, _) in enumerate(parts)] or [np.zeros(0, dtype=np.int64)])
+    flows = np.concatenate([ids for ids, _ in parts] or [np.zeros(0, dtype=np.int64)])
+    data = np.concatenate([amounts for _, amounts in parts] or [np.zeros(0)])
+
+    flow_ids = np.unique(flows)
+    cols = np.searchsorted(flow_ids, flows)
+    matrix = sp.csr_matrix((data, (rows, cols)), shape=(len(methods), len(flow_ids)))
+    return {"methods": list(methods), "flow_ids": flow_ids, "matrix": matrix}
+
+
+def project_stack(stack: Dict[str, Any], ids: Iterable[int]) -> sp.csr_matrix:
+    """Riallinea le colonne della matrice impilata a un ordine di id arbitrario (zero per i flussi senza CF)."""
+    ids = np.asarray(list(ids), dtype=np.int64)
+    flow_ids = stack["flow_ids"]
+    pos = np.searchsorted(flow_ids, ids)
+    pos_clipped = np.minimum(pos, max(len(flow_ids) - 1, 0))
+    found = (pos < len(flow_ids)) & (flow_ids[pos_clipped] == ids) if len(flow_ids) else np.zeros(len(ids), dtype=bool)
+    selector = sp.csr_matrix(
+        (np.ones(int(found.sum())), (pos[found], np.flatnonzero(found))),
+        shape=(len(flow_ids), len(ids)),
+    )
+    return (stack["matrix"] @ selector).tocsr()
+
+
+def characterize_inventory(stack: Dict[str, Any], ids: Iterable[int], amounts: np.ndarray) -> Dict[str, Any]:
+    """
+    Punteggi di tutte le categorie con un solo prodotto sparso: scores = C · g.
+    Sottoprodotto: contributi caratterizzati per flusso (csr n_metodi × n_flussi, colonne come `ids`).
+    """
+    ids = np.asarray(list(ids), dtype=np.int64)
+    C = project_stack(stack, ids)
+    g = np.asarray(amounts, dtype=np.float64).ravel()
+    scores = C @ g
+    contributions = C.multiply(g[np.newaxis, :]).tocsr()
+    return {"scores": np.asarray(scores).ravel(), "contributions": contributions, "flow_ids": ids}
+
@@ -0,0 +1,180 @@
+# core/comparative.py
+
+from __future__ import annotations
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import pandas as pd
+import bw2data as bd
+from bw2data.backends import ActivityDataset as AD
+
+from core.activity_lookup import mapping_pair, resolve_activities
+from core.exploratory_lcia import IN_MEMORY_DATABASE
+from core.inventory_builder import MappingType, compile_exchanges
+from core.lcia_runner import cached_lcia_scores
+
+# LCIA comparativa su più background (database e/o progetti diversi, es. cutoff vs consequential,
+# ecoinvent 3.9 vs 3.10): la mappatura viene ricollegata alle attività equivalenti di ogni background
+# e le LCIA (in memoria, senza scritture) girano in parallelo in un pool di processi.
+
+BackgroundTarget = Tuple[str, str]  # (progetto, database)
+
+# Ordine di ripiego sulla location quando quella originale non esiste nel background di destinazione
+_LOCATION_FALLBACK = ("GLO", "RoW")
+
+
+def ricollega_mappatura(
+    mapping: MappingType,
+    target_db: str,
+    sources: Optional[Dict[Tuple[str, str], Dict[str, Any]]] = None,
+) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """
+    Ricollega ogni voce di mappatura all'attività equivalente di target_db (stesso nome, prodotto di
+    riferimento e unità; location identica, poi GLO, poi RoW). I flussi di biosfera sono ricollegati al
+    flusso con stesso nome, categorie e unità nei database di biosfera del progetto di destinazione
+    (preferendo un database con lo stesso nome). Tre query: metadati di partenza, candidati di tecnosfera
+    per nome in target_db, candidati di biosfera per nome.
+    sources: metadati delle attività di partenza già risolti (necessari se target_db è in un altro progetto).
+    Ritorna (nuova mappatura, report [{flow, source, target, match}]).
+    """
+    pairs = {flow: mapping_pair(entry) for flow, entry in (mapping or {}).items()}
+    if sources is None:
+        sources = resolve_activities(p for p in pairs.values() if p[0] and p[1])
+    bio_types = set(bd.labels.biosphere_node_types)
+    names = sorted({m["name"] for m in sources.values() if m.get("type") not in bio_types})
+    bio_names = sorted({m["name"] for m in sources.values() if m.get("type") in bio_types})
+
+    candidates: Dict[Tuple[str, str, str], Dict[str, Dict[str, Any]]] = {}
+    for start in range(0, len(names), 500):
+        query = AD.select(AD.code, AD.name, AD.location, AD.data).where(
+            (AD.database == target_db) & (AD.name << names[start:start + 500])
+        )
+        for row in query:
+            data = row.data or {}
+            key = (row.name, data.get("reference product", ""), data.get("unit", ""))
+            candidates.setdefault(key, {})[row.location or ""] = {"code": row.code, "unit": data.get("unit", "")}
+
+    bio_candidates: Dict[Tuple[str, Tuple[str, ...], str], Dict[str, str]] = {}
+    for start in range(0, len(bio_names), 500):
+        query = AD.select(AD.database, AD.code, AD.name, AD.data).where(
+            (AD.type << list(bio_types)) & (AD.name << bio_names[start:start + 500])
+        )
+        for row in query:
+            data = row.data or {}
+            key = (row.name, tuple(data.get("categories", []) or []), data.get("unit", ""))
+            bio_candidates.setdefault(key, {})[row.database] = row.code
+
+    relinked: Dict[str, Any] = {}
+    report: List[Dict[str, Any]] = []
+    for flow, pair in pairs.items():
+        meta = sources.get(pair)
+        if meta is None:
+            report.append({"flow": flow, "source": pair, "target": None, "match": "source not found"})
+            continue
+        if meta.get("type") in bio_types:
+            by_db = bio_candidates.get((meta["name"], tuple(meta["categories"]), meta["unit"]), {})
+            if not by_db:
+                report.append({"flow": flow, "source": pair, "target": None, "match": "not found"})
+                continue
+            db_name = pair[0] if pair[0] in by_db else sorted(by_db)[0]
+            entry = dict(mapping[flow]) if isinstance(mapping[flow], dict) else {"unit": meta["unit"]}
+            entry.update(database=db_name, code=by_db[db_name])
+            relinked[flow] = entry
+            report.append({"flow": flow, "source": pair, "target": (db_name, by_db[db_name]), "match": "biosphere"})
+            continue
+        by_location = candidates.get((meta["name"], meta["reference product"], meta["unit"]), {})
+        match = None
+        for loc in (meta["location"], *_LOCATION_FALLBACK):
+            if loc in by_location:
+                match = (loc, by_location[loc])
+                break
+        if match is None:
+            report.append({"flow": flow, "source": pair, "target": None, "match": None})
+            continue
+        entry = dict(mapping[flow]) if isinstance(mapping[flow], dict) else {"unit": meta["unit"]}
+        entry.update(database=target_db, code=match[1]["code"], unit=match[1]["unit"])
+        relinked[flow] = entry
+        report.append({
+            "flow": flow,
+            "source": pair,
+            "target": (target_db, match[1]["code"]),
+            "match": "exact" if match[0] == meta["location"] else match[0],
+        })
+    return relinked, report
+
+
+def _compare_worker(
+    target: BackgroundTarget,
+    df_lci,
+    mapping: MappingType,
+    methods: List[Tuple],
+    sources: Dict[Tuple[str, str], Dict[str, Any]],
+) -> Dict[str, Any]:
+    """Eseguito nel processo del pool: progetto di destinazione, ricollegamento, LCIA in memoria."""
+    project, db_name = target
+    bd.projects.set_current(project)
+    if db_name not in bd.databases:
+        return {"target": target, "results": {}, "report": [], "warnings": [],
+                "error": f"Database '{db_name}' not found in project '{project}'."}
+    available = [tuple(m) for m in methods if tuple(m) in bd.methods]
+    relinked, report = ricollega_mappatura(mapping, db_name, sources)
+    # Come run_lcia_in_memory, ma conservando gli avvisi di compilazione (flussi scartati)
+    process_key = (IN_MEMORY_DATABASE, "foreground")
+    compiled = compile_exchanges(df_lci, relinked, process_key)
+    results = (
+        cached_lcia_scores(compiled["exchanges"], process_key, available, targets=compiled["targets"])
+        if available else {}
+    )
+    missing = [str(tuple(m)) for m in methods if tuple(m) not in bd.methods]
+    return {
+        "target": target,
+        "results": results,
+        "report": report,
+        "warnings": [w for w in compiled["warnings"] if w],
+        "error": f"Methods not available: {', '.join(missing)}" if missing else None,
+    }
+
+
+def confronta_background(
+    df_lci,
+    mapping: MappingType,
+    targets: Sequence[BackgroundTarget],
+    methods: List[Tuple],
+    workers: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Esegue la LCIA dello stesso processo Aspen su ogni background (progetto, database) in parallelo.
+    Ritorna {"table": DataFrame (righe = categorie, colonne = "progetto / database"), "reports", "warnings", "errors"}.
+    """
+    methods = [tuple(m) for m in methods]
+    targets = list(dict.fromkeys(tuple(t) for t in targets))
+    if not targets or not methods:
+        return {"table": pd.DataFrame(), "reports": {}, "warnings": {}, "errors": {}}
+
+    # Metadati di partenza risolti qui, nel progetto corrente: i worker lavorano nei progetti di destinazione
+    sources = resolve_activities(p for p in (mapping_pair(e) for e in (mapping or {}).values()) if p[0] and p[1])
+    workers = workers or max(1, min(len(targets), (os.cpu_count() or 2) - 1))
+    outcomes: Dict[BackgroundTarget, Dict[str, Any]] = {}
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {pool.submit(_compare_worker, t, df_lci, dict(mapping), methods, sources): t for t in targets}
+        for future in as_completed(futures):
+            target = futures[future]
+            try:
+                outcomes[target] = future.result()
+            except Exception as e:
+                outcomes[target] = {"target": target, "results": {}, "report": [], "warnings": [],
+                                    "error": f"{type(e).__name__}: {e}"}
+
+    labels = {t: f"{t[0]} / {t[1]}" for t in targets}
+    table = pd.DataFrame(
+        {labels[t]: {str(m): outcomes[t]["results"].get(str(m)) for m in methods} for t in targets}
+    )
+    return {
+        "table": table,
+        "reports": {labels[t]: outcomes[t]["report"] for t in targets},
+        "warnings": {labels[t]: outcomes[t]["warnings"] for t in targets if outcomes[t].get("warnings")},
+        "errors": {labels[t]: outcomes[t]["error"] for t in targets if outcomes[t].get("error")},
+    }
@@ -0,0 +1,103 @@
+# core/contributions.py
+
+from __future__ import annotations
+
+from typing import Any, Dict, List
+
+import numpy as np
+
+from core.activity_lookup import resolve_activities, resolve_activity_ids
+from core.characterization import project_stack, stacked_characterization
+
+# Analisi dei contributi sul risultato di lcia_from_exchanges / run_lcia_detailed: nessuna nuova
+# risoluzione del background, solo prodotti elemento per elemento su inventario, supply e matrici
+# caratterizzate già calcolati, con selezione top-k parziale (np.argpartition).
+
+FOREGROUND_DIRECT = "Foreground process (direct emissions)"
+
+
+def _top_k(values: np.ndarray, k: int) -> np.ndarray:
+    """Indici dei k valori con |valore| maggiore, ordinati in modo decrescente (ordinamento parziale)."""
+    values = np.asarray(values).ravel()
+    nz = np.flatnonzero(values)
+    if len(nz) > k:
+        nz = nz[np.argpartition(-np.abs(values[nz]), k - 1)[:k]]
+    return nz[np.argsort(-np.abs(values[nz]))]
+
+
+def _share(score: float, total: float) -> float:
+    return score / total if total else 0.0
+
+
+def _meta_row(meta: Dict[str, Any], score: float, total: float) -> Dict[str, Any]:
+    return {
+        "name": meta.get("name", "-"),
+        "location": meta.get("location", ""),
+        "categories": " | ".join(meta.get("categories", []) or []),
+        "database": meta.get("database", ""),
+        "score": float(score),
+        "share": _share(score, total),
+    }
+
+
+def analizza_contributi(res: Dict[str, Any], top_k: int = 10) -> Dict[str, Dict[str, Any]]:
+    """
+    Scompone ogni punteggio per:
+    - exchange del processo foreground (colonne di supply per exchange già risolte con l'LCIA);
+    - processo di background (impatto diretto caratterizzato × supply) + emissioni dirette del foreground;
+    - flusso elementare (contributi caratterizzati già calcolati da characterize_inventory).
+    Ritorna {metodo: {"total", "exchanges", "processes", "flows"}} con liste di righe ordinate per |score|.
+    """
+    methods = [tuple(m) for m in res.get("methods", [])]
+    if not methods:
+        return {}
+    bg = res["background"]
+    stack = stacked_characterization(tuple(methods))
+
+    # Per exchange foreground: punteggi calcolati dalla solve dell'LCIA (un termine noto per prodotto domandato)
+    by_exchange = res.get("by_exchange", [])
+    targets = resolve_activities(e["input"] for e in by_exchange) if by_exchange else {}
+    ex_metas = [targets.get(e["input"], {"name": str(e["input"])}) for e in by_exchange]
+    ex_scores = np.array([e["scores"] for e in by_exchange]).reshape(len(by_exchange), len(methods))
+
+    # Per processo di background: (C · B)[m, j] * supply[j]
+    H = (project_stack(stack, bg.biosphere_ids) @ bg.biosphere).tocsr()
+    P = H.multiply(np.asarray(res["supply"]).ravel()[np.newaxis, :]).tocsr()
+    col_ids = np.empty(bg.technosphere.shape[1], dtype=np.int64)
+    for activity_id, col in bg.activity_index.items():
+        col_ids[col] = activity_id
+    b_f = res["column"]["b_f"]
+    direct = (
+        project_stack(stack, list(b_f)) @ (np.array(list(b_f.values()), dtype=np.float64) * res["x_f"])
+        if b_f else np.zeros(len(methods))
+    )
+
+    contributions = res["contributions"]
+    flow_ids = np.asarray(res["flow_ids"])
+
+    selected = []
+    for i in range(len(methods)):
+        proc_row = np.asarray(P.getrow(i).todense()).ravel()
+        flow_row = np.asarray(contributions.getrow(i).todense()).ravel()
+        selected.append((_top_k(proc_row, top_k), proc_row, _top_k(flow_row, top_k), flow_row))
+    metas = resolve_activity_ids(
+        [int(col_ids[j]) for p, _, _, _ in selected for j in p] + [int(flow_ids[j]) for _, _, f, _ in selected for j in f]
+    )
+
+    out: Dict[str, Dict[str, Any]] = {}
+    for i, m in enumerate(methods):
+        total = float(res["scores"][i])
+        proc_idx, proc_row, flow_idx, flow_row = selected[i]
+        exchanges: List[Dict[str, Any]] = [
+            {**_meta_row(meta, ex_scores[j, i], total), "type": e["type"], "amount": e["amount"]}
+            for j, (e, meta) in enumerate(zip(by_exchange, ex_metas))
+        ]
+        exchanges.sort(key=lambda r: -abs(r["score"]))
+        processes = [_meta_row(metas.get(int(col_ids[j]), {}), proc_row[j], total) for j in proc_idx]
+        if direct[i]:
+            processes.append({"name": FOREGROUND_DIRECT, "location": "", "categories": "", "database": "",
+                              "score": float(direct[i]), "share": _share(float(direct[i]), total)})
+            processes.sort(key=lambda r: -abs(r["score"]))
+        flows = [_meta_row(metas.get(int(flow_ids[j]), {}), flow_row[j], total) for j in flow_idx]
+        out[str(m)] = {"total": total, "exchanges": exchanges, "processes": processes[:top_k], "flows": flows}
+    return out
@@ -1,14 +1,21 @@
 # core/database_management.py
 
 import streamlit as st
-import bw2data as bd
-import bw2io as bi
+
+from core.impact_atlas import costruisci_atlante, riepilogo_atlante
+from core.method_catalog import cerca_metodi
+from core.ecospold_import import importa_ecoinvent, importa_ecospold_locale
+from core.jobs import DONE, ERROR, CANCELLED, cancel_job, get_job
+from core.project_workers import esegui_nel_progetto, job_nel_progetto, metadati_progetto
 
 def gestione_database_brightway():
     """Visualizza i database presenti e permette di importare Ecoinvent via credenziali."""
 
+    # Import, atlante e metadati girano nel worker del progetto della sessione
+    progetto = st.session_state['progetto']
+    metadati = metadati_progetto(progetto)
     st.markdown("### LCA databases available in the current project")
-    db_list = list(bd.databases)
+    db_list = list(metadati["databases"])
     if db_list:
         st.write("Imported databases:")
         for db in db_list:
@@ -31,12 +38,95 @@ def gestione_database_brightway():
         if st.button("Import Ecoinvent database"):
             try:
                 with st.spinner("Importing database, this could take several minutes..."):
-                    bi.import_ecoinvent_release(
-                        version=eco_version,
-                        system_model=eco_model,
-                        username=eco_user,
-                        password=eco_pass
-                    )
+                    esegui_nel_progetto(progetto, importa_ecoinvent, eco_version, eco_model, eco_user, eco_pass)
                 st.success("Database Ecoinvent successfully imported!")
             except Exception as e:
                 st.error(f"Importing error: {e}")
+
+    st.markdown("### Import local ecospold2 database (offline)")
+
+    with st.expander("Import from a local folder or archive"):
+        spold_path = st.text_input(
+            "Folder or archive on the server (zip, tar, 7z)", key="spold_path",
+            placeholder="e.g. D:/data/ecoinvent 3.10_cutoff_ecoSpold02.7z",
+        )
+        spold_db = st.text_input("New database name", key="spold_db")
+        bio_options = ["(default)"] + db_list
+        spold_bio = st.selectbox("Biosphere database", bio_options, key="spold_bio")
+        job = get_job(st.session_state.get('import_job'))
+        if st.button("Import ecospold2", disabled=bool(job and job.active) or not (spold_path and spold_db)):
+            # Progetto fissato all'invio: l'import gira nel worker legato a quel progetto
+            st.session_state['import_job'] = job_nel_progetto(
+                "import",
+                progetto,
+                importa_ecospold_locale,
+                spold_path,
+                spold_db,
+                None if spold_bio == "(default)" else spold_bio,
+            )
+        _mostra_job_import()
+
+    st.markdown("### Unit-impact atlas")
+
+    with st.expander("Build unit-impact atlas (impact preview in activity search)"):
+        if not db_list:
+            st.info("Import a database first.")
+            return
+        atlas_db = st.selectbox("Background database", db_list, key="atlas_db")
+        default_methods = [tuple(c) for c in st.session_state.get('lcia_selection_payload', {}).get('categories', [])]
+        atlas_methods = st.multiselect(
+            "LCIA methods (the first one is shown in the search preview)",
+            options=cerca_metodi("", catalog=metadati["methods"]),
+            default=[m for m in default_methods if m in metadati["methods"]["units"]],
+            format_func=lambda m: " | ".join(map(str, m)),
+            key="atlas_methods",
+        )
+        existing = esegui_nel_progetto(progetto, riepilogo_atlante, atlas_db)
+        if existing is not None:
+            st.caption(
+                f"Current atlas: {existing['shape'][0]} activities × {existing['shape'][1]} methods."
+            )
+        job = get_job(st.session_state.get('atlas_job'))
+        if st.button("Build atlas", disabled=not atlas_methods or bool(job and job.active)):
+            st.session_state['atlas_job'] = job_nel_progetto(
+                "atlas", progetto, costruisci_atlante, atlas_db, list(atlas_methods), solver=True,
+            )
+        _mostra_job_atlante()
+
+
+def _stato_job_import():
+    job = get_job(st.session_state.get('import_job'))
+    if job is None:
+        return
+    if job.active:
+        st.progress(job.progress, text=job.message or "Importing...")
+        if st.button("Cancel import", key="cancel_import"):
+            cancel_job(job.id)
+    elif job.status == DONE:
+        st.success(f"Database imported: {job.result['datasets']} datasets, {job.result['exchanges']} exchanges.")
+    elif job.status == ERROR:
+        st.error(f"Importing error: {job.error}")
+    elif job.status == CANCELLED:
+        st.info("Import cancelled.")
+
+
+def _stato_job_atlante():
+    job = get_job(st.session_state.get('atlas_job'))
+    if job is None:
+        return
+    if job.active:
+        st.progress(job.progress, text=job.message or "Solving unit impacts...")
+        if st.button("Cancel atlas build", key="cancel_atlas"):
+            cancel_job(job.id)
+    elif job.status == DONE:
+        st.success("Atlas built.")
+    elif job.status == ERROR:
+        st.error(f"Atlas error: {job.error}")
+    elif job.status == CANCELLED:
+        st.info("Atlas build cancelled.")
+
+
+# Aggiornamento periodico del solo riquadro di stato (senza bloccare il resto della pagina), se disponibile
+_fragment = getattr(st, "fragment", None)
+_mostra_job_import = _fragment(run_every=1.0)(_stato_job_import) if _fragment else _stato_job_import
+_mostra_job_atlante = _fragment(run_every=1.0)(_stato_job_atlante) if _fragment else _stato_job_atlante
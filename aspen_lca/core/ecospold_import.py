@@ -0,0 +1,144 @@
+# core/ecospold_import.py
+
+from __future__ import annotations
+
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import zipfile
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional
+
+import bw2data as bd
+import bw2io as bi
+
+from core.cache import invalidate_database
+from core.jobs import check_cancelled
+
+# Import offline di un database ecospold2 da una cartella locale o da un archivio (zip, tar.*, 7z).
+# Il parsing dei dataset usa il pool di processi di bw2io (use_mp=True), le strategie sono applicate in
+# blocco sull'intera lista di dataset e la scrittura usa l'inserimento in blocco del backend SQLite.
+
+_ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz", ".7z")
+
+
+def _is_archive(path: Path) -> bool:
+    name = path.name.lower()
+    return path.is_file() and name.endswith(_ARCHIVE_SUFFIXES)
+
+
+def _check_members(names: Iterable[str], target: Path) -> None:
+    """Rifiuta membri dell'archivio che verrebbero scritti fuori dalla cartella di destinazione."""
+    root = target.resolve()
+    for member in names:
+        dest = (root / member).resolve()
+        if dest != root and root not in dest.parents:
+            raise ValueError(f"Archive member '{member}' would be extracted outside the target folder.")
+
+
+def _extract(archive: Path, target: Path) -> None:
+    name = archive.name.lower()
+    if name.endswith(".zip"):
+        with zipfile.ZipFile(archive) as zf:
+            _check_members(zf.namelist(), target)
+            zf.extractall(target)
+    elif name.endswith(".7z"):
+        try:
+            import py7zr
+        except ImportError as e:
+            raise ImportError("Reading .7z archives requires the optional package 'py7zr' (pip install py7zr).") from e
+        with py7zr.SevenZipFile(archive, mode="r") as zf:
+            _check_members(zf.getnames(), target)
+            zf.extractall(path=target)
+    else:
+        with tarfile.open(archive) as tf:
+            if hasattr(tarfile, "data_filter"):
+                # Filtro "data": niente path assoluti, traversal, link esterni o file speciali
+                tf.extractall(target, filter="data")
+            else:
+                _check_members(tf.getnames(), target)
+                members = [m for m in tf.getmembers() if m.isfile() or m.isdir()]
+                tf.extractall(target, members=members)
+
+
+def trova_cartella_dataset(root: Path) -> Path:
+    """Cartella con i file .spold: 'datasets' delle release ecoinvent, altrimenti la prima che ne contiene."""
+    for candidate in [root / "datasets", *sorted(p for p in root.rglob("datasets") if p.is_dir())]:
+        if candidate.is_dir() and any(candidate.glob("*.spold")):
+            return candidate
+    if any(root.glob("*.spold")):
+        return root
+    for folder in sorted(p for p in root.rglob("*") if p.is_dir()):
+        if any(folder.glob("*.spold")):
+            return folder
+    raise FileNotFoundError(f"No .spold datasets found in {root}.")
+
+
+def importa_ecospold_locale(
+    source: str,
+    db_name: str,
+    biosphere_db: Optional[str] = None,
+    progress: Optional[Callable[[float, str], None]] = None,
+    cancel: Optional[threading.Event] = None,
+) -> Dict[str, int]:
+    """
+    Importa un database ecospold2 da cartella o archivio locale. Pensata per girare come job (core.jobs)
+    nel worker del progetto di destinazione (core.project_workers), così la scrittura finale non dipende dal
+    progetto attivo nel processo Streamlit: avanzamento per fase e annullamento tra una fase e l'altra.
+    Ritorna {"datasets", "exchanges"}.
+    """
+    progress = progress or (lambda fraction, message="": None)
+    path = Path(source).expanduser()
+    if not path.exists():
+        raise FileNotFoundError(f"Path not found: {path}")
+    if db_name in bd.databases:
+        raise ValueError(f"Database '{db_name}' already exists in project '{bd.projects.current}'.")
+
+    workdir = None
+    try:
+        if _is_archive(path):
+            progress(0.02, "Extracting archive")
+            workdir = Path(tempfile.mkdtemp(prefix="aspen_ecospold_"))
+            _extract(path, workdir)
+            path = workdir
+        datasets = trova_cartella_dataset(path)
+        check_cancelled(cancel)
+
+        progress(0.1, f"Parsing datasets in parallel ({os.cpu_count() or 1} processes)")
+        kwargs = {"use_mp": True}
+        if biosphere_db:
+            kwargs["biosphere_database_name"] = biosphere_db
+        importer = bi.SingleOutputEcospold2Importer(str(datasets), db_name, **kwargs)
+        check_cancelled(cancel)
+
+        progress(0.55, "Applying strategies")
+        importer.apply_strategies()
+        check_cancelled(cancel)
+
+        progress(0.75, "Checking links")
+        _, _, unlinked = importer.statistics(print_stats=False)
+        if unlinked:
+            raise ValueError(
+                f"{unlinked} unlinked exchanges: check that the biosphere database matches the ecospold2 release."
+            )
+        check_cancelled(cancel)
+
+        progress(0.8, "Writing database")
+        importer.write_database()
+        invalidate_database(db_name)
+        progress(1.0, "Import completed")
+        return {
+            "datasets": len(importer.data),
+            "exchanges": sum(len(ds.get("exchanges", [])) for ds in importer.data),
+        }
+    finally:
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def importa_ecoinvent(version: str, system_model: str, username: str, password: str) -> None:
+    """Import di un rilascio ecoinvent con credenziali, nel worker del progetto di destinazione."""
+    bi.import_ecoinvent_release(version=version, system_model=system_model, username=username, password=password)
+    invalidate_database()
@@ -0,0 +1,51 @@
+# core/exploratory_lcia.py
+
+from __future__ import annotations
+
+from typing import Any, Dict
+
+from core.inventory_builder import MappingType, compile_exchanges
+from core.lcia_runner import _as_method_tuples, cached_lcia_scores, lcia_from_exchanges
+
+# Chiave fittizia del processo foreground in memoria (mai scritto su SQLite)
+IN_MEMORY_DATABASE = "__aspen_in_memory__"
+
+
+def run_lcia_in_memory_detailed(
+    df_lci,
+    mapping: MappingType,
+    lcia_selection: Dict[str, Any],
+    progress=None,
+    cancel=None,
+    use_store: bool = True,
+) -> Dict[str, Any]:
+    """
+    Come run_lcia_in_memory, ma ritorna il risultato completo di lcia_from_exchanges (per i contributi);
+    con use_store=True i punteggi già salvati per lo stesso inventario vengono letti senza risolvere.
+    """
+    methods = _as_method_tuples(lcia_selection)
+    if not methods:
+        return {"results": {}}
+
+    process_key = (IN_MEMORY_DATABASE, "foreground")
+    compiled = compile_exchanges(df_lci, mapping, process_key)
+    return lcia_from_exchanges(
+        compiled["exchanges"], process_key, methods, targets=compiled["targets"], progress=progress, cancel=cancel,
+        use_store=use_store,
+    )
+
+
+def run_lcia_in_memory(df_lci, mapping: MappingType, lcia_selection: Dict[str, Any]) -> Dict[str, float]:
+    """
+    LCIA esplorativa: come run_lcia ma il processo foreground non viene mai salvato né processato.
+    La colonna foreground in memoria è risolta contro la fattorizzazione di background in cache.
+    Le categorie già calcolate per lo stesso inventario vengono lette dall'archivio persistente.
+    Ritorna dict {method_tuple: score}.
+    """
+    methods = _as_method_tuples(lcia_selection)
+    if not methods:
+        return {}
+
+    process_key = (IN_MEMORY_DATABASE, "foreground")
+    compiled = compile_exchanges(df_lci, mapping, process_key)
+    return cached_lcia_scores(compiled["exchanges"], process_key, methods, targets=compiled["targets"])
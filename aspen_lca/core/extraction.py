@@ -2,7 +2,12 @@
 
 import pythoncom
 
-def estrai_flussi(tmp_path, st):
+def estrai_flussi(tmp_path, st, topologia=None):
+    """
+    Estrae utilities e stream di confine dal file Aspen.
+    Se `topologia` è un dict viene popolato con la struttura del flowsheet:
+    {"blocks": [...], "internal_streams": [{name, value, unit, source, destination}], "utility_blocks": {utility: block}}.
+    """
     import win32com.client as win32
     import time
 
@@ -104,6 +109,7 @@ def estrai_flussi(tmp_path, st):
         ##################
         minputs = []
         moutputs = []
+        internal_streams = []
         streams_node = aspen.Tree.FindNode('\\Data\\Streams')
 
         def is_empty(val):
@@ -145,13 +151,40 @@ def estrai_flussi(tmp_path, st):
                     d = {
                         'name': stream_name,
                         'value': float(mass_flow) if mass_flow else 0.0,
-                        'unit': 'kg/s'
+                        'unit': 'kg/s',
+                        'source': None if is_empty(source) else str(source).strip(),
+                        'destination': None if is_empty(destination) else str(destination).strip(),
                     }
 
                     if is_empty(source) and not is_empty(destination):
                         minputs.append(d)
                     elif not is_empty(source) and is_empty(destination):
                         moutputs.append(d)
+                    elif not is_empty(source) and not is_empty(destination):
+                        internal_streams.append(d)
+
+        ##################
+        # Topologia (blocchi e utilities per blocco), solo se richiesta
+        ##################
+        if topologia is not None:
+            blocks = []
+            utility_blocks = {}
+            blocks_node = aspen.Tree.FindNode('\\Data\\Blocks')
+            if blocks_node:
+                for i in range(blocks_node.Elements.Count):
+                    block = blocks_node.Elements(i)
+                    if block is None or not hasattr(block, 'Name'):
+                        continue
+                    blocks.append(block.Name)
+                    try:
+                        util_node = aspen.Tree.FindNode(f'\\Data\\Blocks\\{block.Name}\\Input\\UTILITY_ID')
+                        if util_node is not None and not is_empty(util_node.Value):
+                            utility_blocks[str(util_node.Value).strip()] = block.Name
+                    except Exception:
+                        pass
+            topologia["blocks"] = blocks
+            topologia["internal_streams"] = internal_streams
+            topologia["utility_blocks"] = utility_blocks
 
         return energy_flows, minputs, moutputs, None
 
@@ -0,0 +1,295 @@
+# core/foreground_network.py
+
+from __future__ import annotations
+
+import hashlib
+import threading
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.linalg import spsolve
+import bw2data as bd
+from bw2data.backends import Activity, ActivityDataset, sqlite3_lci_db
+
+from core.activity_lookup import resolve_activities
+from core.background import background_databases, background_system, foreground_column, stored_exchanges_many
+from core.cache import invalidate_database
+from core.characterization import project_stack, stacked_characterization
+from core.inventory_builder import (
+    MappingType,
+    _exchange,
+    _process_attributes,
+    _reference_flow_name,
+    compile_exchanges,
+    ensure_database,
+    prefetch_targets,
+    stable_process_code,
+    sync_process_bulk,
+)
+from core.jobs import check_cancelled
+from core.lcia_runner import _as_method_tuples, run_lcia_detailed
+
+# Modello foreground multi-blocco: un processo Brightway per blocco Aspen, gli stream interni
+# diventano link di tecnosfera tra blocchi. Ogni blocco produce il proprio "outlet" (kg, somma delle
+# portate uscenti per unità di reference flow): per bilancio di massa ogni blocco ha supply = 1 e il
+# risultato totale coincide con quello del processo unico di build_inventory.
+
+UNASSIGNED = "(unassigned)"
+
+
+def assegna_blocchi(
+    energy_flows: Iterable[Dict[str, Any]],
+    material_inputs: Iterable[Dict[str, Any]],
+    material_outputs: Iterable[Dict[str, Any]],
+    topologia: Dict[str, Any],
+) -> Dict[str, str]:
+    """{Flow: blocco}: input -> blocco di destinazione, output -> blocco sorgente, utility -> blocco che la usa."""
+    utility_blocks = (topologia or {}).get("utility_blocks", {})
+    out: Dict[str, str] = {}
+    for f in energy_flows:
+        if f["name"] in utility_blocks:
+            out[f["name"]] = utility_blocks[f["name"]]
+    for f in material_inputs:
+        if f.get("destination"):
+            out[f["name"]] = f["destination"]
+    for f in material_outputs:
+        if f.get("source"):
+            out[f["name"]] = f["source"]
+    return out
+
+
+def _block_code(top_code: str, block: str) -> str:
+    return f"{top_code}-blk-{hashlib.sha1(block.encode('utf-8')).hexdigest()[:12]}"
+
+
+def _block_balances(df_lci, flow_blocks: Dict[str, str], internal_streams: List[Dict[str, Any]], reference_value: float):
+    """Portate uscenti per blocco (outlet) e link interni normalizzati per unità di reference flow."""
+    outlet: Dict[str, float] = defaultdict(float)
+    internal_out: Dict[str, float] = defaultdict(float)
+    links: Dict[Tuple[str, str], float] = defaultdict(float)
+    for s in internal_streams:
+        amount = abs(float(s.get("value") or 0.0)) / reference_value
+        if amount <= 0.0:
+            continue
+        links[(s["source"], s["destination"])] += amount
+        outlet[s["source"]] += amount
+        internal_out[s["source"]] += amount
+    outputs = df_lci[(df_lci["Direction"] == "output") & (df_lci["Category"] == "material")]
+    for flow, amount in zip(outputs["Flow"], outputs["Amount_float"]):
+        block = flow_blocks.get(flow)
+        if block:
+            outlet[block] += abs(float(amount))
+    return outlet, internal_out, links
+
+
+def build_foreground_network(
+    df_lci,
+    mapping: MappingType,
+    target_db: str,
+    process_meta: Dict[str, Any],
+    topologia: Dict[str, Any],
+    flow_blocks: Dict[str, str],
+    reference_value: float,
+) -> Dict[str, Any]:
+    """
+    Costruisce (o aggiorna in modo incrementale) la sotto-rete foreground: un processo per blocco
+    più il processo di flowsheet che produce il reference flow e consuma gli outlet di confine dei blocchi.
+    Tutte le scritture avvengono in un'unica transazione con diff per nodo; processing una sola volta.
+    """
+    if not reference_value:
+        raise ValueError("Reference Flow value is 0. Normalization is not possible.")
+    db = ensure_database(target_db)
+
+    reference_product = process_meta.get("reference_product")
+    top_code = process_meta.get("code") or stable_process_code(
+        f"{process_meta.get('flowsheet') or ''}#blocks", _reference_flow_name(df_lci, reference_product)
+    )
+    top_attrs = _process_attributes(
+        db, process_meta.get("name"), process_meta.get("location", "GLO"), process_meta.get("unit"),
+        reference_product, top_code, True, process_meta.get("extra", {}),
+    )
+    top_key = (db.name, top_code)
+
+    internal_streams = [s for s in (topologia or {}).get("internal_streams", []) if s.get("source") and s.get("destination")]
+    blocks = sorted(set((topologia or {}).get("blocks", [])) | set(flow_blocks.values())
+                    | {s["source"] for s in internal_streams} | {s["destination"] for s in internal_streams})
+    block_keys = {b: (db.name, _block_code(top_code, b)) for b in blocks}
+    outlet, internal_out, links = _block_balances(df_lci, flow_blocks, internal_streams, reference_value)
+
+    # Righe LCI per blocco (il Reference Flow resta sempre sul processo di flowsheet)
+    row_block = df_lci["Flow"].map(lambda f: flow_blocks.get(f) if flow_blocks.get(f) in block_keys else None)
+    is_ref = df_lci["Type"] == "Reference Flow"
+
+    nodes: List[Tuple[Dict[str, Any], list]] = []
+    warnings: List[str] = []
+    created_edges = 0
+    # Una sola query di metadati per tutta la mappatura, condivisa dai processi di blocco e di flowsheet
+    targets = prefetch_targets(mapping)
+
+    for b in blocks:
+        key = block_keys[b]
+        compiled = compile_exchanges(df_lci[(row_block == b) & ~is_ref], mapping, key, fallback_production=False, targets=targets)
+        exchanges = compiled["exchanges"]
+        exchanges.append(_exchange("production", key, outlet[b] if outlet[b] > 0 else 1.0))
+        for (src, dst), amount in links.items():
+            if dst == b:
+                exchanges.append(_exchange("technosphere", block_keys[src], amount))
+        attrs = _process_attributes(
+            db, f"{top_attrs['name']} — block {b}", top_attrs["location"], "kilogram", f"{b} outlet", key[1], True,
+            {"aspen_block": b, "aspen_flowsheet_process": top_code},
+        )
+        nodes.append((attrs, exchanges))
+        created_edges += len(exchanges)
+        warnings.extend(compiled["warnings"])
+
+    compiled = compile_exchanges(df_lci[row_block.isna() | is_ref], mapping, top_key, targets=targets)
+    top_exchanges = compiled["exchanges"]
+    for b in blocks:
+        # Consumo degli outlet di confine del blocco: per bilancio di massa porta la supply del blocco a 1
+        boundary = outlet[b] - internal_out[b] if outlet[b] > 0 else 1.0
+        if boundary > 0:
+            top_exchanges.append(_exchange("technosphere", block_keys[b], boundary))
+    nodes.append((top_attrs, top_exchanges))
+    created_edges += len(top_exchanges)
+    warnings.extend(compiled["warnings"])
+
+    diffs = {"inserted": 0, "updated": 0, "deleted": 0, "unchanged": 0}
+    changed = False
+    with sqlite3_lci_db.transaction():
+        for attrs, exchanges in nodes:
+            _, diff = sync_process_bulk(db, attrs, exchanges)
+            changed |= diff["changed"]
+            for k in diffs:
+                diffs[k] += diff[k]
+        # Blocchi non più presenti nel flowsheet: rimuovi nodi ed edges in blocco
+        removed = _delete_stale_blocks(db.name, top_code, {k[1] for k in block_keys.values()})
+        changed |= removed > 0
+    if changed:
+        bd.databases.set_dirty(db.name)
+        db.process()
+        invalidate_database(target_db)
+
+    return {
+        "database": target_db,
+        "process": top_key,
+        "blocks": {b: block_keys[b] for b in blocks},
+        "report": {"created_edges": created_edges, **diffs, "warnings": [w for w in warnings if w]},
+    }
+
+
+def _delete_stale_blocks(db_name: str, top_code: str, keep_codes: set) -> int:
+    # Percorso di cancellazione di bw2data (exchanges in entrata e in uscita, indice di ricerca, segnali),
+    # dentro la transazione del chiamante
+    prefix = f"{top_code}-blk-"
+    stale = [
+        row for row in ActivityDataset.select().where(
+            (ActivityDataset.database == db_name) & ActivityDataset.code.startswith(prefix)
+        ) if row.code not in keep_codes
+    ]
+    for row in stale:
+        Activity(row).delete()
+    return len(stale)
+
+
+def block_hotspots(network: Dict[str, Any], lcia_selection: Dict[str, Any]) -> Dict[str, Dict[str, float]]:
+    """
+    Hotspot per blocco: impatti diretti del blocco + catene di background dei suoi input esterni,
+    esclusi i link interni (che appartengono agli altri blocchi). Somma sui blocchi = punteggio totale.
+    Il sistema foreground (blocchi + flowsheet) è risolto come sistema sparso a parte; le catene di background
+    di tutti i blocchi riusano la fattorizzazione in cache (background_system) con più termini noti.
+    Ritorna {blocco: {metodo: score}}.
+    """
+    methods = _as_method_tuples(lcia_selection)
+    if not methods:
+        return {}
+
+    top_key = tuple(network["process"])
+    labels = {b: tuple(k) for b, k in network["blocks"].items()}
+    labels[UNASSIGNED] = top_key
+    order = list(labels)
+    fg_index = {labels[b]: j for j, b in enumerate(order)}
+    stored = stored_exchanges_many(top_key[0], [k[1] for k in fg_index])
+
+    external = {
+        tuple(ex["input"]) for exs in stored.values() for ex in exs if tuple(ex["input"]) not in fg_index
+    }
+    targets = resolve_activities(external)
+    bg = background_system(tuple(background_databases({k[0] for k in external}, exclude={top_key[0]})))
+
+    # Sistema foreground sparso (solo blocchi + flowsheet) e colonne esterne (background e biosfera) per blocco
+    negative = set(bd.labels.technosphere_negative_edge_types)
+    n = len(order)
+    ff_rows, ff_cols, ff_data = [], [], []
+    columns = []
+    for j, b in enumerate(order):
+        key = labels[b]
+        exchanges = stored.get(key, [])
+        for ex in exchanges:
+            i = fg_index.get(tuple(ex["input"]))
+            if i is not None and i != j:
+                ff_rows.append(i)
+                ff_cols.append(j)
+                ff_data.append(-ex["amount"] if ex["type"] in negative else ex["amount"])
+        column = foreground_column(
+            [ex for ex in exchanges if tuple(ex["input"]) not in fg_index or tuple(ex["input"]) == key], key, bg, targets
+        )
+        ff_rows.append(j)
+        ff_cols.append(j)
+        ff_data.append(column["a_ff"])
+        columns.append(column)
+    A_ff = sp.csc_matrix((ff_data, (ff_rows, ff_cols)), shape=(n, n))
+    rhs = np.zeros(n)
+    rhs[fg_index[top_key]] = 1.0
+    x_f = np.atleast_1d(spsolve(A_ff, rhs))
+
+    # Termini noti di background sparsi (input esterni di ciascun blocco scalati per la sua supply), densi solo nella solve
+    nz = [np.flatnonzero(c["a_bf"]) for c in columns]
+    D = sp.csc_matrix(
+        (
+            np.concatenate([-c["a_bf"][r] * x for c, r, x in zip(columns, nz, x_f)]),
+            (np.concatenate(nz), np.repeat(np.arange(n), [len(r) for r in nz])),
+        ),
+        shape=(bg.technosphere.shape[0], n),
+    )
+    stack = stacked_characterization(tuple(methods))
+    if bg.lu is None:
+        # Nessun input di tecnosfera esterno (solo biosfera e link tra blocchi): nessuna catena di background
+        scores = np.zeros((len(methods), n))
+    else:
+        X = bg.solve(D.toarray())
+        scores = np.asarray(project_stack(stack, bg.biosphere_ids) @ (bg.biosphere @ X))
+
+    # Impatti diretti: flussi di biosfera dei blocchi × supply
+    direct_ids = sorted({f for c in columns for f in c["b_f"]})
+    if direct_ids:
+        pos = {f: i for i, f in enumerate(direct_ids)}
+        d_rows, d_cols, d_data = [], [], []
+        for j, (c, x) in enumerate(zip(columns, x_f)):
+            for f, amount in c["b_f"].items():
+                d_rows.append(pos[f])
+                d_cols.append(j)
+                d_data.append(amount * x)
+        direct = sp.csc_matrix((d_data, (d_rows, d_cols)), shape=(len(direct_ids), n))
+        scores = scores + np.asarray((project_stack(stack, direct_ids) @ direct).todense())
+    return {b: {str(m): float(scores[i, j]) for i, m in enumerate(methods)} for j, b in enumerate(order)}
+
+
+def run_lcia_blocks(
+    process_node,
+    lcia_selection: Dict[str, Any],
+    network: Optional[Dict[str, Any]] = None,
+    progress: Optional[Callable[[float, str], None]] = None,
+    cancel: Optional[threading.Event] = None,
+    use_store: bool = True,
+) -> Dict[str, Any]:
+    """
+    run_lcia_detailed più, se c'è una rete multi-blocco, gli hotspot per blocco ("block_hotspots") nello
+    stesso job: entrambi nel worker del progetto, senza calcoli sincroni nello script Streamlit.
+    """
+    res = run_lcia_detailed(process_node, lcia_selection, progress=progress, cancel=cancel, use_store=use_store)
+    if network and res.get("results"):
+        check_cancelled(cancel)
+        res["block_hotspots"] = block_hotspots(network, lcia_selection)
+    return res
@@ -0,0 +1,186 @@
+# core/impact_atlas.py
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import bw2data as bd
+
+from core.background import background_databases, background_system
+from core.cache import cached_by_fingerprint, method_fingerprint
+from core.characterization import project_stack, stacked_characterization
+from core.jobs import check_cancelled
+
+# Atlante degli impatti unitari: per ogni attività di un database di background, il punteggio per unità
+# di prodotto su un insieme di metodi. Calcolato una volta (A^T z_m = B^T c_m, un termine noto per metodo
+# contro la stessa fattorizzazione) e salvato su disco come matrice float32 memory-mapped
+# (righe = prodotti, colonne = metodi) con indici di attività e metodi accanto.
+
+ATLAS_DIRNAME = "aspen_atlas"
+# Metodi risolti per ogni chiamata a lu.solve (limita la memoria dei termini noti densi)
+_SOLVE_CHUNK = 16
+
+
+def _atlas_root(db_name: str) -> Path:
+    safe = "".join(c if c.isalnum() or c in "-_." else "_" for c in db_name)
+    return Path(bd.projects.dir) / ATLAS_DIRNAME / safe
+
+
+def _stored_fingerprint(db_name: str, methods: Iterable[Tuple]) -> List[Any]:
+    """Impronta persistente (senza generazione locale): 'modified' dei database di background e dei metodi."""
+    dbs = background_databases([db_name])
+    return (
+        [[d, bd.databases[d].get("modified")] for d in dbs]
+        + [[list(m), fp[2], fp[3]] for m, fp in ((tuple(m), method_fingerprint(m)) for m in methods)]
+    )
+
+
+def atlas_key(db_name: str, methods: Iterable[Tuple]) -> str:
+    payload = json.dumps([bd.projects.current, db_name, _stored_fingerprint(db_name, methods)], default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def costruisci_atlante(
+    db_name: str,
+    methods: List[Tuple],
+    progress: Optional[Callable[[float, str], None]] = None,
+    cancel: Optional[threading.Event] = None,
+) -> Path:
+    """
+    Calcola l'atlante di db_name per i metodi dati e lo salva su disco. Ritorna la cartella dell'atlante.
+    Sistema trasposto: z_m = A^-T B^T c_m, cioè il punteggio per unità di ogni prodotto per il metodo m.
+    Pensata per girare come job (core.jobs): avanzamento e annullamento per blocco di metodi.
+    """
+    progress = progress or (lambda fraction, message="": None)
+    methods = [tuple(m) for m in methods]
+    if not methods:
+        raise ValueError("Select at least one LCIA method to build the atlas.")
+    progress(0.0, "Loading background system")
+    databases = tuple(background_databases([db_name]))
+    bg = background_system(databases)
+    stack = stacked_characterization(tuple(methods))
+    C_bg = project_stack(stack, bg.biosphere_ids)
+    rhs_all = (bg.biosphere.T @ C_bg.T).tocsc()  # n_prodotti × n_metodi
+
+    folder = _atlas_root(db_name) / atlas_key(db_name, methods)
+    folder.mkdir(parents=True, exist_ok=True)
+    n_products = bg.technosphere.shape[0]
+    scores = np.lib.format.open_memmap(
+        folder / "scores.tmp.npy", mode="w+", dtype=np.float32, shape=(n_products, len(methods))
+    )
+    completed = False
+    try:
+        for start in range(0, len(methods), _SOLVE_CHUNK):
+            check_cancelled(cancel)
+            stop = min(start + _SOLVE_CHUNK, len(methods))
+            scores[:, start:stop] = bg.solve(rhs_all[:, start:stop].toarray(), trans="T").reshape(n_products, -1)
+            progress(0.05 + 0.9 * stop / len(methods), f"Solved unit impacts for {stop}/{len(methods)} methods")
+        scores.flush()
+        completed = True
+    finally:
+        del scores
+        if not completed:
+            # Annullato o fallito: nessun file parziale accanto all'atlante valido
+            (folder / "scores.tmp.npy").unlink(missing_ok=True)
+
+    # Indice righe: id Brightway del prodotto di ogni riga, ordinati per lookup vettoriale
+    ids = np.empty(n_products, dtype=np.int64)
+    for product_id, row in bg.product_index.items():
+        ids[row] = product_id
+    np.save(folder / "ids.npy", ids)
+    os.replace(folder / "scores.tmp.npy", folder / "scores.npy")
+    index = {
+        "database": db_name,
+        "databases": list(databases),
+        "methods": [list(m) for m in methods],
+        "units": [bd.methods.get(m, {}).get("unit", "") for m in methods],
+        "fingerprint": _stored_fingerprint(db_name, methods),
+        "shape": [n_products, len(methods)],
+        "created": time.time(),
+    }
+    tmp = folder / "index.json.tmp"
+    tmp.write_text(json.dumps(index, default=str), encoding="utf-8")
+    os.replace(tmp, folder / "index.json")
+    return folder
+
+
+def _atlas_file_fingerprint(folder: str) -> Tuple:
+    path = Path(folder) / "index.json"
+    return (folder, path.stat().st_mtime if path.exists() else None)
+
+
+@cached_by_fingerprint(_atlas_file_fingerprint, max_entries=8)
+def _open_atlas(folder: str) -> Optional[Dict[str, Any]]:
+    path = Path(folder)
+    if not (path / "index.json").exists():
+        return None
+    index = json.loads((path / "index.json").read_text(encoding="utf-8"))
+    ids = np.load(path / "ids.npy")
+    order = np.argsort(ids)
+    return {
+        **index,
+        "methods": [tuple(m) for m in index["methods"]],
+        "path": str(path),
+        "scores": np.load(path / "scores.npy", mmap_mode="r"),
+        "sorted_ids": ids[order],
+        "sorted_rows": order,
+    }
+
+
+def carica_atlante(db_name: str, methods: Optional[List[Tuple]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Atlante valido (impronta corrente) per db_name: per i metodi dati oppure, se None, il più recente.
+    Ritorna None se non esiste o se il database/metodi sono cambiati dopo la costruzione.
+    """
+    if methods is not None:
+        return _open_atlas(str(_atlas_root(db_name) / atlas_key(db_name, methods)))
+    root = _atlas_root(db_name)
+    if not root.exists():
+        return None
+    candidates = sorted(
+        (p for p in root.iterdir() if (p / "index.json").exists()),
+        key=lambda p: (p / "index.json").stat().st_mtime,
+        reverse=True,
+    )
+    for folder in candidates:
+        atlas = _open_atlas(str(folder))
+        if atlas and folder.name == atlas_key(db_name, atlas["methods"]):
+            return atlas
+    return None
+
+
+def anteprima_impatti(atlas: Dict[str, Any], activity_ids: Iterable[int]) -> np.ndarray:
+    """Lookup vettoriale: punteggi per unità (len(ids) × n_metodi), NaN per le attività non presenti."""
+    ids = np.asarray(list(activity_ids), dtype=np.int64)
+    out = np.full((len(ids), len(atlas["methods"])), np.nan, dtype=np.float32)
+    sorted_ids = atlas["sorted_ids"]
+    if not len(ids) or not len(sorted_ids):
+        return out
+    pos = np.searchsorted(sorted_ids, ids)
+    pos_clipped = np.minimum(pos, len(sorted_ids) - 1)
+    found = sorted_ids[pos_clipped] == ids
+    out[found] = atlas["scores"][atlas["sorted_rows"][pos_clipped[found]], :]
+    return out
+
+
+def riepilogo_atlante(db_name: str, activity_ids: Iterable[int] = ()) -> Optional[Dict[str, Any]]:
+    """
+    Per l'interfaccia, eseguita nel worker del progetto: dimensioni, metodi e unità dell'atlante valido
+    di db_name e anteprima (primo metodo) per activity_ids. None se l'atlante non c'è o non è aggiornato.
+    """
+    atlas = carica_atlante(db_name)
+    if atlas is None:
+        return None
+    return {
+        "shape": atlas["shape"],
+        "methods": atlas["methods"],
+        "units": atlas["units"],
+        "preview": anteprima_impatti(atlas, activity_ids)[:, 0],
+    }
@@ -2,14 +2,24 @@
 
 from __future__ import annotations
 
-from typing import Dict, Tuple, Any, Optional, Union
+import hashlib
+import math
+from collections import OrderedDict
+from typing import Dict, Iterable, Tuple, Any, Optional, Union
 
 import bw2data as bd
+from bw2data.backends import ActivityDataset, ExchangeDataset, sqlite3_lci_db
+
+from core.activity_lookup import mapped_pairs, mapping_pair, production_sign_index, resolve_activities
+from core.cache import invalidate_database
 
 # Tipi utili: supporta sia vecchia tupla (db, code) sia nuovo dict con density
 MappingValue = Union[Tuple[str, str], Dict[str, Any]]
 MappingType = Dict[str, MappingValue]  # {Flow: (db, code)} oppure {Flow: {"database","code","unit","density"}}
 
+# Righe per statement INSERT nella scrittura bulk degli exchanges
+_BULK_BATCH = 500
+
 def ensure_database(db_name: str) -> bd.Database:
     """
     Crea o recupera un database Brightway per l'inventario custom.
@@ -19,21 +29,16 @@ def ensure_database(db_name: str) -> bd.Database:
         bd.Database(db_name).register()
     return bd.Database(db_name)
 
-def create_process_node(
+def _process_attributes(
     db: bd.Database,
     name: str,
     location: Optional[str],
     unit: str,
     reference_product: str,
-    code: Optional[str] = None,
-    chimaera: bool = True,
-    extra: Optional[dict] = None,
-):
-    """
-    Crea un nodo di processo; per default crea un nodo chimaera (process+reference product).
-    - chimaera True: type='processwithreferenceproduct', con unit e reference product
-    - chimaera False: type='process'
-    """
+    code: Optional[str],
+    chimaera: bool,
+    extra: Optional[dict],
+) -> Dict[str, Any]:
     attributes = {
         "name": name,
         "database": db.name,
@@ -52,53 +57,69 @@ def create_process_node(
     if extra:
         attributes.update(extra)
 
+    return attributes
+
+def create_process_node(
+    db: bd.Database,
+    name: str,
+    location: Optional[str],
+    unit: str,
+    reference_product: str,
+    code: Optional[str] = None,
+    chimaera: bool = True,
+    extra: Optional[dict] = None,
+):
+    """
+    Crea un nodo di processo; per default crea un nodo chimaera (process+reference product).
+    - chimaera True: type='processwithreferenceproduct', con unit e reference product
+    - chimaera False: type='process'
+    """
+    attributes = _process_attributes(db, name, location, unit, reference_product, code, chimaera, extra)
     node = db.new_node(**attributes)
     node.save()
     return node
 
-def _resolve_target_product(db_name: str, code: str):
-    """Risolve un prodotto/attività target via (database, code)."""
-    return bd.get_node(database=db_name, code=code)
+def prefetch_targets(mapping: MappingType) -> Dict[Tuple[str, str], Dict[str, Any]]:
+    """Metadati di tutti i target mappati, risolti con una sola query."""
+    return resolve_activities(mapped_pairs(mapping))
 
-def _add_technosphere_consumption_edge(process_node, target_node, amount: float):
-    e = process_node.new_edge(
-        type="technosphere",
-        amount=float(amount),
-        input=target_node,
-        output=process_node,
-    )
-    e.save()
-    return e
-
-def _add_technosphere_substitution_edge(process_node, target_node, amount: float):
-    e = process_node.new_edge(
-        type="substitution",
-        amount=float(amount),
-        input=target_node,
-        output=process_node,
-    )
-    e.save()
-    return e
-
-def _add_technosphere_production_edge(process_node, amount: float):
-    e = process_node.new_edge(
-        type="production",
-        amount=float(amount),
-        input=process_node,   # per chimaera, il proprio prodotto
-        output=process_node,
-    )
-    e.save()
-    return e
-
-def _add_biosphere_edge(process_node, biosphere_flow_node, amount: float):
-    e = process_node.new_edge(
-        type="biosphere",
-        amount=float(amount),
-        input=biosphere_flow_node,
-        output=process_node,
-    )
-    e.save()
-    return e
+def production_signs_for(keys: Iterable[Tuple[Optional[str], Optional[str]]]) -> Dict[Tuple[str, str], float]:
+    """Segni di produzione per le chiavi date, letti dagli indici (in cache) dei rispettivi database."""
+    keys = [(d, c) for d, c in keys if d and c]
+    indexes = {db_name: production_sign_index(db_name) for db_name in {d for d, _ in keys}}
+    return {(d, c): indexes[d].get(c, 0.0) for d, c in keys}
+
+def _exchange(edge_type: str, input_key: Tuple[str, str], amount: float) -> Dict[str, Any]:
+    """Specifica di un exchange del processo foreground (l'output è sempre il processo stesso)."""
+    return {"type": edge_type, "input": tuple(input_key), "amount": float(amount)}
+
+def _add_technosphere_consumption_edge(exchanges: list, target_key, amount: float):
+    exchanges.append(_exchange("technosphere", target_key, amount))
+
+def _add_technosphere_substitution_edge(exchanges: list, target_key, amount: float):
+    exchanges.append(_exchange("substitution", target_key, amount))
+
+def _add_technosphere_production_edge(exchanges: list, process_key, amount: float):
+    # per chimaera, il proprio prodotto
+    exchanges.append(_exchange("production", process_key, amount))
+
+def _add_biosphere_edge(exchanges: list, biosphere_key, amount: float):
+    exchanges.append(_exchange("biosphere", biosphere_key, amount))
+
+def write_process_bulk(db: bd.Database, attributes: Dict[str, Any], exchanges: list):
+    """
+    Scrive il nodo di processo e tutti i suoi exchanges in un'unica transazione SQLite
+    (insert_many sugli ExchangeDataset invece di un save() per edge).
+    Il processing delle matrici NON viene eseguito qui: il chiamante lo esegue una volta alla fine.
+    """
+    node = db.new_node(**attributes)
+    with sqlite3_lci_db.transaction():
+        node.save()
+        rows = _exchange_rows(node.key, exchanges)
+        for start in range(0, len(rows), _BULK_BATCH):
+            ExchangeDataset.insert_many(rows[start:start + _BULK_BATCH]).execute()
+    bd.databases.set_dirty(db.name)
+    return node
 
 # Normalizzazione etichette unità per evitare falsi mismatch
 _UNIT_ALIASES = {
@@ -132,7 +153,8 @@ def _parse_mapping_entry(entry: MappingValue) -> Tuple[Optional[str], Optional[s
     Ritorna (db_name, code, target_unit, density) a partire da vecchio (db, code) o nuovo dict.
     """
     if isinstance(entry, (tuple, list)) and len(entry) >= 2:
-        return entry, entry[1], None, None
+        db, code = mapping_pair(entry)
+        return db, code, None, None
     if isinstance(entry, dict):
         db = entry.get("database")
         code = entry.get("code")
@@ -159,16 +181,122 @@ def _convert_if_needed(amount: float, row_unit: Optional[str], target_unit: Opti
             warnings.append(f"Missing or invalid density for flow '{flow_name}' mapped to volumetric unit; cannot convert kg→m³.")
     return amount
 
+def stable_process_code(flowsheet: Optional[str], reference_flow: Optional[str]) -> str:
+    """Code deterministico del processo foreground: stesso flowsheet + reference flow -> stesso nodo."""
+    digest = hashlib.sha1(f"{flowsheet or ''}|{reference_flow or ''}".encode("utf-8")).hexdigest()
+    return f"aspen-{digest[:20]}"
+
+def _reference_flow_name(df_lci, fallback: Optional[str]) -> Optional[str]:
+    ref_rows = df_lci[df_lci["Type"] == "Reference Flow"]
+    return str(ref_rows["Flow"].iloc[0]) if not ref_rows.empty else fallback
+
+def _exchange_rows(output_key: Tuple[str, str], exchanges: list) -> list:
+    return [
+        {
+            "data": {"input": ex["input"], "output": output_key, "amount": ex["amount"], "type": ex["type"]},
+            "input_database": ex["input"][0],
+            "input_code": ex["input"][1],
+            "output_database": output_key[0],
+            "output_code": output_key[1],
+            "type": ex["type"],
+        }
+        for ex in exchanges
+    ]
+
+def _aggregate_exchanges(exchanges: list) -> "OrderedDict[Tuple[str, Tuple[str, str]], Dict[str, Any]]":
+    """Somma gli exchanges con stesso (type, input): nella matrice si sommerebbero comunque."""
+    out: "OrderedDict[Tuple[str, Tuple[str, str]], Dict[str, Any]]" = OrderedDict()
+    for ex in exchanges:
+        k = (ex["type"], tuple(ex["input"]))
+        if k in out:
+            out[k] = _exchange(ex["type"], ex["input"], out[k]["amount"] + ex["amount"])
+        else:
+            out[k] = dict(ex)
+    return out
+
+def sync_process_bulk(db: bd.Database, attributes: Dict[str, Any], exchanges: list):
+    """
+    Crea o aggiorna in modo idempotente il processo attributes["code"]:
+    confronta gli edges desiderati con quelli salvati e scrive solo insert, update e delete,
+    tutto in un'unica transazione. Ritorna (nodo, diff) con diff["changed"] se è stato scritto qualcosa.
+    """
+    diff = {"inserted": 0, "updated": 0, "deleted": 0, "unchanged": 0, "changed": False}
+    desired = _aggregate_exchanges(exchanges)
+
+    existing = ActivityDataset.get_or_none(
+        (ActivityDataset.database == db.name) & (ActivityDataset.code == attributes["code"])
+    )
+    if existing is None:
+        node = write_process_bulk(db, attributes, list(desired.values()))
+        diff.update(inserted=len(desired), changed=True)
+        return node, diff
+
+    node = bd.get_node(database=db.name, code=attributes["code"])
+    output_key = node.key
+
+    stored: Dict[Tuple[str, Tuple[str, str]], Tuple[int, float]] = {}
+    to_delete = []
+    query = ExchangeDataset.select(ExchangeDataset.id, ExchangeDataset.type, ExchangeDataset.input_database,
+                                   ExchangeDataset.input_code, ExchangeDataset.data).where(
+        (ExchangeDataset.output_database == output_key[0]) & (ExchangeDataset.output_code == output_key[1])
+    )
+    for row in query:
+        k = (row.type, (row.input_database, row.input_code))
+        if k in stored:
+            # Duplicati lasciati da build precedenti: teniamo una sola riga per chiave
+            to_delete.append(row.id)
+        else:
+            stored[k] = (row.id, float((row.data or {}).get("amount", 0.0)))
+
+    to_insert = [ex for k, ex in desired.items() if k not in stored]
+    to_update = []
+    for k, (row_id, amount) in stored.items():
+        if k not in desired:
+            to_delete.append(row_id)
+        elif math.isclose(amount, desired[k]["amount"], rel_tol=1e-12, abs_tol=0.0):
+            diff["unchanged"] += 1
+        else:
+            to_update.append((row_id, desired[k]))
+
+    attrs_changed = any(node.get(k) != v for k, v in attributes.items())
+
+    if not (to_insert or to_update or to_delete or attrs_changed):
+        return node, diff
+
+    with sqlite3_lci_db.transaction():
+        if attrs_changed:
+            for k, v in attributes.items():
+                node[k] = v
+            node.save()
+        rows = _exchange_rows(output_key, to_insert)
+        for start in range(0, len(rows), _BULK_BATCH):
+            ExchangeDataset.insert_many(rows[start:start + _BULK_BATCH]).execute()
+        for row_id, ex in to_update:
+            ExchangeDataset.update(data=_exchange_rows(output_key, [ex])[0]["data"]).where(
+                ExchangeDataset.id == row_id
+            ).execute()
+        for start in range(0, len(to_delete), _BULK_BATCH):
+            ExchangeDataset.delete().where(ExchangeDataset.id << to_delete[start:start + _BULK_BATCH]).execute()
+    bd.databases.set_dirty(db.name)
+
+    diff.update(inserted=len(to_insert), updated=len(to_update), deleted=len(to_delete), changed=True)
+    return node, diff
+
 def edge_from_row(
-    process_node,
+    process_key: Tuple[str, str],
     row: Any,
     mapping: MappingType,
     products_cache: Dict[Tuple[str, str], Any],
+    exchanges: list,
+    production_signs: Optional[Dict[Tuple[str, str], float]] = None,
 ) -> Dict[str, Any]:
     """
     Traduce una riga del DataFrame LCI normalizzato in uno o più edges Brightway.
     row atteso con colonne: Flow, Type, Amount, Amount_float, Unit, Group, Direction.
     mapping: {Flow: (db, code)} oppure {Flow: {"database","code","unit","density"}}
+    Gli edges non vengono salvati: le specifiche sono accodate a `exchanges` per la scrittura bulk.
+    products_cache: metadati dei target prefetchati in blocco (vedi prefetch_targets);
+    production_signs: {(db, code): segno della produzione di riferimento} per i provider dei rifiuti.
     """
     flow = row["Flow"]
     ftype = row["Type"]
@@ -180,7 +308,7 @@ def edge_from_row(
 
     # 1) Reference Flow: SEMPRE crea la produzione, senza alcuna dipendenza dal mapping
     if ftype == "Reference Flow":
-        _add_technosphere_production_edge(process_node, amount)
+        _add_technosphere_production_edge(exchanges, process_key, amount)
         created.append(("production", flow, amount))
         return {"created": created, "warnings": warnings}
 
@@ -202,8 +330,11 @@ def edge_from_row(
 
     key = (db_name, code)
     if key not in products_cache:
-        products_cache[key] = _resolve_target_product(db_name, code)
-    target = products_cache[key]
+        products_cache.update(resolve_activities([key]))
+    target = products_cache.get(key)
+    if target is None:
+        warnings.append(f"Mapped activity for flow '{flow}' not found in database '{db_name}'; skipping.")
+        return {"created": created, "warnings": warnings}
 
     # Determina l'unità target (preferisci metadati del nodo, altrimenti quella salvata nel mapping)
     target_unit = target.get("unit") or target_unit_from_map
@@ -222,13 +353,13 @@ def edge_from_row(
         # Uptake (input) -> amount negativo; Emissione (output o None) -> amount positivo
         dirn = (direction or "").strip().lower()
         signed_amount = -amount_converted if dirn == "input" else amount_converted
-        _add_biosphere_edge(process_node, target, signed_amount)
+        _add_biosphere_edge(exchanges, key, signed_amount)
         created.append(("biosphere", flow, signed_amount))
         return {"created": created, "warnings": warnings}
 
 
     if ftype == "Avoided Product":
-        _add_technosphere_substitution_edge(process_node, target, amount_converted)
+        _add_technosphere_substitution_edge(exchanges, key, amount_converted)
         created.append(("substitution", flow, amount_converted))
         return {"created": created, "warnings": warnings}
 
@@ -241,46 +372,77 @@ def edge_from_row(
                 f"Waste flow '{flow}' with Direction='{direction}' treated as output (treatment consumption)."
             )
 
-        # Rileva il segno della produzione di riferimento del provider
-        rp_amount = 0.0
-        try:
-            # Prende il primo exchange di produzione; per i 'treatment of ...' ecoinvent è tipicamente < 0
-            prod_exchanges = list(target.production())
-            if prod_exchanges:
-                rp_amount = float(prod_exchanges.get("amount", 0.0))
-        except Exception:
-            rp_amount = 0.0
+        # Segno della produzione di riferimento del provider (indice precalcolato, nessuna query per riga);
+        # per i 'treatment of ...' ecoinvent è tipicamente < 0
+        if production_signs is None:
+            production_signs = production_signs_for([key])
+        rp_amount = production_signs.get(key, 0.0)
 
         # Se il provider ha RP negativo (treatment), il consumo deve essere positivo
         signed_amount = abs(amount_converted) if rp_amount < 0 else -abs(amount_converted)
 
-        _add_technosphere_consumption_edge(process_node, target, signed_amount)
+        _add_technosphere_consumption_edge(exchanges, key, signed_amount)
         created.append(("technosphere-waste-treatment", flow, signed_amount))
         return {"created": created, "warnings": warnings}
 
 
     if ftype == "Technosphere":
         if direction == "input":
-            _add_technosphere_consumption_edge(process_node, target, amount_converted)
+            _add_technosphere_consumption_edge(exchanges, key, amount_converted)
             created.append(("technosphere-consumption", flow, amount_converted))
         elif direction == "output":
             # Produzione verso un prodotto esterno (co‑prodotto)
-            e = process_node.new_edge(
-                type="production",
-                amount=float(amount_converted),
-                input=target,
-                output=process_node,
-            )
-            e.save()
+            exchanges.append(_exchange("production", key, amount_converted))
             created.append(("technosphere-production-external", flow, amount_converted))
         else:
-            _add_technosphere_consumption_edge(process_node, target, amount_converted)
+            _add_technosphere_consumption_edge(exchanges, key, amount_converted)
             created.append(("technosphere-consumption-fallback", flow, amount_converted))
         return {"created": created, "warnings": warnings}
 
     warnings.append(f"Row for flow '{flow}' with Type '{ftype}' not handled; skipped.")
     return {"created": created, "warnings": warnings}
 
+def compile_exchanges(
+    df_lci,
+    mapping: MappingType,
+    process_key: Tuple[str, str],
+    fallback_production: bool = True,
+    targets: Optional[Dict[Tuple[str, str], Dict[str, Any]]] = None,
+) -> Dict[str, Any]:
+    """
+    Traduce tutto df_lci nelle specifiche degli exchanges del processo process_key, senza scrivere nulla.
+    fallback_production=False disattiva la produzione minima di guardia (il chiamante la imposta da sé).
+    targets: metadati già prefetchati (chiamate ripetute sulla stessa mappatura, es. un processo per blocco).
+    Ritorna {"exchanges", "created_edges", "warnings", "targets"} (targets: metadati prefetchati per (db, code)).
+    """
+    # Prefetch in blocco: metadati di tutti i target mappati e segni di produzione dei provider dei rifiuti
+    products_cache = targets if targets is not None else prefetch_targets(mapping)
+    waste_flows = set(df_lci.loc[df_lci["Type"] == "Waste", "Flow"])
+    production_signs = production_signs_for(
+        mapping_pair(v) for k, v in mapping.items() if k in waste_flows
+    )
+    exchanges: list = []
+    created_edges = 0
+    warnings_all = []
+
+    for _, row in df_lci.iterrows():
+        result = edge_from_row(process_key, row, mapping, products_cache, exchanges, production_signs)
+        created_edges += len(result.get("created", []))
+        warnings_all.extend(result.get("warnings", []))
+
+    # Guardia anti-orfani: se per qualsiasi motivo non c'è produzione, crea un edge di produzione minimo
+    if fallback_production and not any(ex["type"] == "production" for ex in exchanges):
+        _add_technosphere_production_edge(exchanges, process_key, 1.0)
+        created_edges += 1
+        warnings_all.append("No production exchange found on the foreground process; added a fallback production of 1.0.")
+
+    return {
+        "exchanges": exchanges,
+        "created_edges": created_edges,
+        "warnings": warnings_all,
+        "targets": products_cache,
+    }
+
 def build_inventory(
     df_lci,
     mapping: MappingType,
@@ -288,7 +450,10 @@ def build_inventory(
     process_meta: Dict[str, Any],
 ) -> Dict[str, Any]:
     """
-    Orchestrazione: crea/recupera DB, crea processo, agrega edges da df_lci, ritorna info per LCIA.
+    Orchestrazione: crea/recupera DB, raccoglie tutti gli edges da df_lci e sincronizza il processo
+    foreground (code stabile da flowsheet + reference flow) scrivendo solo le differenze in un'unica
+    transazione; le matrici vengono processate una sola volta alla fine e solo se qualcosa è cambiato.
+    Ritorna info per LCIA.
     """
     db = ensure_database(target_db)
 
@@ -296,38 +461,30 @@ def build_inventory(
     location = process_meta.get("location", "GLO")
     unit = process_meta.get("unit")
     reference_product = process_meta.get("reference_product")
-    code = process_meta.get("code")
+    code = process_meta.get("code") or stable_process_code(process_meta.get("flowsheet"), _reference_flow_name(df_lci, reference_product))
     chimaera = bool(process_meta.get("chimaera", True))
     extra = process_meta.get("extra", {})
 
-    process_node = create_process_node(
-        db=db,
-        name=name,
-        location=location,
-        unit=unit,
-        reference_product=reference_product,
-        code=code,
-        chimaera=chimaera,
-        extra=extra,
-    )
+    attributes = _process_attributes(db, name, location, unit, reference_product, code, chimaera, extra)
+    process_key = (db.name, attributes["code"])
 
-    products_cache: Dict[Tuple[str, str], Any] = {}
-    created_edges = 0
-    warnings_all = []
+    compiled = compile_exchanges(df_lci, mapping, process_key)
+    exchanges = compiled["exchanges"]
+    created_edges = compiled["created_edges"]
+    warnings_all = compiled["warnings"]
 
-    for _, row in df_lci.iterrows():
-        result = edge_from_row(process_node, row, mapping, products_cache)
-        created_edges += len(result.get("created", []))
-        warnings_all.extend(result.get("warnings", []))
-
-    # Guardia anti-orfani: se per qualsiasi motivo non c'è produzione, crea un edge di produzione minimo
-    if len(list(process_node.production())) == 0:
-        _add_technosphere_production_edge(process_node, 1.0)
-        created_edges += 1
-        warnings_all.append("No production exchange found on the foreground process; added a fallback production of 1.0.")
+    process_node, diff = sync_process_bulk(db, attributes, exchanges)
+    if diff["changed"]:
+        db.process()
+        # Le cache derivate dal DB foreground non sono più valide
+        invalidate_database(target_db)
 
     report = {
         "created_edges": created_edges,
+        "inserted": diff["inserted"],
+        "updated": diff["updated"],
+        "deleted": diff["deleted"],
+        "unchanged": diff["unchanged"],
         "warnings": [w for w in warnings_all if w],
     }
 
@@ -0,0 +1,118 @@
+# core/jobs.py
+
+from __future__ import annotations
+
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional
+
+import bw2data as bd
+
+# Esecuzione asincrona dei calcoli lunghi (LCIA, import) fuori dal thread dello script Streamlit:
+# executor e registro dei job sono a livello di processo, quindi un job sopravvive ai rerun e, tramite
+# l'id salvato nei query params, anche alla riconnessione del browser.
+
+_MAX_WORKERS = 2
+# Job conclusi conservati nel registro (i più vecchi vengono scartati)
+_MAX_FINISHED = 50
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=_MAX_WORKERS, thread_name_prefix="aspen-job")
+_JOBS: Dict[str, "Job"] = {}
+_LOCK = threading.Lock()
+
+QUEUED, RUNNING, DONE, ERROR, CANCELLED = "queued", "running", "done", "error", "cancelled"
+
+
+class JobCancelled(Exception):
+    """Sollevata dal codice di calcolo quando il job è stato annullato."""
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    project: str
+    status: str = QUEUED
+    progress: float = 0.0
+    message: str = ""
+    result: Any = None
+    error: Optional[str] = None
+    created: float = field(default_factory=time.time)
+    finished: Optional[float] = None
+    cancel_event: threading.Event = field(default_factory=threading.Event, repr=False)
+    future: Optional[Future] = field(default=None, repr=False)
+
+    @property
+    def active(self) -> bool:
+        return self.status in (QUEUED, RUNNING)
+
+    def report(self, fraction: float, message: str = "") -> None:
+        """Callback di avanzamento passata al calcolo; solleva JobCancelled se il job è stato annullato."""
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+        self.progress = max(0.0, min(1.0, float(fraction)))
+        if message:
+            self.message = message
+
+
+def _run(job: Job, fn: Callable[..., Any], args, kwargs) -> None:
+    if job.cancel_event.is_set():
+        job.status, job.finished = CANCELLED, time.time()
+        return
+    job.status = RUNNING
+    try:
+        job.result = fn(*args, progress=job.report, cancel=job.cancel_event, **kwargs)
+        job.status, job.progress = DONE, 1.0
+    except JobCancelled:
+        job.status = CANCELLED
+    except Exception as e:
+        job.status, job.error = ERROR, f"{type(e).__name__}: {e}"
+    finally:
+        job.finished = time.time()
+
+
+def _prune() -> None:
+    finished = sorted((j for j in _JOBS.values() if not j.active), key=lambda j: j.finished or 0.0)
+    for job in finished[:max(0, len(finished) - _MAX_FINISHED)]:
+        _JOBS.pop(job.id, None)
+
+
+def submit_job(kind: str, fn: Callable[..., Any], *args, project: Optional[str] = None, **kwargs) -> str:
+    """
+    Accoda fn(*args, progress=..., cancel=..., **kwargs) sull'executor e ritorna l'id del job.
+    fn riceve `progress(fraction, message)` e l'Event `cancel`; l'annullamento è cooperativo.
+    project: progetto a cui si riferisce il job (default: progetto attivo del processo).
+    """
+    job = Job(id=uuid.uuid4().hex[:12], kind=kind, project=project or bd.projects.current)
+    with _LOCK:
+        _prune()
+        _JOBS[job.id] = job
+    job.future = _EXECUTOR.submit(_run, job, fn, args, kwargs)
+    return job.id
+
+
+def get_job(job_id: Optional[str]) -> Optional[Job]:
+    if not job_id:
+        return None
+    with _LOCK:
+        return _JOBS.get(job_id)
+
+
+def cancel_job(job_id: str) -> bool:
+    """Richiede l'annullamento; True se il job era ancora attivo."""
+    job = get_job(job_id)
+    if job is None or not job.active:
+        return False
+    job.cancel_event.set()
+    if job.future is not None and job.future.cancel():
+        job.status, job.finished = CANCELLED, time.time()
+    return True
+
+
+def check_cancelled(cancel: Optional[threading.Event]) -> None:
+    """Punto di annullamento cooperativo per il codice di calcolo."""
+    if cancel is not None and cancel.is_set():
+        raise JobCancelled()
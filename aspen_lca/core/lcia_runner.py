@@ -1,8 +1,23 @@
 # core/lcia_runner.py
 from __future__ import annotations
-from typing import Dict, Any, Tuple, List
-import bw2data as bd
-import bw2calc as bc
+import threading
+from typing import Callable, Dict, Any, Tuple, List, Optional
+
+import numpy as np
+
+from core.background import (
+    background_databases,
+    background_system,
+    flatten_foreground,
+    foreground_column,
+    solve_foreground,
+    stored_exchanges,
+)
+from core.characterization import characterize_inventory, method_characterization, project_stack, stacked_characterization
+from core.jobs import check_cancelled
+from core.result_store import inventory_key, leggi_risultati, salva_risultati
+
+ProgressType = Optional[Callable[[float, str], None]]
 
 def _as_method_tuples(lcia_selection: Dict[str, Any]) -> List[Tuple]:
     """
@@ -13,25 +28,154 @@ def _as_method_tuples(lcia_selection: Dict[str, Any]) -> List[Tuple]:
     # cats sono già tuple Brightway (('Method', 'Midpoint', 'Indicator'), ...)
     return [tuple(c) for c in cats]
 
+def _exchange_scores(column: Dict[str, Any], solved: Dict[str, Any], stack: Dict[str, Any], bg) -> List[Dict[str, Any]]:
+    """
+    Punteggi per exchange del foreground dalle colonne di supply già risolte (una per riga prodotto):
+    exchange sulla stessa riga ripartiti in proporzione al loro valore, biosfera = CF × amount × x_f.
+    """
+    rows = solved["split_rows"]
+    S = np.asarray(project_stack(stack, bg.biosphere_ids) @ (bg.biosphere @ solved["split_supply"]))
+    col_of = {int(r): j for j, r in enumerate(rows)}
+    bio_ids = sorted({pos for _, kind, pos, _ in column["positions"] if kind == "biosphere"})
+    cf = project_stack(stack, bio_ids).toarray() if bio_ids else None
+    bio_col = {f: i for i, f in enumerate(bio_ids)}
+    out = []
+    for ex, kind, pos, value in column["positions"]:
+        if kind == "product":
+            total = column["a_bf"][pos]
+            scores = S[:, col_of[pos]] * (value / total) if pos in col_of and total else np.zeros(S.shape[0])
+        else:
+            scores = cf[:, bio_col[pos]] * value * solved["x_f"]
+        out.append({"input": tuple(ex["input"]), "type": ex["type"], "amount": ex["amount"], "scores": scores})
+    return out
+
+def lcia_from_exchanges(
+    exchanges: List[Dict[str, Any]],
+    process_key: Tuple[str, str],
+    methods: List[Tuple],
+    targets: Optional[Dict[Tuple[str, str], Dict[str, Any]]] = None,
+    amount: float = 1.0,
+    progress: ProgressType = None,
+    cancel: Optional[threading.Event] = None,
+    use_store: bool = True,
+) -> Dict[str, Any]:
+    """
+    LCIA di un processo foreground dato dai suoi exchanges, risolto contro il sistema di background in cache
+    (fattorizzazione LU condivisa tra sessioni e rerun): nessun riassemblaggio né rifattorizzazione.
+    progress(fraction, message) e cancel (threading.Event) servono all'esecuzione come job asincrono:
+    l'avanzamento è riportato per categoria e l'annullamento è controllato tra un passo e l'altro.
+    use_store: se tutte le categorie sono già nell'archivio persistente per questo inventario, ritorna solo
+    i punteggi salvati ("from_store": True, senza supply né contributi) senza toccare il solver.
+    Altri processi del database foreground consumati (blocchi) sono risolti come foreground (flatten_foreground):
+    gli exchanges del risultato sono quelli della colonna equivalente.
+    """
+    progress = progress or (lambda fraction, message="": None)
+    methods = [tuple(m) for m in methods]
+    process_key = tuple(process_key)
+    exchanges = flatten_foreground(exchanges, process_key)
+    inventory = inventory_key(exchanges, process_key) if amount == 1.0 else None
+    if use_store and inventory is not None:
+        stored = leggi_risultati(inventory, methods)
+        if len(stored) == len(methods):
+            progress(1.0, "Scores read from the result store")
+            return {
+                "methods": methods,
+                "scores": np.array([stored[m] for m in methods]),
+                "results": {str(m): float(stored[m]) for m in methods},
+                "exchanges": exchanges,
+                "process_key": process_key,
+                "warnings": [],
+                "from_store": True,
+            }
+    progress(0.0, "Loading background system")
+    bg_dbs = background_databases(
+        {ex["input"][0] for ex in exchanges if tuple(ex["input"]) != process_key}, exclude={process_key[0]}
+    )
+    bg = background_system(tuple(bg_dbs))
+    check_cancelled(cancel)
+    progress(0.4, "Solving foreground demand")
+    column = foreground_column(exchanges, process_key, bg, targets)
+    solved = solve_foreground(column, bg, amount, split=True)
+    for i, m in enumerate(methods):
+        check_cancelled(cancel)
+        method_characterization(m)
+        progress(0.5 + 0.5 * (i + 1) / len(methods), f"Characterized {' | '.join(map(str, m))} ({i + 1}/{len(methods)})")
+    stack = stacked_characterization(tuple(methods))
+    res = characterize_inventory(stack, solved["biosphere_ids"], solved["inventory"])
+    res.update(
+        methods=stack["methods"],
+        results={str(m): float(s) for m, s in zip(stack["methods"], res["scores"])},
+        inventory=solved["inventory"],
+        supply=solved["supply"],
+        x_f=solved["x_f"],
+        column=column,
+        by_exchange=_exchange_scores(column, solved, stack, bg),
+        background=bg,
+        exchanges=exchanges,
+        process_key=process_key,
+        warnings=column["warnings"],
+    )
+    if inventory is not None:
+        salva_risultati(inventory, dict(zip(stack["methods"], res["scores"])))
+    return res
+
+def cached_lcia_scores(
+    exchanges: List[Dict[str, Any]],
+    process_key: Tuple[str, str],
+    methods: List[Tuple],
+    targets: Optional[Dict[Tuple[str, str], Dict[str, Any]]] = None,
+    progress: ProgressType = None,
+    cancel: Optional[threading.Event] = None,
+) -> Dict[str, float]:
+    """
+    Punteggi {method_tuple: score} letti dall'archivio persistente; si calcolano (e salvano) solo le
+    categorie mancanti per questo inventario e queste versioni di database/metodi.
+    """
+    methods = [tuple(m) for m in methods]
+    process_key = tuple(process_key)
+    exchanges = flatten_foreground(exchanges, process_key)
+    stored = leggi_risultati(inventory_key(exchanges, process_key), methods)
+    missing = [m for m in methods if m not in stored]
+    if missing:
+        computed = lcia_from_exchanges(exchanges, process_key, missing, targets, progress=progress, cancel=cancel, use_store=False)
+        stored.update(zip(computed["methods"], computed["scores"]))
+    return {str(m): float(stored[m]) for m in methods}
+
+def _process_key(process_node) -> Tuple[str, str]:
+    if isinstance(process_node, dict):
+        return (process_node["database"], process_node["code"])
+    return tuple(getattr(process_node, "key", process_node))
+
+def run_lcia_detailed(
+    process_node,
+    lcia_selection: Dict[str, Any],
+    progress: ProgressType = None,
+    cancel: Optional[threading.Event] = None,
+    use_store: bool = True,
+) -> Dict[str, Any]:
+    """
+    Come run_lcia, ma ritorna anche inventario, supply di background, contributi per flusso
+    e il sistema di background usato (use_store=False forza la risoluzione anche se i punteggi sono salvati).
+    """
+    methods = _as_method_tuples(lcia_selection)
+    if not methods:
+        return {"results": {}}
+
+    # Domanda: 1 unità del processo creato (chimaera: il proprio prodotto)
+    process_key = _process_key(process_node)
+    return lcia_from_exchanges(
+        stored_exchanges(process_key), process_key, methods, progress=progress, cancel=cancel, use_store=use_store
+    )
+
 def run_lcia(process_node, lcia_selection: Dict[str, Any]) -> Dict[str, float]:
     """
     Esegue LCIA per 1 unità funzionale del processo creato (functional edge del chimaera).
+    Un solo calcolo LCI condiviso da tutte le categorie selezionate; le categorie già calcolate per lo
+    stesso inventario vengono lette dall'archivio persistente.
     Ritorna dict {method_tuple: score}.
     """
     methods = _as_method_tuples(lcia_selection)
     if not methods:
         return {}
-
-    # Vector di domanda: 1 unità del processo creato (chimaera: il proprio prodotto)
-    demand = {process_node: 1.0}
-
-    results: Dict[str, float] = {}
-
-    # Esegui LCIA per ogni categoria selezionata
-    for m in methods:
-        lca = bc.LCA(demand, method=m)
-        lca.lci()
-        lca.lcia()
-        results[str(m)] = float(lca.score)
-
-    return results
+    process_key = _process_key(process_node)
+    return cached_lcia_scores(stored_exchanges(process_key), process_key, methods)
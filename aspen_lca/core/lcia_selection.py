@@ -1,20 +1,18 @@
 import streamlit as st
-import bw2data as bd
-from collections import defaultdict
+
+from core.method_catalog import category_label, cerca_metodi
+from core.project_workers import metadati_progetto
 
 def show_lcia_selector():
     st.markdown("### LCIA method and categories selection")
 
-    # Raggruppa metodi per nome
-    categories_by_method = defaultdict(list)
-    for m in bd.methods:
-        t = tuple(m)
-        if not t:
-            continue
-        method_name = str(t[0])
-        categories_by_method[method_name].append(t)
-
-    method_names = sorted(categories_by_method.keys())
+    # Catalogo dei metodi del progetto della sessione (famiglie, unità, indice di ricerca), letto nel suo worker
+    catalog = metadati_progetto(st.session_state['progetto'])["methods"]
+    categories_by_method = catalog["families"]
+    method_names = catalog["names"]
+    if not method_names:
+        st.info("No LCIA methods in the current project.")
+        return
 
     # Controllo inizializzazione valido
     if 'lcia_method_selected' not in st.session_state:
@@ -41,16 +39,23 @@ def show_lcia_selector():
 
     with col2:
         st.caption("Impact categories included in the method (select one or more):")
-        cats = list(categories_by_method.get(chosen_name, []))
-        cats.sort(key=lambda t: (str(t[1]) if len(t) >= 2 else "", str(t[2]) if len(t) >= 3 else ""))
+        query = st.text_input(
+            "Search categories",
+            key="lcia_category_search",
+            placeholder="Filter by category, indicator or unit",
+            label_visibility="collapsed",
+        )
+        family = categories_by_method.get(chosen_name, [])
+        cats = cerca_metodi(query, chosen_name, catalog=catalog)
 
         selected = list(st.session_state['lcia_categories_selected'])
-        new_selected = []
+        # Le categorie selezionate ma nascoste dal filtro restano selezionate
+        shown = set(cats)
+        new_selected = [c for c in selected if c in family and c not in shown]
 
         def label_cat(t):
-            mid = t[1] if len(t) >= 2 else ""
-            ind = t[2] if len(t) >= 3 else ""
-            return f"{mid} — {ind}" if mid and ind else str(t)
+            unit = catalog["units"].get(t, "")
+            return f"{category_label(t)} [{unit}]" if unit else category_label(t)
 
         def key_cat(t):
             method = t[0] if len(t) >= 1 else ""
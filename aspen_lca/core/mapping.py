@@ -5,9 +5,15 @@ from __future__ import annotations
 from typing import List, Dict, Any, Iterable, Tuple, Optional
 import hashlib
 
+import numpy as np
 import streamlit as st
 import bw2data as bd
 
+from core.cache import cached_by_database
+from core.impact_atlas import riepilogo_atlante
+from core.mapping_library import applica_libreria, carica_libreria
+from core.project_workers import elenco_database, esegui_nel_progetto
+
 
 # Badge HTML per categoria flusso
 def _flow_type_badge(ftype: str) -> str:
@@ -35,10 +41,12 @@ def _format_activity_label(n: Dict[str, Any]) -> str:
     cats = " | ".join(n.get("categories", []) or [])
     unit = n.get("unit", "") or ""
     unit_part = f" — {unit}" if unit else ""
-    return f"{name}{loc_part} ({cats}){unit_part}"
+    preview = n.get("_preview")
+    preview_part = f" · ≈ {preview:.3g} {n.get('_preview_unit', '')}".rstrip() if preview is not None else ""
+    return f"{name}{loc_part} ({cats}){unit_part}{preview_part}"
 
 
-@st.cache_data(show_spinner=False, ttl=3600)
+@cached_by_database(max_entries=16)
 def _index_db_nodes(db_name: str) -> List[Dict[str, Any]]:
     db = bd.Database(db_name)
     out: List[Dict[str, Any]] = []
@@ -48,6 +56,7 @@ def _index_db_nodes(db_name: str) -> List[Dict[str, Any]]:
         loc = str(n.get("location", "") or "")
         unit = n.get("unit", "") or ""
         out.append({
+            "id": n.id,
             "database": n["database"],
             "code": n["code"],
             "name": name,
@@ -59,7 +68,7 @@ def _index_db_nodes(db_name: str) -> List[Dict[str, Any]]:
     return out
 
 
-@st.cache_data(show_spinner=False, ttl=600)
+@cached_by_database(max_entries=256)
 def _search_indexed(db_name: str, query: str) -> List[Dict[str, Any]]:
     q = (query or "").strip().lower()
     if not q:
@@ -92,6 +101,22 @@ def cerca_attivita(db_names: Iterable[str] | str, query: str) -> List[Dict[str,
     return merged
 
 
+def cerca_con_anteprima(db_name: str, query: str) -> List[Dict[str, Any]]:
+    """
+    cerca_attivita più l'anteprima d'impatto per unità dall'atlante su disco (nessuna risoluzione), se presente:
+    "_preview", "_preview_unit" e "_preview_method" sui risultati. Eseguita nel worker del progetto.
+    """
+    risultati = cerca_attivita(db_name, query)
+    atlas = riepilogo_atlante(db_name, [n.get("id", -1) for n in risultati]) if risultati else None
+    if atlas is None:
+        return risultati
+    return [
+        {**n, "_preview": float(v), "_preview_unit": atlas["units"][0], "_preview_method": atlas["methods"][0]}
+        if np.isfinite(v) else n
+        for n, v in zip(risultati, atlas["preview"])
+    ]
+
+
 def _stable_keys(base: str, chosen_db: str) -> Dict[str, str]:
     digest = hashlib.sha1(f"{base}|{chosen_db}".encode()).hexdigest()[:8]
     return {
@@ -115,7 +140,9 @@ def mapping_flussi_activita(df_flussi, default_db=None):
     if "mappatura_db" not in st.session_state:
         st.session_state["mappatura_db"] = {}
 
-    available_dbs = sorted(list(bd.databases))
+    # Ricerca, libreria e anteprime girano nel worker del progetto della sessione
+    progetto = st.session_state["progetto"]
+    available_dbs = elenco_database(progetto)
     if not available_dbs:
         st.info("Nessun database Brightway disponibile nel progetto corrente.")
         return st.session_state["mappatura"]
@@ -137,6 +164,42 @@ def mapping_flussi_activita(df_flussi, default_db=None):
         k: v for k, v in st.session_state.get("mappatura", {}).items() if k in flussi_ammessi
     }
 
+    # Applica automaticamente la libreria di mappature (una sola volta per flusso)
+    applied = st.session_state.setdefault("mappatura_libreria_applicata", set())
+    skip_flows = set(st.session_state["mappatura"]) | applied
+    library = carica_libreria()
+    # Solo le voci dei flussi ancora da proporre: nessuna chiamata al worker se non c'è nulla da applicare
+    library = library[library["flow"].isin(set(df_mappabili["Flow"]) - skip_flows)]
+    from_library = esegui_nel_progetto(
+        progetto,
+        applica_libreria,
+        df_mappabili,
+        library,
+        available_dbs,
+        preferred_db=default_db_value,
+        skip_flows=skip_flows,
+    ) if not library.empty else {}
+    for flusso, entry in from_library.items():
+        meta = entry.pop("_meta")
+        st.session_state["mappatura"][flusso] = entry
+        st.session_state["mappatura_db"][flusso] = entry["database"]
+        group_key = df_mappabili.loc[df_mappabili["Flow"] == flusso, "_group_norm"].iloc[0]
+        # Pre-popola i risultati così che la selectbox mostri l'attività già mappata
+        st.session_state[f"res_{group_key}:{flusso}"] = [{
+            "database": meta["database"],
+            "code": meta["code"],
+            "name": meta["name"],
+            "location": meta["location"],
+            "categories": meta["categories"],
+            "unit": meta["unit"],
+        }]
+        if "density" in entry:
+            keys = _stable_keys(f"{group_key}:{flusso}", entry["database"])
+            st.session_state[keys["density"]] = entry["density"]
+    applied.update(from_library)
+    if from_library:
+        st.success(f"Applied {len(from_library)} mappings from the mapping library.")
+
     # Messaggio esplicativo
     st.info("Note: the reference flow does not require mapping.")
 
@@ -219,7 +282,8 @@ def mapping_flussi_activita(df_flussi, default_db=None):
                     else:
                         with results_slot:
                             with st.spinner("Searching in LCA database…"):
-                                st.session_state[keys["results"]] = _search_indexed(chosen_db, q_clean)
+                                # Nel worker del progetto della sessione (indice di ricerca in cache nel worker)
+                                st.session_state[keys["results"]] = esegui_nel_progetto(progetto, cerca_con_anteprima, chosen_db, q_clean)
 
                 risultati = st.session_state.get(keys["results"], [])
 
@@ -241,6 +305,10 @@ def mapping_flussi_activita(df_flussi, default_db=None):
                             "categories": [],
                             "unit": "",
                         }
+                        # Anteprima impatto per unità dall'atlante su disco (nessuna risoluzione)
+                        preview_method = next((n["_preview_method"] for n in risultati if "_preview_method" in n), None)
+                        if preview_method is not None:
+                            st.caption(f"Impact preview per unit: {' | '.join(map(str, preview_method))}")
                         options_list = [no_map_option] + risultati
 
                         default_index = 0
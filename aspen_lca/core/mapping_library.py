@@ -0,0 +1,206 @@
+# core/mapping_library.py
+
+from __future__ import annotations
+
+import io
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import pandas as pd
+import streamlit as st
+
+from core.activity_lookup import mapping_pair, resolve_activities
+from core.project_workers import esegui_nel_progetto
+
+# Libreria persistente di mappature riutilizzabili tra flowsheet:
+# una riga per (flow, unit, database) -> attività Brightway (code) + densità opzionale.
+LIBRARY_COLUMNS = ["flow", "unit", "database", "code", "target_unit", "density", "name", "location", "updated"]
+_KEY_COLUMNS = ["flow", "unit", "database"]
+
+
+def library_path() -> Path:
+    """Percorso del file libreria (override con la variabile d'ambiente ASPEN_LCA_HOME)."""
+    base = Path(os.environ.get("ASPEN_LCA_HOME", Path.home() / ".aspen_lca"))
+    return base / "mapping_library.csv"
+
+
+def _empty_library() -> pd.DataFrame:
+    return pd.DataFrame(columns=LIBRARY_COLUMNS)
+
+
+def _normalize_library(df: pd.DataFrame) -> pd.DataFrame:
+    """Allinea colonne e tipi, scarta righe incomplete e duplica-chiave (vince la più recente)."""
+    df = df.copy()
+    for col in LIBRARY_COLUMNS:
+        if col not in df.columns:
+            df[col] = None
+    df = df[LIBRARY_COLUMNS]
+    for col in ("flow", "unit", "database", "code", "target_unit", "name", "location", "updated"):
+        df[col] = df[col].fillna("").astype(str).str.strip()
+    df["density"] = pd.to_numeric(df["density"], errors="coerce")
+    df = df[(df["flow"] != "") & (df["database"] != "") & (df["code"] != "")]
+    df = df.sort_values("updated").drop_duplicates(subset=_KEY_COLUMNS, keep="last")
+    return df.reset_index(drop=True)
+
+
+@st.cache_data(show_spinner=False)
+def _read_library(path: str, mtime: float) -> pd.DataFrame:
+    # mtime fa parte della chiave di cache: il file viene riletto solo se cambia
+    return _normalize_library(pd.read_csv(path, dtype=str, keep_default_na=False))
+
+
+def carica_libreria(path: Optional[Path] = None) -> pd.DataFrame:
+    """Carica la libreria di mappature dal disco (vuota se il file non esiste)."""
+    path = Path(path) if path else library_path()
+    if not path.exists():
+        return _empty_library()
+    return _read_library(str(path), path.stat().st_mtime).copy()
+
+
+def salva_libreria(library: pd.DataFrame, path: Optional[Path] = None) -> Path:
+    """Salva la libreria su disco in modo atomico (scrittura su file temporaneo + replace)."""
+    path = Path(path) if path else library_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    _normalize_library(library).to_csv(tmp, index=False)
+    os.replace(tmp, path)
+    return path
+
+
+def aggiorna_libreria(library: pd.DataFrame, df_lci: pd.DataFrame, mapping: Dict[str, Any]) -> pd.DataFrame:
+    """Inserisce/aggiorna nella libreria le mappature correnti di df_lci (chiave: flow, unit, database)."""
+    units = dict(zip(df_lci["Flow"], df_lci["Unit"])) if "Unit" in df_lci else {}
+    metas = resolve_activities(mapping_pair(v) for v in mapping.values())
+    now = datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+    rows = []
+    for flow, entry in mapping.items():
+        db_name, code = mapping_pair(entry)
+        if not db_name or not code:
+            continue
+        meta = metas.get((db_name, code), {})
+        rows.append({
+            "flow": flow,
+            "unit": units.get(flow, ""),
+            "database": db_name,
+            "code": code,
+            "target_unit": (entry.get("unit") if isinstance(entry, dict) else None) or meta.get("unit", ""),
+            "density": entry.get("density") if isinstance(entry, dict) else None,
+            "name": meta.get("name", ""),
+            "location": meta.get("location", ""),
+            "updated": now,
+        })
+    if not rows:
+        return _normalize_library(library)
+    return _normalize_library(pd.concat([library, pd.DataFrame(rows)], ignore_index=True))
+
+
+def valida_libreria(library: pd.DataFrame) -> Tuple[pd.Series, Dict[Tuple[str, str], Dict[str, Any]]]:
+    """
+    Verifica tutte le coppie (database, code) della libreria con una sola query batch.
+    Ritorna (maschera booleana delle righe valide, metadati risolti per coppia).
+    """
+    if library.empty:
+        return pd.Series([], dtype=bool), {}
+    pairs = list(zip(library["database"], library["code"]))
+    metas = resolve_activities(pairs)
+    valid = pd.Series([p in metas for p in pairs], index=library.index)
+    return valid, metas
+
+
+def applica_libreria(
+    df_lci: pd.DataFrame,
+    library: pd.DataFrame,
+    available_dbs: Iterable[str],
+    preferred_db: Optional[str] = None,
+    skip_flows: Iterable[str] = (),
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Propone mappature per i flussi di df_lci a partire dalla libreria.
+    Corrispondenza su (Flow, Unit); tra più database disponibili preferisce preferred_db.
+    Le voci che puntano ad attività non più esistenti vengono ignorate.
+    Ritorna {Flow: {"database","code","unit","density"?, "_meta": {...}}}.
+    """
+    if library.empty or df_lci.empty:
+        return {}
+    available = set(available_dbs)
+    skip = set(skip_flows)
+    flows = df_lci[df_lci["Type"] != "Reference Flow"][["Flow", "Unit"]].drop_duplicates()
+    flows = flows[~flows["Flow"].isin(skip)]
+
+    candidates = library[library["database"].isin(available)].merge(
+        flows.rename(columns={"Flow": "flow", "Unit": "unit"}), on=["flow", "unit"], how="inner"
+    )
+    if candidates.empty:
+        return {}
+    valid, metas = valida_libreria(candidates)
+    candidates = candidates[valid]
+    candidates = candidates.assign(_pref=(candidates["database"] != (preferred_db or "")).astype(int))
+    candidates = candidates.sort_values(["_pref", "updated"], ascending=[True, False]).drop_duplicates("flow")
+
+    out: Dict[str, Dict[str, Any]] = {}
+    for rec in candidates.to_dict("records"):
+        meta = metas[(rec["database"], rec["code"])]
+        entry: Dict[str, Any] = {
+            "database": rec["database"],
+            "code": rec["code"],
+            "unit": meta.get("unit") or rec["target_unit"],
+            "_meta": meta,
+        }
+        if pd.notna(rec["density"]):
+            entry["density"] = float(rec["density"])
+        out[rec["flow"]] = entry
+    return out
+
+
+def esporta_libreria(library: pd.DataFrame, fmt: str = "csv") -> bytes:
+    """Serializza la libreria in CSV o Parquet (Parquet richiede pyarrow o fastparquet)."""
+    library = _normalize_library(library)
+    buf = io.BytesIO()
+    if fmt == "parquet":
+        library.to_parquet(buf, index=False)
+    else:
+        library.to_csv(buf, index=False)
+    return buf.getvalue()
+
+
+def importa_libreria(data: bytes, filename: str) -> pd.DataFrame:
+    """Legge una libreria esportata (CSV o Parquet, dedotto dall'estensione del file)."""
+    if str(filename).lower().endswith(".parquet"):
+        df = pd.read_parquet(io.BytesIO(data))
+    else:
+        df = pd.read_csv(io.BytesIO(data), dtype=str, keep_default_na=False)
+    return _normalize_library(df)
+
+
+def mostra_libreria_mappature(df_lci: pd.DataFrame, mapping: Dict[str, Any]):
+    """Sezione UI: salvataggio della mappatura corrente, import/export della libreria."""
+    library = carica_libreria()
+    st.caption(f"Mapping library: {len(library)} stored mappings ({library_path()})")
+
+    col_save, col_csv, col_pq = st.columns([2, 1, 1], gap="small")
+    with col_save:
+        if st.button("Save current mapping to library", disabled=not mapping):
+            # Metadati delle attività risolti nel worker del progetto della sessione
+            salva_libreria(esegui_nel_progetto(st.session_state["progetto"], aggiorna_libreria, library, df_lci, dict(mapping)))
+            st.success("Mapping library updated.")
+    with col_csv:
+        st.download_button("Export CSV", esporta_libreria(library, "csv"), file_name="mapping_library.csv", mime="text/csv")
+    with col_pq:
+        try:
+            pq_bytes = esporta_libreria(library, "parquet")
+        except ImportError:
+            pq_bytes = None
+        if pq_bytes is not None:
+            st.download_button("Export Parquet", pq_bytes, file_name="mapping_library.parquet")
+
+    uploaded = st.file_uploader("Import mapping library (CSV or Parquet)", type=["csv", "parquet"], key="mapping_library_upload")
+    if uploaded is not None and st.button("Merge into library"):
+        try:
+            imported = importa_libreria(uploaded.getvalue(), uploaded.name)
+            salva_libreria(pd.concat([library, imported], ignore_index=True))
+            st.success(f"Imported {len(imported)} mappings.")
+        except Exception as e:
+            st.error(f"Import error: {e}")
@@ -2,58 +2,51 @@
 
 from __future__ import annotations
 
+from typing import Any, Dict, Tuple
+
 import pandas as pd
-import bw2data as bd
 import streamlit as st
 
+from core.activity_lookup import mapping_pair, mapped_pairs, resolve_activities
+from core.cache import cached_by_database
+from core.project_workers import esegui_nel_progetto
+
+
+@cached_by_database(databases=lambda pairs: [d for d, _ in pairs])
+def _get_acts_by_codes(pairs: Tuple[Tuple[str, str], ...]) -> Dict[Tuple[str, str], Dict[str, Any]]:
+    """Metadati (name, location) per tutte le coppie (db, code) mappate, con una sola query."""
+    found = resolve_activities(pairs)
+    return {k: {"name": v["name"], "location": v["location"]} for k, v in found.items()}
+
 
-@st.cache_data(show_spinner=False, ttl=3600)
-def _get_act_by_code(db_name: str, code: str):
+def _format_density(entry: Any) -> str:
+    if not isinstance(entry, dict):
+        return ""
+    density_val = entry.get("density", "")
     try:
-        n = bd.get_node(database=db_name, code=code)
-        return {"name": n.get("name", "-"), "location": n.get("location", "-")}
+        return f"{float(density_val):.4f}" if density_val not in (None, "") else ""
     except Exception:
-        return {"name": "-", "location": "-"}
+        return str(density_val) if density_val is not None else ""
 
 
 def mostra_tabella_riepilogo(df_flussi, mapping):
-    rows = []
-    for _, row in df_flussi.iterrows():
-        flusso = row["Flow"]
-        mappatura = mapping.get(flusso)
-
-        mapped_name = "-"
-        region = "-"
-        density = ""
-
-        if mappatura is not None:
-            # Supporta vecchio formato (tuple) e nuovo (dict)
-            if isinstance(mappatura, (tuple, list)) and len(mappatura) >= 2:
-                db_name, code = mappatura, mappatura[1]
-                meta = _get_act_by_code(db_name, code)
-                mapped_name = meta["name"]
-                region = meta["location"]
-            elif isinstance(mappatura, dict):
-                db_name = mappatura.get("database")
-                code = mappatura.get("code")
-                density_val = mappatura.get("density", "")
-                try:
-                    density = f"{float(density_val):.4f}" if density_val not in (None, "") else ""
-                except Exception:
-                    density = str(density_val) if density_val is not None else ""
-                if db_name and code:
-                    meta = _get_act_by_code(db_name, code)
-                    mapped_name = meta["name"]
-                    region = meta["location"]
-
-        rows.append({
-            "Nome Flusso Aspen": flusso,
-            "Attività Mappata": mapped_name,
-            "Region": region,
-            "Amount Normalizzato": row.get("Amount", ""),
-            "Unità": row.get("Unit", ""),
-            "Density (kg/m³)": density,
-        })
-
-    df_summary = pd.DataFrame(rows)
+    mapping = mapping or {}
+    pairs = tuple(mapped_pairs(mapping))
+    # Metadati letti nel worker del progetto della sessione (cache per database nel worker)
+    metas = esegui_nel_progetto(st.session_state["progetto"], _get_acts_by_codes, pairs) if pairs else {}
+
+    # Supporta vecchio formato (tuple) e nuovo (dict)
+    entries = df_flussi["Flow"].map(mapping.get)
+    keys = entries.map(mapping_pair)
+    missing = {"name": "-", "location": "-"}
+    resolved = keys.map(lambda k: metas.get(k, missing))
+
+    df_summary = pd.DataFrame({
+        "Nome Flusso Aspen": df_flussi["Flow"],
+        "Attività Mappata": resolved.map(lambda m: m["name"]),
+        "Region": resolved.map(lambda m: m["location"]),
+        "Amount Normalizzato": df_flussi["Amount"] if "Amount" in df_flussi else "",
+        "Unità": df_flussi["Unit"] if "Unit" in df_flussi else "",
+        "Density (kg/m³)": entries.map(_format_density),
+    }).reset_index(drop=True)
     st.dataframe(df_summary, use_container_width=True)
@@ -0,0 +1,75 @@
+# core/method_catalog.py
+
+from __future__ import annotations
+
+import os
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import bw2data as bd
+
+from core.cache import cached_by_fingerprint
+
+# Catalogo dei metodi LCIA del progetto corrente, costruito una volta e condiviso tra sessioni:
+# metodi raggruppati per famiglia (primo elemento della tupla), unità, numero di CF e indice di ricerca.
+# Si ricostruisce solo quando cambia il file dei metadati dei metodi (nuovi metodi importati o modificati).
+
+
+def _catalog_fingerprint() -> Tuple[Any, ...]:
+    path = getattr(bd.methods, "filepath", None)
+    mtime = os.stat(path).st_mtime if path and os.path.exists(path) else None
+    return (bd.projects.current, mtime, len(bd.methods))
+
+
+def category_label(method: Tuple) -> str:
+    mid = method[1] if len(method) >= 2 else ""
+    ind = method[2] if len(method) >= 3 else ""
+    return f"{mid} — {ind}" if mid and ind else str(method)
+
+
+@cached_by_fingerprint(lambda: _catalog_fingerprint(), max_entries=8)
+def method_catalog() -> Dict[str, Any]:
+    """
+    {"families": {famiglia: [tuple ordinate]}, "names": [famiglie ordinate],
+     "units": {tuple: unità}, "num_cfs": {tuple: n}, "search": {tuple: testo minuscolo}}.
+    Una sola lettura dei metadati (bd.methods), nessun caricamento dei CF.
+    """
+    families: Dict[str, List[Tuple]] = defaultdict(list)
+    units: Dict[Tuple, str] = {}
+    num_cfs: Dict[Tuple, Optional[int]] = {}
+    search: Dict[Tuple, str] = {}
+    for m, meta in bd.methods.items():
+        t = tuple(m)
+        if not t:
+            continue
+        families[str(t[0])].append(t)
+        meta = meta or {}
+        units[t] = meta.get("unit", "") or ""
+        num_cfs[t] = meta.get("num_cfs")
+        search[t] = " ".join([*map(str, t), units[t], str(meta.get("description", "") or "")]).lower()
+    for cats in families.values():
+        cats.sort(key=lambda t: (str(t[1]) if len(t) >= 2 else "", str(t[2]) if len(t) >= 3 else ""))
+    return {
+        "families": dict(families),
+        "names": sorted(families),
+        "units": units,
+        "num_cfs": num_cfs,
+        "search": search,
+    }
+
+
+def cerca_metodi(query: str, family: Optional[str] = None, catalog: Optional[Dict[str, Any]] = None) -> List[Tuple]:
+    """
+    Categorie che contengono tutte le parole della query (facoltativamente di una sola famiglia).
+    catalog: catalogo già letto (es. dal worker del progetto, core.project_workers.metadati_progetto).
+    """
+    catalog = catalog or method_catalog()
+    pool = catalog["families"].get(family, []) if family else [m for f in catalog["names"] for m in catalog["families"][f]]
+    words = (query or "").lower().split()
+    if not words:
+        return list(pool)
+    return [m for m in pool if all(w in catalog["search"][m] for w in words)]
+
+
+def method_unit(method: Tuple, catalog: Optional[Dict[str, Any]] = None) -> str:
+    return (catalog or method_catalog())["units"].get(tuple(method), "")
@@ -0,0 +1,322 @@
+# core/monte_carlo.py
+
+from __future__ import annotations
+
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.linalg import LinearOperator, gmres, splu, spsolve
+import bw2data as bd
+import bw2calc as bc
+
+from core.activity_lookup import resolve_activities
+from core.background import (
+    background_databases,
+    background_system,
+    flatten_foreground,
+    foreground_column,
+    solve_foreground,
+    technosphere_node_id,
+)
+from core.characterization import project_stack, stacked_characterization
+from core.jobs import JobCancelled
+from core.shared_matrices import collega_matrici, lega_lease
+
+# Monte Carlo LCIA: incertezza del background (distribuzioni dei datapackage Brightway) e del foreground
+# (±% uniforme per exchange). Le iterazioni girano in un pool di processi; la tecnosfera deterministica
+# viene collegata dall'archivio condiviso delle matrici di background, mentre soluzione di partenza e
+# matrice di caratterizzazione sono in memoria condivisa (nessuna copia per worker). Ogni worker
+# fattorizza una sola volta la tecnosfera deterministica e la usa come precondizionatore di GMRES,
+# partendo dalla supply deterministica: sulle matrici campionate converge in poche iterazioni.
+
+SpreadType = Union[float, Dict[Tuple[str, str], float]]
+
+_WORKER: Dict[str, Any] = {}
+
+
+class _SharedArrays:
+    """Più array numpy in un unico blocco di memoria condivisa, descritto da un layout serializzabile."""
+
+    def __init__(self, arrays: Optional[Dict[str, np.ndarray]] = None, name: Optional[str] = None,
+                 layout: Optional[Dict[str, Tuple[int, str, Tuple[int, ...]]]] = None):
+        if arrays is not None:
+            layout, offset = {}, 0
+            for key, arr in arrays.items():
+                arr = np.ascontiguousarray(arr)
+                layout[key] = (offset, arr.dtype.str, arr.shape)
+                offset += -(-arr.nbytes // 8) * 8  # allineamento a 8 byte
+            self.shm = shared_memory.SharedMemory(create=True, size=max(offset, 8))
+            self.layout = layout
+            for key, arr in arrays.items():
+                self[key][...] = arr
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.layout = layout
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        offset, dtype, shape = self.layout[key]
+        return np.ndarray(shape, dtype=np.dtype(dtype), buffer=self.shm.buf, offset=offset)
+
+    def close(self, unlink: bool = False) -> None:
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def _gmres(A, b, x0, M):
+    try:
+        return gmres(A, b, x0=x0, M=M, rtol=1e-8, atol=0.0)
+    except TypeError:  # scipy < 1.12
+        return gmres(A, b, x0=x0, M=M, tol=1e-8, atol=0.0)
+
+
+def _init_worker(project: str, databases: Tuple[str, ...], shm_name: str, layout: Dict[str, Any]) -> None:
+    """Inizializzatore del worker: progetto, memoria condivisa, precondizionatore LU, LCA con distribuzioni."""
+    bd.projects.set_current(project)
+    shared = _SharedArrays(name=shm_name, layout=layout)
+    attached = collega_matrici(tuple(databases))
+    if attached is not None:
+        A0 = attached["technosphere"]
+        lu = splu(A0.copy())
+    else:
+        # Archivio non (più) disponibile: matrici e LU costruite nel worker (e ripubblicate per gli altri)
+        bg = background_system(tuple(databases))
+        A0, lu = bg.technosphere, bg.lu
+    n = A0.shape[0]
+    C = sp.csr_matrix(
+        (shared["c_data"], shared["c_indices"], shared["c_indptr"]), shape=tuple(shared["c_shape"])
+    )
+    any_id = technosphere_node_id(databases) if n else None
+    if any_id is None:
+        # Foreground con soli flussi di biosfera: si campiona solo l'incertezza del foreground
+        _WORKER.update(shared=shared, C=C, lca=None, M=None)
+        return
+    lca = bc.LCA(
+        {any_id: 1.0},
+        data_objs=[bd.Database(name).datapackage() for name in databases],
+        use_distributions=True,
+        seed_override=int.from_bytes(os.urandom(4), "little"),
+    )
+    lca.load_lci_data()
+    if lca.technosphere_matrix.shape != A0.shape:
+        raise RuntimeError("Sampled technosphere does not match the shared background system.")
+    if attached is not None:
+        lega_lease(lca, attached["lease"])
+    _WORKER.update(
+        shared=shared, C=C, lca=lca,
+        M=LinearOperator((n, n), matvec=lu.solve, dtype=np.float64),
+    )
+
+
+def _run_batch(iterations: int, seed: int) -> np.ndarray:
+    """Esegue `iterations` iterazioni Monte Carlo; ritorna i punteggi (iterations × n_metodi)."""
+    shared, C, lca, M = _WORKER["shared"], _WORKER["C"], _WORKER["lca"], _WORKER["M"]
+    rng = np.random.default_rng(seed)
+    x0 = shared["x0"]
+    fg_rows, fg_values, fg_spread = shared["fg_rows"], shared["fg_values"], shared["fg_spread"]
+    bio_scores, bio_spread = shared["bio_scores"], shared["bio_spread"]
+    x_f = float(shared["x_f"][0])
+    n = len(x0)
+
+    out = np.empty((iterations, C.shape[0]))
+    for it in range(iterations):
+        bio_mult = 1.0 + bio_spread * rng.uniform(-1.0, 1.0, len(bio_spread))
+        if lca is None:
+            out[it] = bio_scores.T @ bio_mult * x_f
+            continue
+        next(lca.technosphere_mm)
+        next(lca.biosphere_mm)
+        A = lca.technosphere_mm.matrix.tocsc()
+        B = lca.biosphere_mm.matrix.tocsr()
+
+        mult = 1.0 + fg_spread * rng.uniform(-1.0, 1.0, len(fg_values))
+        rhs = np.zeros(n)
+        np.add.at(rhs, fg_rows, -fg_values * mult * x_f)
+        x, info = _gmres(A, rhs, x0, M)
+        if info != 0:
+            x = spsolve(A, rhs)
+        out[it] = C @ (B @ x) + bio_scores.T @ bio_mult * x_f
+    return out
+
+
+def _foreground_design(
+    exchanges: List[Dict[str, Any]],
+    process_key: Tuple[str, str],
+    bg,
+    stack: Dict[str, Any],
+    targets: Dict[Tuple[str, str], Dict[str, Any]],
+    spread: SpreadType,
+) -> Dict[str, np.ndarray]:
+    """Entrate del foreground campionabili: righe/valori in tecnosfera e punteggi diretti dei flussi di biosfera."""
+    negative = set(bd.labels.technosphere_negative_edge_types)
+
+    def _spread(key) -> float:
+        value = spread.get(key, 0.0) if isinstance(spread, dict) else spread
+        return abs(float(value or 0.0)) / 100.0
+
+    rows, values, spreads, bio_ids, bio_amounts, bio_spreads = [], [], [], [], [], []
+    for ex in exchanges:
+        key = tuple(ex["input"])
+        meta = targets.get(key)
+        if key == tuple(process_key) or meta is None:
+            continue
+        if ex["type"] == "biosphere":
+            bio_ids.append(meta["id"])
+            bio_amounts.append(ex["amount"])
+            bio_spreads.append(_spread(key))
+        elif meta["id"] in bg.product_index:
+            rows.append(bg.product_index[meta["id"]])
+            values.append(-ex["amount"] if ex["type"] in negative else ex["amount"])
+            spreads.append(_spread(key))
+    bio_scores = (
+        project_stack(stack, bio_ids).toarray().T * np.array(bio_amounts)[:, np.newaxis]
+        if bio_ids else np.zeros((0, len(stack["methods"])))
+    )
+    return {
+        "fg_rows": np.array(rows, dtype=np.int64),
+        "fg_values": np.array(values, dtype=np.float64),
+        "fg_spread": np.array(spreads, dtype=np.float64),
+        "bio_scores": bio_scores,
+        "bio_spread": np.array(bio_spreads, dtype=np.float64),
+    }
+
+
+def _stats(samples: np.ndarray, methods: List[Tuple], deterministic: np.ndarray) -> Dict[str, Any]:
+    n = samples.shape[0]
+    mean = samples.mean(axis=0)
+    std = samples.std(axis=0, ddof=1) if n > 1 else np.zeros_like(mean)
+    sem = std / np.sqrt(n) if n else std
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rel_sem = np.where(mean != 0, np.abs(sem / mean), 0.0)
+    return {
+        "iterations": n,
+        "methods": [str(m) for m in methods],
+        "deterministic": deterministic,
+        "mean": mean,
+        "std": std,
+        "sem": sem,
+        "rel_sem": rel_sem,
+        "p2_5": np.percentile(samples, 2.5, axis=0),
+        "p97_5": np.percentile(samples, 97.5, axis=0),
+        "samples": samples,
+    }
+
+
+def monte_carlo_lcia(
+    exchanges: List[Dict[str, Any]],
+    process_key: Tuple[str, str],
+    methods: List[Tuple],
+    targets: Optional[Dict[Tuple[str, str], Dict[str, Any]]] = None,
+    foreground_spread: SpreadType = 0.0,
+    max_iterations: int = 1000,
+    min_iterations: int = 100,
+    rel_tolerance: float = 0.01,
+    batch_size: int = 25,
+    workers: Optional[int] = None,
+    seed: Optional[int] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Generatore: dopo ogni batch completato restituisce le statistiche correnti (media, dev. standard, errore
+    standard relativo, intervallo 95%, campioni). Si ferma a max_iterations o, dopo min_iterations, quando
+    l'errore standard relativo di tutte le categorie scende sotto rel_tolerance ("converged": True).
+    Interrompere l'iterazione (es. rerun Streamlit) chiude il pool e libera la memoria condivisa.
+    foreground_spread: ±% uniforme per tutti gli exchanges o {(db, code): ±%}.
+    """
+    methods = [tuple(m) for m in methods]
+    process_key = tuple(process_key)
+    exchanges = flatten_foreground(exchanges, process_key)
+    databases = tuple(background_databases(
+        {ex["input"][0] for ex in exchanges if tuple(ex["input"]) != process_key}, exclude={process_key[0]}
+    ))
+    bg = background_system(databases)
+    if targets is None:
+        targets = resolve_activities(ex["input"] for ex in exchanges if tuple(ex["input"]) != process_key)
+    column = foreground_column(exchanges, process_key, bg, targets)
+    solved = solve_foreground(column, bg)
+    stack = stacked_characterization(tuple(methods))
+    C_bg = project_stack(stack, bg.biosphere_ids)
+    design = _foreground_design(exchanges, process_key, bg, stack, targets, foreground_spread)
+    deterministic = (
+        C_bg @ (bg.biosphere @ solved["supply"]) + design["bio_scores"].T @ np.ones(len(design["bio_spread"])) * solved["x_f"]
+    )
+
+    shared = _SharedArrays({
+        "c_data": C_bg.data, "c_indices": C_bg.indices, "c_indptr": C_bg.indptr, "c_shape": np.array(C_bg.shape),
+        "x0": solved["supply"], "x_f": np.array([solved["x_f"]]),
+        **design,
+    })
+    rng = np.random.default_rng(seed)
+    workers = workers or max(1, min(4, (os.cpu_count() or 2) - 1))
+    pool = ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(bd.projects.current, databases, shared.name, shared.layout),
+    )
+    batches: List[np.ndarray] = []
+    pending: set = set()
+    submitted = 0
+
+    def _fill() -> None:
+        # Al più due batch in coda per worker: lo stop anticipato spreca poco lavoro
+        nonlocal submitted
+        while submitted < max_iterations and len(pending) < 2 * workers:
+            size = min(batch_size, max_iterations - submitted)
+            pending.add(pool.submit(_run_batch, size, int(rng.integers(2**31))))
+            submitted += size
+
+    try:
+        _fill()
+        while pending:
+            done, still_running = wait(pending, return_when=FIRST_COMPLETED)
+            pending.intersection_update(still_running)
+            for future in done:
+                batches.append(future.result())
+            stats = _stats(np.vstack(batches), methods, deterministic)
+            stats["converged"] = bool(stats["iterations"] >= min_iterations and np.all(stats["rel_sem"] < rel_tolerance))
+            yield stats
+            if stats["converged"]:
+                break
+            _fill()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+        shared.close(unlink=True)
+
+
+def esegui_monte_carlo(
+    exchanges: List[Dict[str, Any]],
+    process_key: Tuple[str, str],
+    methods: List[Tuple],
+    progress: Optional[Callable[[float, str], None]] = None,
+    cancel: Optional[threading.Event] = None,
+    **options,
+) -> Optional[Dict[str, Any]]:
+    """
+    monte_carlo_lcia come job (core.jobs), nel worker del progetto: avanzamento a ogni batch.
+    L'annullamento ferma le iterazioni e ritorna le statistiche parziali (None se nessun batch è concluso).
+    """
+    max_iterations = options.get("max_iterations", 1000)
+    stats = None
+    runner = monte_carlo_lcia(exchanges, process_key, methods, **options)
+    try:
+        for stats in runner:
+            if cancel is not None and cancel.is_set():
+                break
+            if progress is not None:
+                progress(
+                    stats["iterations"] / max_iterations,
+                    f"Iterations: {stats['iterations']} — max rel. SEM {100 * float(np.max(stats['rel_sem'], initial=0.0)):.2f}%",
+                )
+    except JobCancelled:
+        pass
+    finally:
+        runner.close()
+    return stats
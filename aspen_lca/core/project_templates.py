@@ -0,0 +1,146 @@
+# core/project_templates.py
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+import bw2data as bd
+import bw2io as bi
+
+from core.ecospold_import import importa_ecospold_locale
+from core.jobs import check_cancelled
+from core.project_workers import chiudi_pool, esegui_isolato, esegui_nel_progetto
+
+# Template di progetto Brightway: un progetto costruito una sola volta (biosfera, metodi, eventualmente
+# ecoinvent) e registrato localmente; i nuovi progetti sono cloni della sua cartella (bd.projects.copy_project),
+# quindi la creazione è offline e richiede pochi secondi invece di un'installazione remota ogni volta.
+
+TEMPLATE_PREFIX = "__aspen_template__"
+DEFAULT_REMOTE_PROJECT = "ecoinvent-3.10-biosphere"
+
+_LOCK = threading.Lock()
+
+
+def registry_path() -> Path:
+    """Registro dei template (override con la variabile d'ambiente ASPEN_LCA_HOME)."""
+    base = Path(os.environ.get("ASPEN_LCA_HOME", Path.home() / ".aspen_lca"))
+    return base / "project_templates.json"
+
+
+def carica_registro() -> Dict[str, Dict[str, Any]]:
+    path = registry_path()
+    if not path.exists():
+        return {}
+    registry = json.loads(path.read_text(encoding="utf-8"))
+    # Solo i template il cui progetto esiste ancora
+    return {name: entry for name, entry in registry.items() if entry.get("project") in bd.projects}
+
+
+def _salva_registro(registry: Dict[str, Dict[str, Any]]) -> None:
+    path = registry_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(registry, indent=2, default=str), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _costruisci_progetto(
+    project: str,
+    remote_project: Optional[str],
+    ecospold_path: Optional[str],
+    ecospold_db: Optional[str],
+    progress: Callable[[float, str], None],
+    cancel,
+) -> Dict[str, Any]:
+    """Eseguita in un processo isolato: crea e popola il progetto template; se qualcosa fallisce lo elimina."""
+    if project in bd.projects:
+        raise ValueError(f"Template project '{project}' already exists.")
+    try:
+        if remote_project:
+            progress(0.05, f"Installing {remote_project}")
+            bi.remote.install_project(remote_project, project)
+        else:
+            bd.projects.create_project(project)
+        bd.projects.set_current(project)
+        check_cancelled(cancel)
+        if ecospold_path and ecospold_db:
+            importa_ecospold_locale(
+                ecospold_path, ecospold_db,
+                progress=lambda f, m="": progress(0.3 + 0.65 * f, m), cancel=cancel,
+            )
+        return {
+            "project": project,
+            "created": time.time(),
+            "databases": sorted(bd.databases),
+            "methods": len(bd.methods),
+            "remote_project": remote_project,
+        }
+    except BaseException:
+        # Nessun template a metà: bloccherebbe una nuova costruzione con lo stesso nome
+        if project in bd.projects:
+            bd.projects.delete_project(project, delete_dir=True)
+        raise
+
+
+def _copia_progetto(new_project: str) -> None:
+    """Eseguita nel worker del progetto template: copia della cartella, senza cambiare progetto attivo."""
+    bd.projects.copy_project(new_project, switch=False)
+
+
+def costruisci_template(
+    name: str,
+    remote_project: Optional[str] = DEFAULT_REMOTE_PROJECT,
+    ecospold_path: Optional[str] = None,
+    ecospold_db: Optional[str] = None,
+    progress: Optional[Callable[[float, str], None]] = None,
+    cancel: Optional[threading.Event] = None,
+) -> Dict[str, Any]:
+    """
+    Costruisce (una volta) il progetto template: installazione remota di biosfera e metodi
+    (unico passaggio che richiede rete) e, facoltativamente, import di un ecospold2 locale.
+    Il progetto viene creato e popolato in un processo isolato (il progetto attivo del server non cambia).
+    Pensata per girare come job (core.jobs). Ritorna la voce di registro.
+    """
+    progress = progress or (lambda fraction, message="": None)
+    project = f"{TEMPLATE_PREFIX}{name}"
+    if project in bd.projects:
+        raise ValueError(f"Template '{name}' already exists.")
+
+    entry = esegui_isolato(
+        _costruisci_progetto, project, remote_project, ecospold_path, ecospold_db, progress=progress, cancel=cancel,
+    )
+    with _LOCK:
+        registry = carica_registro()
+        registry[name] = entry
+        _salva_registro(registry)
+    progress(1.0, "Template ready")
+    return entry
+
+
+def crea_da_template(template: str, new_project: str) -> str:
+    """
+    Nuovo progetto come clone della cartella del template: offline, nessuna reinstallazione.
+    La copia avviene nel worker legato al template; il progetto attivo del server non cambia.
+    """
+    entry = carica_registro().get(template)
+    if entry is None:
+        raise KeyError(f"Template '{template}' not found.")
+    if new_project in bd.projects:
+        raise ValueError(f"Project '{new_project}' already exists.")
+    esegui_nel_progetto(entry["project"], _copia_progetto, new_project)
+    return new_project
+
+
+def elimina_template(template: str) -> None:
+    with _LOCK:
+        registry = carica_registro()
+        entry = registry.pop(template, None)
+        _salva_registro(registry)
+    if entry and entry["project"] in bd.projects:
+        chiudi_pool(entry["project"])
+        bd.projects.delete_project(entry["project"], delete_dir=True)
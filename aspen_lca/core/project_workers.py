@@ -0,0 +1,267 @@
+# core/project_workers.py
+
+from __future__ import annotations
+
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from queue import Empty
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import bw2data as bd
+
+from core.background import BackgroundSystem, background_system
+from core.jobs import JobCancelled, submit_job
+from core.method_catalog import method_catalog
+
+# Isolamento per sessione: il progetto attivo di Brightway è stato globale del processo, quindi due sessioni
+# Streamlit che chiamano bd.projects.set_current si cambierebbero il progetto a vicenda durante un calcolo.
+# Ogni progetto ha invece un proprio pool di processi worker legati a quel progetto (set_current una sola
+# volta, all'avvio del worker): le chiamate di una sessione vanno al pool del suo progetto, senza lock globali,
+# e ogni worker mantiene calde le proprie cache (indici di ricerca, metadati).
+# I calcoli che usano il sistema di background (LCIA, contributi, catena di fornitura, sensitività, Monte Carlo,
+# atlante) vanno invece all'unico processo "solver" del progetto (esegui_solver): la fattorizzazione LU è in
+# memoria una sola volta per progetto ed è sempre calda per le chiamate successive sullo stesso risultato.
+# Il processo Streamlit non attiva mai un progetto: anche i metadati (database, metodi) si leggono nei worker.
+
+# Worker generici per progetto (più il processo solver) e numero massimo di progetti con pool attivi
+# (il meno usato di recente viene chiuso)
+WORKERS_PER_PROJECT = int(os.environ.get("ASPEN_LCA_WORKERS_PER_PROJECT", 2))
+MAX_PROJECTS = int(os.environ.get("ASPEN_LCA_MAX_PROJECT_POOLS", 4))
+# Intervallo di inoltro dell'avanzamento dal worker al job
+_POLL = 0.2
+
+# spawn: il processo Streamlit ha thread e connessioni SQLite aperte, che un fork duplicherebbe
+_CTX = multiprocessing.get_context("spawn")
+# {progetto: {solver (bool): pool}}
+_POOLS: "OrderedDict[str, Dict[bool, ProcessPoolExecutor]]" = OrderedDict()
+_LOCK = threading.Lock()
+_MANAGER = None
+
+# Nel worker: data di modifica dei file di metadati già letti
+_METADATA_MTIMES: Dict[str, Optional[float]] = {}
+# Nel processo Streamlit: {progetto: (impronta, metadati)} letti dai worker
+_METADATI: Dict[str, Tuple[Any, Dict[str, Any]]] = {}
+
+
+class BackgroundRef(NamedTuple):
+    """Riferimento serializzabile a un BackgroundSystem (la LU di SuperLU non attraversa i processi)."""
+    databases: Tuple[str, ...]
+
+
+def _init_worker(project: str) -> None:
+    bd.projects.set_current(project)
+
+
+def _ricarica_metadati() -> None:
+    """databases.json e methods.json sono letti una volta per processo: ricaricati se modificati altrove."""
+    for meta in (bd.databases, bd.methods):
+        path = Path(meta.filepath)
+        mtime = path.stat().st_mtime if path.exists() else None
+        if str(path) in _METADATA_MTIMES and _METADATA_MTIMES[str(path)] != mtime:
+            meta.load()
+        _METADATA_MTIMES[str(path)] = mtime
+
+
+def _leggi_metadati(known: Any) -> Tuple[Any, Optional[Dict[str, Any]]]:
+    """Eseguita nel worker: impronta dei metadati e, se diversa da `known`, database e catalogo dei metodi."""
+    fingerprint = tuple(
+        (os.stat(meta.filepath).st_mtime if os.path.exists(meta.filepath) else None, len(meta))
+        for meta in (bd.databases, bd.methods)
+    )
+    if fingerprint == known:
+        return fingerprint, None
+    return fingerprint, {"databases": sorted(bd.databases), "methods": method_catalog()}
+
+
+def _esporta(value: Any) -> Any:
+    if isinstance(value, dict) and isinstance(value.get("background"), BackgroundSystem):
+        return dict(value, background=BackgroundRef(value["background"].databases))
+    return value
+
+
+def _importa(value: Any) -> Any:
+    # Nel processo solver del progetto la fattorizzazione è in cache: nessun ricalcolo
+    if isinstance(value, dict) and isinstance(value.get("background"), BackgroundRef):
+        return dict(value, background=background_system(tuple(value["background"].databases)))
+    return value
+
+
+def _call(fn: Callable[..., Any], args: tuple, kwargs: Dict[str, Any], channel) -> Any:
+    """Eseguita nel worker: progress/cancel del job arrivano come coda ed Event del manager."""
+    _ricarica_metadati()
+    if channel is not None:
+        queue, stop = channel
+
+        def progress(fraction: float, message: str = "") -> None:
+            if stop.is_set():
+                raise JobCancelled()
+            queue.put((fraction, message))
+
+        kwargs = dict(kwargs, progress=progress, cancel=stop)
+    args = tuple(_importa(a) for a in args)
+    kwargs = {k: _importa(v) for k, v in kwargs.items()}
+    return _esporta(fn(*args, **kwargs))
+
+
+def _manager():
+    global _MANAGER
+    with _LOCK:
+        if _MANAGER is None:
+            _MANAGER = _CTX.Manager()
+        return _MANAGER
+
+
+def _pool(project: str, solver: bool) -> ProcessPoolExecutor:
+    with _LOCK:
+        pools = _POOLS.pop(project, None)
+        if pools is None:
+            if project not in bd.projects:
+                raise ValueError(f"Project '{project}' not found.")
+            pools = {}
+        pool = pools.get(solver)
+        if pool is None:
+            pool = pools[solver] = ProcessPoolExecutor(
+                max_workers=1 if solver else WORKERS_PER_PROJECT,
+                mp_context=_CTX,
+                initializer=_init_worker,
+                initargs=(project,),
+            )
+        _POOLS[project] = pools
+        while len(_POOLS) > MAX_PROJECTS:
+            # I calcoli già accodati sui pool chiusi terminano comunque
+            _, old = _POOLS.popitem(last=False)
+            for p in old.values():
+                p.shutdown(wait=False)
+        return pool
+
+
+def _scarta(project: str, solver: bool, pool: ProcessPoolExecutor) -> None:
+    with _LOCK:
+        pools = _POOLS.get(project, {})
+        if pools.get(solver) is pool:
+            del pools[solver]
+    pool.shutdown(wait=False)
+
+
+def _esegui(project: str, solver: bool, fn, args, kwargs, progress, cancel) -> Any:
+    pool = _pool(project, solver)
+    try:
+        return _attendi(pool, fn, args, kwargs, progress, cancel)
+    except BrokenProcessPool:
+        # Worker terminato in modo anomalo: il prossimo calcolo ricrea il pool
+        _scarta(project, solver, pool)
+        raise
+
+
+def esegui_nel_progetto(
+    project: str,
+    fn: Callable[..., Any],
+    *args,
+    progress: Optional[Callable[[float, str], None]] = None,
+    cancel: Optional[threading.Event] = None,
+    **kwargs,
+) -> Any:
+    """
+    Esegue fn(*args, **kwargs) in un worker legato a `project` e ne ritorna il risultato (bloccante).
+    fn, argomenti e risultato devono essere serializzabili.
+    Con progress/cancel (esecuzione come job, core.jobs) l'avanzamento è inoltrato e l'annullamento propagato.
+    Per i calcoli che usano il sistema di background si usa esegui_solver.
+    """
+    return _esegui(project, False, fn, args, kwargs, progress, cancel)
+
+
+def esegui_solver(
+    project: str,
+    fn: Callable[..., Any],
+    *args,
+    progress: Optional[Callable[[float, str], None]] = None,
+    cancel: Optional[threading.Event] = None,
+    **kwargs,
+) -> Any:
+    """
+    Come esegui_nel_progetto, ma nel processo solver del progetto (uno solo), che tiene in cache la
+    fattorizzazione del background. I BackgroundSystem nei dict di risultato viaggiano come BackgroundRef
+    e tornano a essere il sistema in cache quando passati di nuovo al solver.
+    """
+    return _esegui(project, True, fn, args, kwargs, progress, cancel)
+
+
+def esegui_isolato(
+    fn: Callable[..., Any],
+    *args,
+    progress: Optional[Callable[[float, str], None]] = None,
+    cancel: Optional[threading.Event] = None,
+    **kwargs,
+) -> Any:
+    """
+    Come esegui_nel_progetto, ma in un processo nuovo usato una sola volta: per operazioni che creano
+    progetti o cambiano il progetto attivo (es. costruzione di un template) senza toccare né il processo
+    Streamlit né i worker di progetto.
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=_CTX) as pool:
+        return _attendi(pool, fn, args, kwargs, progress, cancel)
+
+
+def _attendi(pool: ProcessPoolExecutor, fn, args, kwargs, progress, cancel) -> Any:
+    if progress is None and cancel is None:
+        return pool.submit(_call, fn, args, kwargs, None).result()
+
+    manager = _manager()
+    queue, stop = manager.Queue(), manager.Event()
+    future = pool.submit(_call, fn, args, kwargs, (queue, stop))
+    while not future.done() or not queue.empty():
+        try:
+            fraction, message = queue.get(timeout=_POLL)
+        except Empty:
+            fraction = None
+        if cancel is not None and cancel.is_set():
+            stop.set()
+        if fraction is not None and progress is not None and not stop.is_set():
+            try:
+                progress(fraction, message)
+            except JobCancelled:
+                stop.set()
+    return future.result()
+
+
+def job_nel_progetto(kind: str, project: str, fn: Callable[..., Any], *args, solver: bool = False, **kwargs) -> str:
+    """
+    Accoda come job (core.jobs) l'esecuzione di fn nel worker di `project` (solver=True: nel processo
+    solver, per i calcoli sul sistema di background); ritorna l'id del job.
+    """
+    esegui = esegui_solver if solver else esegui_nel_progetto
+    return submit_job(kind, esegui, project, fn, *args, project=project, **kwargs)
+
+
+def metadati_progetto(project: str) -> Dict[str, Any]:
+    """
+    {"databases": [nomi ordinati], "methods": catalogo (core.method_catalog)} di `project`, letti nel suo worker.
+    Il risultato resta in cache nel processo Streamlit finché databases.json e methods.json non cambiano.
+    """
+    known = _METADATI.get(project)
+    fingerprint, payload = esegui_nel_progetto(project, _leggi_metadati, known[0] if known else None)
+    if payload is None:
+        return known[1]
+    with _LOCK:
+        _METADATI[project] = (fingerprint, payload)
+    return payload
+
+
+def elenco_database(project: str) -> List[str]:
+    return metadati_progetto(project)["databases"]
+
+
+def chiudi_pool(project: Optional[str] = None) -> None:
+    """Chiude i pool di un progetto (es. dopo eliminazione) o tutti."""
+    with _LOCK:
+        names = [project] if project else list(_POOLS)
+        pools = [p for n in names if n in _POOLS for p in _POOLS.pop(n).values()]
+        for name in [project] if project else list(_METADATI):
+            _METADATI.pop(name, None)
+    for pool in pools:
+        pool.shutdown(wait=False)
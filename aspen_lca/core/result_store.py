@@ -0,0 +1,124 @@
+# core/result_store.py
+
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Tuple
+
+import bw2data as bd
+
+from core.background import background_databases
+from core.cache import method_fingerprint
+
+# Archivio persistente dei punteggi LCIA (SQLite nella cartella del progetto Brightway).
+# Chiave: hash canonico degli exchanges del foreground + versioni ('modified') dei database di background,
+# e impronta del metodo. Una riga per (inventario, metodo): si calcolano solo le categorie mancanti.
+
+STORE_FILENAME = "aspen_lcia_results.sqlite"
+# Limite di righe; oltre, si eliminano le meno usate di recente (LRU)
+MAX_ROWS = 50_000
+
+_LOCK = threading.Lock()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    inventory TEXT NOT NULL,
+    method TEXT NOT NULL,
+    method_label TEXT,
+    score REAL NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (inventory, method)
+);
+CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used);
+"""
+
+
+def store_path() -> Path:
+    return Path(bd.projects.dir) / STORE_FILENAME
+
+
+@contextmanager
+def _connect():
+    """Connessione breve (commit alla fine, sempre chiusa): l'archivio è condiviso tra sessioni e processi."""
+    conn = sqlite3.connect(str(store_path()), timeout=30)
+    try:
+        conn.executescript(_SCHEMA)
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _hash(payload: Any) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def inventory_key(exchanges: List[Dict[str, Any]], process_key: Tuple[str, str]) -> str:
+    """
+    Hash canonico del processo foreground: exchanges ordinati (l'autoriferimento diventa "__self__",
+    quindi lo stesso inventario in memoria o salvato ha la stessa chiave) + versioni dei database di background.
+    """
+    process_key = tuple(process_key)
+    canonical = sorted(
+        (ex["type"], "__self__" if tuple(ex["input"]) == process_key else list(ex["input"]), repr(float(ex["amount"])))
+        for ex in exchanges
+    )
+    inputs = {ex["input"][0] for ex in exchanges if tuple(ex["input"]) != process_key}
+    versions = [[d, bd.databases[d].get("modified")] for d in background_databases(inputs)]
+    return _hash([bd.projects.current, canonical, versions])
+
+
+def method_key(method: Tuple) -> str:
+    fp = method_fingerprint(method)
+    return _hash([list(method), fp[2], fp[3]])
+
+
+def leggi_risultati(inventory: str, methods: Iterable[Tuple]) -> Dict[Tuple, float]:
+    """Punteggi già salvati per l'inventario dato ({metodo: score}); aggiorna last_used delle righe lette."""
+    methods = [tuple(m) for m in methods]
+    keys = {method_key(m): m for m in methods}
+    if not keys:
+        return {}
+    now = time.time()
+    with _LOCK, _connect() as conn:
+        placeholders = ",".join("?" * len(keys))
+        rows = conn.execute(
+            f"SELECT method, score FROM results WHERE inventory = ? AND method IN ({placeholders})",
+            [inventory, *keys],
+        ).fetchall()
+        conn.execute(
+            f"UPDATE results SET last_used = ? WHERE inventory = ? AND method IN ({placeholders})",
+            [now, inventory, *keys],
+        )
+    return {keys[k]: float(score) for k, score in rows}
+
+
+def salva_risultati(inventory: str, scores: Dict[Tuple, float], max_rows: int = MAX_ROWS) -> None:
+    """Salva i punteggi e applica l'eviction LRU oltre max_rows."""
+    if not scores:
+        return
+    now = time.time()
+    with _LOCK, _connect() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO results (inventory, method, method_label, score, created, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(inventory, method_key(m), str(tuple(m)), float(s), now, now) for m, s in scores.items()],
+        )
+        excess = conn.execute("SELECT COUNT(*) FROM results").fetchone()[0] - max_rows
+        if excess > 0:
+            conn.execute(
+                "DELETE FROM results WHERE rowid IN (SELECT rowid FROM results ORDER BY last_used ASC LIMIT ?)",
+                (excess,),
+            )
+
+
+def svuota_risultati() -> None:
+    with _LOCK, _connect() as conn:
+        conn.execute("DELETE FROM results")
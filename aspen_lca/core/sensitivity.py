@@ -0,0 +1,153 @@
+# core/sensitivity.py
+
+from __future__ import annotations
+
+import itertools
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+import bw2data as bd
+
+from core.activity_lookup import resolve_activities
+from core.background import background_databases, background_system, flatten_foreground
+from core.characterization import project_stack, stacked_characterization
+
+# Sensitività sugli amount del foreground: tutti gli scenari diventano colonne di un'unica matrice di
+# termini noti, risolta con una sola chiamata alla fattorizzazione di background in cache.
+# Uno scenario è {"name": str, "factors": {(db, code): moltiplicatore}} (input non citati: fattore 1).
+
+ActivityKey = Tuple[str, str]
+
+
+def _linear_terms(
+    exchanges: List[Dict[str, Any]],
+    process_key: ActivityKey,
+    bg,
+    stack: Dict[str, Any],
+    targets: Dict[ActivityKey, Dict[str, Any]],
+) -> Dict[str, Any]:
+    """Termini lineari del foreground: una colonna per exchange (tecnosfera) e punteggi diretti (biosfera)."""
+    negative = set(bd.labels.technosphere_negative_edge_types)
+    a_ff = 0.0
+    t_keys, t_rows, t_values = [], [], []
+    b_keys, b_ids, b_amounts = [], [], []
+    for ex in exchanges:
+        key = tuple(ex["input"])
+        value = -ex["amount"] if ex["type"] in negative else ex["amount"]
+        if key == tuple(process_key):
+            a_ff += value
+            continue
+        meta = targets.get(key)
+        if meta is None:
+            continue
+        if ex["type"] == "biosphere":
+            b_keys.append(key)
+            b_ids.append(meta["id"])
+            b_amounts.append(ex["amount"])
+        elif meta["id"] in bg.product_index:
+            t_keys.append(key)
+            t_rows.append(bg.product_index[meta["id"]])
+            t_values.append(value)
+    if not a_ff:
+        raise ValueError("The foreground process has no production exchange; cannot solve.")
+    T = sp.csc_matrix(
+        (np.array(t_values, dtype=np.float64), (np.array(t_rows, dtype=np.int64), np.arange(len(t_rows)))),
+        shape=(bg.technosphere.shape[0], len(t_rows)),
+    )
+    bio_scores = (
+        project_stack(stack, b_ids).toarray() * np.array(b_amounts)[np.newaxis, :]
+        if b_ids else np.zeros((len(stack["methods"]), 0))
+    )
+    return {"a_ff": a_ff, "t_keys": t_keys, "T": T, "b_keys": b_keys, "bio_scores": bio_scores}
+
+
+def _factor_matrix(keys: List[ActivityKey], scenarios: List[Dict[str, Any]]) -> np.ndarray:
+    return np.array(
+        [[float(sc.get("factors", {}).get(k, 1.0)) for sc in scenarios] for k in keys], dtype=np.float64
+    ).reshape(len(keys), len(scenarios))
+
+
+def solve_scenarios(
+    exchanges: List[Dict[str, Any]],
+    process_key: ActivityKey,
+    methods: List[Tuple],
+    scenarios: List[Dict[str, Any]],
+    targets: Optional[Dict[ActivityKey, Dict[str, Any]]] = None,
+) -> Dict[str, Any]:
+    """
+    Punteggi scenario × categoria: D = -T · F · x_f (una colonna per scenario), X = A^-1 D con una sola
+    chiamata alla LU, scores = C · B · X + punteggi diretti di biosfera · F_bio · x_f.
+    Ritorna {"scenarios": [nomi], "methods": [...], "scores": ndarray (n_scenari × n_metodi)}.
+    """
+    methods = [tuple(m) for m in methods]
+    process_key = tuple(process_key)
+    exchanges = flatten_foreground(exchanges, process_key)
+    inputs = [tuple(ex["input"]) for ex in exchanges if tuple(ex["input"]) != process_key]
+    bg = background_system(tuple(background_databases({k[0] for k in inputs}, exclude={process_key[0]})))
+    if targets is None:
+        targets = resolve_activities(inputs)
+    stack = stacked_characterization(tuple(methods))
+    terms = _linear_terms(exchanges, process_key, bg, stack, targets)
+    x_f = 1.0 / terms["a_ff"]
+
+    F_t = _factor_matrix(terms["t_keys"], scenarios)
+    F_b = _factor_matrix(terms["b_keys"], scenarios)
+    D = -(terms["T"] @ F_t) * x_f
+    X = bg.solve(np.asarray(D)).reshape(bg.technosphere.shape[0], len(scenarios))
+    C_bg = project_stack(stack, bg.biosphere_ids)
+    scores = np.asarray(C_bg @ (bg.biosphere @ X)) + terms["bio_scores"] @ F_b * x_f
+    return {
+        "scenarios": [sc.get("name", f"scenario {i}") for i, sc in enumerate(scenarios)],
+        "methods": methods,
+        "scores": scores.T,
+    }
+
+
+def one_at_a_time(
+    exchanges: List[Dict[str, Any]],
+    process_key: ActivityKey,
+    methods: List[Tuple],
+    keys: Optional[Iterable[ActivityKey]] = None,
+    delta: float = 0.10,
+    targets: Optional[Dict[ActivityKey, Dict[str, Any]]] = None,
+) -> Dict[str, Any]:
+    """
+    Sensitività one-at-a-time (±delta per input, default ±10%): baseline + 2 scenari per input, un'unica risoluzione.
+    Aggiunge "elasticities" {(db, code): ndarray n_metodi} = (S+ − S−) / (2·delta·S0).
+    """
+    if keys is None:
+        keys = {tuple(ex["input"]) for ex in exchanges if tuple(ex["input"]) != tuple(process_key)}
+    keys = sorted(tuple(k) for k in keys)
+    scenarios = [{"name": "baseline", "factors": {}}]
+    for k in keys:
+        scenarios.append({"name": f"{k[1]} +{delta:.0%}", "factors": {k: 1.0 + delta}})
+        scenarios.append({"name": f"{k[1]} -{delta:.0%}", "factors": {k: 1.0 - delta}})
+    res = solve_scenarios(exchanges, process_key, methods, scenarios, targets)
+    base = res["scores"][0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        res["elasticities"] = {
+            k: np.where(
+                base != 0,
+                (res["scores"][1 + 2 * i] - res["scores"][2 + 2 * i]) / (2.0 * delta * base),
+                0.0,
+            )
+            for i, k in enumerate(keys)
+        }
+    return res
+
+
+def grid(
+    exchanges: List[Dict[str, Any]],
+    process_key: ActivityKey,
+    methods: List[Tuple],
+    axes: Dict[ActivityKey, Sequence[float]],
+    targets: Optional[Dict[ActivityKey, Dict[str, Any]]] = None,
+) -> Dict[str, Any]:
+    """Griglia completa di moltiplicatori ({(db, code): [fattori]}): prodotto cartesiano, un'unica risoluzione."""
+    keys = list(axes)
+    scenarios = [
+        {"name": ", ".join(f"{k[1]}×{f:g}" for k, f in zip(keys, combo)), "factors": dict(zip(keys, combo))}
+        for combo in itertools.product(*(axes[k] for k in keys))
+    ]
+    return solve_scenarios(exchanges, process_key, methods, scenarios, targets)
@@ -0,0 +1,179 @@
+# core/shared_matrices.py
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+import uuid
+import weakref
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+import bw2data as bd
+
+# Matrici di background condivise tra processi e sessioni: CSC della tecnosfera, CSR della biosfera e
+# indici salvati una sola volta come file .npy e aperti in memory-map in sola lettura da ogni processo
+# (le pagine restano nella page cache del sistema operativo, una sola copia in RAM).
+# Durata a conteggio di riferimenti: ogni processo che usa un archivio crea un file di lease nella cartella
+# leases/ e lo rimuove al rilascio; gli archivi obsoleti senza lease attivi vengono eliminati.
+
+SHARED_DIRNAME = "aspen_shared"
+# Su Windows (nessun controllo del pid) i lease più vecchi di così sono considerati orfani
+LEASE_TIMEOUT = 24 * 3600
+# Archivi appena pubblicati non vengono raccolti: il processo che li ha scritti non ha ancora il lease
+PUBLISH_GRACE = 600
+
+_ARRAYS = (
+    "a_data", "a_indices", "a_indptr", "b_data", "b_indices", "b_indptr",
+    "product_ids", "product_rows", "activity_ids", "activity_cols", "biosphere_ids",
+)
+
+
+def _root() -> Path:
+    return Path(bd.projects.dir) / SHARED_DIRNAME
+
+
+def store_key(databases: Tuple[str, ...]) -> str:
+    """Chiave persistente dell'archivio: progetto + versione ('modified') di ogni database."""
+    payload = [bd.projects.current, [[d, bd.databases[d].get("modified")] for d in sorted(databases)]]
+    return hashlib.sha1(json.dumps(payload, default=str).encode("utf-8")).hexdigest()[:20]
+
+
+def pubblica_matrici(
+    databases: Tuple[str, ...],
+    technosphere: sp.csc_matrix,
+    biosphere: sp.csr_matrix,
+    product_index: Dict[int, int],
+    activity_index: Dict[int, int],
+    biosphere_ids: np.ndarray,
+) -> Path:
+    """Scrive l'archivio (cartella temporanea + rename atomico); se un altro processo l'ha già pubblicato lo riusa."""
+    folder = _root() / store_key(databases)
+    if (folder / "meta.json").exists():
+        return folder
+    tmp = _root() / f".{folder.name}.{uuid.uuid4().hex[:8]}.tmp"
+    tmp.mkdir(parents=True)
+    arrays = {
+        "a_data": technosphere.data, "a_indices": technosphere.indices, "a_indptr": technosphere.indptr,
+        "b_data": biosphere.data, "b_indices": biosphere.indices, "b_indptr": biosphere.indptr,
+        "product_ids": np.fromiter(product_index.keys(), dtype=np.int64, count=len(product_index)),
+        "product_rows": np.fromiter(product_index.values(), dtype=np.int64, count=len(product_index)),
+        "activity_ids": np.fromiter(activity_index.keys(), dtype=np.int64, count=len(activity_index)),
+        "activity_cols": np.fromiter(activity_index.values(), dtype=np.int64, count=len(activity_index)),
+        "biosphere_ids": np.asarray(biosphere_ids, dtype=np.int64),
+    }
+    for name, arr in arrays.items():
+        np.save(tmp / f"{name}.npy", np.ascontiguousarray(arr))
+    meta = {
+        "databases": list(databases),
+        "technosphere_shape": list(technosphere.shape),
+        "biosphere_shape": list(biosphere.shape),
+        "created": time.time(),
+    }
+    (tmp / "meta.json").write_text(json.dumps(meta), encoding="utf-8")
+    (tmp / "leases").mkdir()
+    try:
+        os.replace(tmp, folder)
+    except OSError:
+        # Pubblicato nel frattempo da un altro processo
+        shutil.rmtree(tmp, ignore_errors=True)
+    return folder
+
+
+def _release(lease: Path) -> None:
+    try:
+        lease.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def collega_matrici(databases: Tuple[str, ...]) -> Optional[Dict[str, Any]]:
+    """
+    Apre l'archivio in sola lettura (memory-map) e acquisisce un lease; None se non ancora pubblicato.
+    Ritorna {"technosphere", "biosphere", "product_index", "activity_index", "biosphere_ids", "lease", "path"}:
+    il lease va rilasciato con rilascia_matrici (o automaticamente alla distruzione dell'oggetto che lo possiede).
+    """
+    folder = _root() / store_key(databases)
+    if not (folder / "meta.json").exists():
+        return None
+    lease = folder / "leases" / f"{os.getpid()}-{uuid.uuid4().hex[:8]}.lease"
+    lease.parent.mkdir(exist_ok=True)
+    lease.write_text(str(time.time()), encoding="utf-8")
+
+    meta = json.loads((folder / "meta.json").read_text(encoding="utf-8"))
+    a = {name: np.load(folder / f"{name}.npy", mmap_mode="r") for name in _ARRAYS}
+    technosphere = sp.csc_matrix(
+        (a["a_data"], a["a_indices"], a["a_indptr"]), shape=tuple(meta["technosphere_shape"]), copy=False
+    )
+    biosphere = sp.csr_matrix(
+        (a["b_data"], a["b_indices"], a["b_indptr"]), shape=tuple(meta["biosphere_shape"]), copy=False
+    )
+    return {
+        "technosphere": technosphere,
+        "biosphere": biosphere,
+        "product_index": dict(zip(a["product_ids"].tolist(), a["product_rows"].tolist())),
+        "activity_index": dict(zip(a["activity_ids"].tolist(), a["activity_cols"].tolist())),
+        "biosphere_ids": np.asarray(a["biosphere_ids"]),
+        "lease": lease,
+        "path": folder,
+    }
+
+
+def lega_lease(owner: Any, lease: Path) -> None:
+    """Rilascia il lease quando `owner` viene distrutto (es. evizione dalla cache) o all'uscita del processo."""
+    weakref.finalize(owner, _release, lease)
+
+
+def rilascia_matrici(attached: Dict[str, Any]) -> None:
+    _release(attached["lease"])
+
+
+def _lease_alive(lease: Path) -> bool:
+    try:
+        age = time.time() - lease.stat().st_mtime
+    except FileNotFoundError:
+        return False
+    if sys.platform != "win32":
+        # Su POSIX basta verificare che il processo esista ancora (su Windows os.kill terminerebbe il processo)
+        try:
+            os.kill(int(lease.name.split("-", 1)[0]), 0)
+        except (ValueError, ProcessLookupError):
+            return False
+        except PermissionError:
+            return True
+        return True
+    return age <= LEASE_TIMEOUT
+
+
+def raccogli_inutilizzati(keep: Optional[Tuple[str, ...]] = None) -> int:
+    """
+    Elimina gli archivi senza lease attivi, tranne quello corrente di `keep` (database ancora validi).
+    Ritorna il numero di archivi rimossi. I lease orfani vengono eliminati durante il conteggio.
+    """
+    root = _root()
+    if not root.exists():
+        return 0
+    current = store_key(keep) if keep else None
+    removed = 0
+    for folder in root.iterdir():
+        if not folder.is_dir() or folder.name == current or folder.name.startswith("."):
+            continue
+        meta = folder / "meta.json"
+        if meta.exists() and time.time() - meta.stat().st_mtime < PUBLISH_GRACE:
+            continue
+        alive = 0
+        for lease in (folder / "leases").glob("*.lease") if (folder / "leases").exists() else []:
+            if _lease_alive(lease):
+                alive += 1
+            else:
+                _release(lease)
+        if not alive:
+            shutil.rmtree(folder, ignore_errors=True)
+            removed += 1
+    return removed
@@ -0,0 +1,141 @@
+# core/supply_chain.py
+
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from core.activity_lookup import resolve_activity_ids
+from core.background import background_system
+from core.cache import cached_by_fingerprint, database_fingerprint, method_fingerprint
+from core.characterization import project_stack, stacked_characterization
+from core.impact_atlas import carica_atlante
+
+# Esplorazione pigra della catena di fornitura del processo foreground: un nodo viene espanso solo su
+# richiesta, leggendo la colonna della tecnosfera del suo fornitore. Il punteggio cumulato di ogni ramo è
+# quantità × punteggio per unità del prodotto (sistema trasposto A^T z = B^T c, risolto una volta per metodo
+# o letto dall'atlante), quindi ogni click costa una sola colonna sparsa anche sul grafo ciclico di ecoinvent.
+
+
+def _impacts_fingerprint(databases: Tuple[str, ...], method: Tuple) -> Tuple:
+    return tuple(database_fingerprint(d) for d in databases) + (method_fingerprint(method),)
+
+
+@cached_by_fingerprint(_impacts_fingerprint, max_entries=16)
+def unit_impacts(databases: Tuple[str, ...], method: Tuple) -> Dict[str, np.ndarray]:
+    """
+    Per il background dato e un metodo: {"unit": z (punteggio per unità di ogni prodotto, righe),
+    "direct": h (impatto diretto per unità di attività, colonne), "row_to_col", "col_ids"}.
+    z viene letto dall'atlante su disco se ne esiste uno valido con questo metodo, altrimenti risolto.
+    """
+    bg = background_system(databases)
+    stack = stacked_characterization((tuple(method),))
+    h = np.asarray((project_stack(stack, bg.biosphere_ids) @ bg.biosphere).todense()).ravel()
+
+    col_ids = np.empty(bg.technosphere.shape[1], dtype=np.int64)
+    for activity_id, col in bg.activity_index.items():
+        col_ids[col] = activity_id
+    row_to_col = np.full(bg.technosphere.shape[0], -1, dtype=np.int64)
+    for product_id, row in bg.product_index.items():
+        row_to_col[row] = bg.activity_index.get(product_id, -1)
+
+    z = None
+    for db_name in databases:
+        atlas = carica_atlante(db_name)
+        if atlas is not None and tuple(method) in atlas["methods"] and tuple(atlas["databases"]) == tuple(databases):
+            z = np.asarray(atlas["scores"][:, atlas["methods"].index(tuple(method))], dtype=np.float64)
+            break
+    if z is None:
+        z = np.asarray(bg.solve(h, trans="T")).ravel()
+    return {"unit": z, "direct": h, "row_to_col": row_to_col, "col_ids": col_ids}
+
+
+def _node(key: str, meta: Dict[str, Any], row: Optional[int], col: Optional[int], amount: float,
+          score: float, direct: float, total: float, level: float) -> Dict[str, Any]:
+    return {
+        "key": key,
+        "row": row,
+        "col": col,
+        "name": meta.get("name", "-"),
+        "location": meta.get("location", ""),
+        "unit": meta.get("unit", ""),
+        "amount": float(amount),
+        "score": float(score),
+        "direct": float(direct),
+        "share": float(score / total) if total else 0.0,
+        # attività totale del nodo nell'intero sistema (supply già risolta): contesto per i cicli
+        "system_supply": float(level),
+        # prodotti senza attività produttrice nel background: non espandibili
+        "leaf": col is None and key != "root",
+    }
+
+
+def radice_catena(res: Dict[str, Any], method: Tuple) -> Dict[str, Any]:
+    """Nodo radice: il processo foreground (1 unità funzionale) con il punteggio totale del metodo."""
+    i = [tuple(m) for m in res["methods"]].index(tuple(method))
+    total = float(res["scores"][i])
+    bg = res["background"]
+    impacts = unit_impacts(bg.databases, tuple(method))
+    # Impatto diretto del foreground = totale − catene di background dei suoi input
+    upstream = float(-res["column"]["a_bf"] @ impacts["unit"]) * res["x_f"]
+    return _node("root", {"name": "Foreground process", "unit": "functional unit"}, None, None,
+                 1.0, total, total - upstream, total, res["x_f"])
+
+
+def espandi_nodo(
+    res: Dict[str, Any],
+    method: Tuple,
+    node: Dict[str, Any],
+    cutoff: float = 0.01,
+) -> List[Dict[str, Any]]:
+    """
+    Figli di un nodo (fornitori diretti) con |score| ≥ cutoff × |totale|, ordinati per |score|; i rami sotto
+    soglia sono aggregati in un'unica riga. Per la radice i fornitori vengono dalla colonna foreground.
+    """
+    bg = res["background"]
+    impacts = unit_impacts(bg.databases, tuple(method))
+    z, h = impacts["unit"], impacts["direct"]
+    total = float(res["scores"][[tuple(m) for m in res["methods"]].index(tuple(method))])
+
+    if node.get("leaf"):
+        return []
+    if node["key"] == "root":
+        demand = -np.asarray(res["column"]["a_bf"]) * res["x_f"]
+        rows = np.flatnonzero(demand)
+        amounts = demand[rows]
+    else:
+        col = node["col"]
+        column = bg.technosphere.getcol(col).tocoo()
+        production = column.data[column.row == node["row"]].sum() if node["row"] is not None else 0.0
+        if not production:
+            return []
+        scale = node["amount"] / production
+        keep = column.row != node["row"]
+        rows = column.row[keep]
+        amounts = -column.data[keep] * scale
+
+    scores = amounts * z[rows]
+    threshold = abs(total) * cutoff
+    above = np.abs(scores) >= threshold
+    order = np.argsort(-np.abs(scores[above]))
+    rows_kept, amounts_kept, scores_kept = rows[above][order], amounts[above][order], scores[above][order]
+
+    cols = impacts["row_to_col"][rows_kept]
+    metas = resolve_activity_ids(int(impacts["col_ids"][c]) for c in cols if c >= 0)
+    supply = np.asarray(res["supply"]).ravel()
+    children = []
+    for r, c, a, s in zip(rows_kept, cols, amounts_kept, scores_kept):
+        meta = metas.get(int(impacts["col_ids"][c]), {}) if c >= 0 else {}
+        production = bg.technosphere[r, c] if c >= 0 else 0.0
+        direct = h[c] * a / production if c >= 0 and production else 0.0
+        children.append(_node(f"{node['key']}/{int(r)}", meta, int(r), int(c) if c >= 0 else None,
+                              a, s, direct, total, supply[c] if c >= 0 else 0.0))
+    rest = float(scores[~above].sum())
+    if rest:
+        children.append({
+            "key": f"{node['key']}/rest", "row": None, "col": None, "leaf": True,
+            "name": f"{int((~above).sum())} suppliers below cutoff", "location": "", "unit": "",
+            "amount": 0.0, "score": rest, "direct": 0.0, "share": rest / total if total else 0.0, "system_supply": 0.0,
+        })
+    return children
@@ -0,0 +1,118 @@
+# core/unit_scores.py
+
+from __future__ import annotations
+
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+import bw2data as bd
+
+from core.activity_lookup import resolve_activities
+from core.background import BackgroundSystem, background_databases, background_system
+from core.cache import cached_by_fingerprint, database_fingerprint, method_fingerprint
+from core.characterization import project_stack, stacked_characterization
+from core.inventory_builder import MappingType, compile_exchanges
+
+# Scomposizione lineare foreground/background: il punteggio del processo foreground è lineare negli
+# amount dei suoi exchanges. Per ogni attività di background mappata si calcola (e mette in cache) il
+# vettore dei punteggi per unità su tutte le categorie; il risultato foreground è poi un prodotto scalare.
+
+INSTANT_PROCESS_KEY = ("__aspen_instant__", "foreground")
+
+
+def _unit_scores_fingerprint(databases: Tuple[str, ...], methods: Tuple[Tuple, ...], keys: Tuple) -> Tuple:
+    return tuple(database_fingerprint(d) for d in databases) + tuple(method_fingerprint(m) for m in methods)
+
+
+@cached_by_fingerprint(_unit_scores_fingerprint, max_entries=64)
+def unit_score_table(
+    databases: Tuple[str, ...],
+    methods: Tuple[Tuple, ...],
+    keys: Tuple[Tuple[str, str], ...],
+) -> Dict[Tuple[str, str], np.ndarray]:
+    """
+    {(db, code): vettore punteggi per unità (n_metodi)} per le attività/flussi dati.
+    - prodotti di tecnosfera: c_m · B · A^-1 · e_j, con un'unica risoluzione multi-colonna contro la LU
+      in cache (colonne e_j oppure, se i metodi sono meno delle attività, sistema trasposto con n_metodi colonne);
+    - flussi di biosfera: direttamente il CF del flusso.
+    """
+    bg: BackgroundSystem = background_system(databases)
+    stack = stacked_characterization(methods)
+    metas = resolve_activities(keys)
+    C_bg = project_stack(stack, bg.biosphere_ids)
+
+    out: Dict[Tuple[str, str], np.ndarray] = {}
+    techno = [(k, bg.product_index[m["id"]]) for k, m in metas.items() if m["id"] in bg.product_index]
+    if techno:
+        rows = np.array([r for _, r in techno])
+        if len(techno) <= len(methods):
+            E = np.zeros((bg.technosphere.shape[0], len(techno)))
+            E[rows, np.arange(len(techno))] = 1.0
+            U = np.asarray(C_bg @ (bg.biosphere @ bg.solve(E)))  # n_metodi × k
+        else:
+            Z = bg.solve(np.asarray((bg.biosphere.T @ C_bg.T).todense()), trans="T")  # n_prodotti × n_metodi
+            U = Z[rows, :].T
+        for j, (k, _) in enumerate(techno):
+            out[k] = np.asarray(U[:, j]).ravel()
+
+    bio_types = set(bd.labels.biosphere_node_types)
+    bio = [(k, m["id"]) for k, m in metas.items() if k not in out and m.get("type") in bio_types]
+    if bio:
+        C_bio = project_stack(stack, [i for _, i in bio]).toarray()
+        for j, (k, _) in enumerate(bio):
+            out[k] = C_bio[:, j]
+    return out
+
+
+def linear_foreground_scores(
+    exchanges: List[Dict[str, Any]],
+    process_key: Tuple[str, str],
+    methods: List[Tuple],
+) -> Dict[str, Any]:
+    """
+    Punteggi del processo foreground come combinazione lineare dei vettori per unità in cache:
+    score = Σ_j (domanda di background_j · u_j + emissione_j · cf_j) / produzione. Nessuna chiamata al solver
+    dopo il primo calcolo dei vettori. Ritorna {"results", "scores", "by_exchange"}.
+    """
+    methods = tuple(tuple(m) for m in methods)
+    process_key = tuple(process_key)
+    negative = set(bd.labels.technosphere_negative_edge_types)
+
+    keys = tuple(sorted({tuple(ex["input"]) for ex in exchanges if tuple(ex["input"]) != process_key}))
+    databases = tuple(background_databases({k[0] for k in keys}))
+    table = unit_score_table(databases, methods, keys) if keys else {}
+
+    a_ff = sum(
+        (-ex["amount"] if ex["type"] in negative else ex["amount"])
+        for ex in exchanges if tuple(ex["input"]) == process_key
+    )
+    if not a_ff:
+        raise ValueError("The foreground process has no production exchange; cannot score.")
+
+    total = np.zeros(len(methods))
+    by_exchange = []
+    for ex in exchanges:
+        key = tuple(ex["input"])
+        if key == process_key or key not in table:
+            continue
+        if ex["type"] == "biosphere":
+            weight = ex["amount"]
+        else:
+            # domanda sul background = -(valore in matrice); consumo > 0, sostituzione/co-prodotto < 0
+            weight = ex["amount"] if ex["type"] in negative else -ex["amount"]
+        contribution = table[key] * (weight / a_ff)
+        total += contribution
+        by_exchange.append({"input": key, "type": ex["type"], "amount": ex["amount"], "scores": contribution})
+    return {
+        "results": {str(m): float(s) for m, s in zip(methods, total)},
+        "scores": total,
+        "by_exchange": by_exchange,
+    }
+
+
+def instant_lcia(df_lci, mapping: MappingType, methods: List[Tuple]) -> Dict[str, Any]:
+    """LCIA istantanea da lci_df + mapping (amount, reference flow e densità modificabili al volo)."""
+    compiled = compile_exchanges(df_lci, mapping, INSTANT_PROCESS_KEY)
+    res = linear_foreground_scores(compiled["exchanges"], INSTANT_PROCESS_KEY, methods)
+    res["warnings"] = [w for w in compiled["warnings"] if w]
+    return res
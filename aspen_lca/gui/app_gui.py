@@ -11,15 +11,30 @@ from core.normalization import normalizza_flussi
 from core.database_management import gestione_database_brightway
 from core.mapping import mapping_flussi_activita
 from core.mapping_summary import mostra_tabella_riepilogo
+from core.mapping_library import mostra_libreria_mappature
 from core.lcia_selection import show_lcia_selector
+from core.method_catalog import method_unit
 from core.inventory_builder import build_inventory
-from core.lcia_runner import run_lcia
+from core.exploratory_lcia import run_lcia_in_memory_detailed
+from core.contributions import analizza_contributi
+from core.monte_carlo import esegui_monte_carlo
+from core.sensitivity import one_at_a_time
+from core.comparative import confronta_background
+from core.project_templates import DEFAULT_REMOTE_PROJECT, TEMPLATE_PREFIX, carica_registro, costruisci_template, crea_da_template
+from core.supply_chain import espandi_nodo, radice_catena
+from core.project_workers import (
+    elenco_database, esegui_isolato, esegui_nel_progetto, esegui_solver, job_nel_progetto, metadati_progetto,
+)
+from core.jobs import CANCELLED as JOB_CANCELLED, DONE as JOB_DONE, ERROR as JOB_ERROR, cancel_job, get_job, submit_job
+from core.activity_lookup import mapping_pair
+from core.foreground_network import assegna_blocchi, build_foreground_network, run_lcia_blocks
+from core.lcia_runner import _as_method_tuples
+from core.unit_scores import instant_lcia
 
 
 import plotly.graph_objects as go
 
 # Import Brightway
-import bw2analyzer as ba
 import bw2data as bd
 import bw2io as bi
 import bw2calc as bc
@@ -41,6 +56,74 @@ uploaded_file = st.file_uploader(
     help="Load an Aspen Plus Backup file (.bkp) to automatically extract the flows"
 )
 
+def _stato_job_template():
+    job = get_job(st.session_state.get('template_job'))
+    if job is None:
+        return
+    if job.active:
+        st.progress(job.progress, text=job.message or "Building template...")
+        if st.button("Cancel template build", key="cancel_template"):
+            cancel_job(job.id)
+    elif job.status == JOB_DONE:
+        st.success("Template ready.")
+    elif job.status == JOB_ERROR:
+        st.error(f"Template error: {job.error}")
+    elif job.status == JOB_CANCELLED:
+        st.info("Template build cancelled; the partial template project was removed.")
+
+
+def _stato_job_mc():
+    job = get_job(st.session_state.get('mc_job'))
+    if job is None:
+        return
+    if job.active:
+        st.progress(job.progress, text=job.message or "Running Monte Carlo...")
+        # Lo stop conclude il batch in corso: le statistiche parziali restano come risultato del job
+        if st.button("Stop", key='mc_stop'):
+            cancel_job(job.id)
+    elif job.status == JOB_DONE and job.result:
+        stats = job.result
+        st.caption(
+            f"Iterations: {stats['iterations']}"
+            + (" — converged" if stats.get('converged') else "")
+        )
+        st.dataframe(pd.DataFrame({
+            'Deterministic': stats['deterministic'],
+            'Mean': stats['mean'],
+            'Std': stats['std'],
+            '2.5%': stats['p2_5'],
+            '97.5%': stats['p97_5'],
+            'Rel. SEM %': 100 * stats['rel_sem'],
+        }, index=stats['methods']), use_container_width=True)
+    elif job.status == JOB_ERROR:
+        st.error(f"Monte Carlo error: {job.error}")
+    elif job.status == JOB_CANCELLED:
+        st.info("Monte Carlo cancelled.")
+
+
+def _stato_job_lcia(was_active: bool):
+    job = get_job(st.session_state.get('lcia_job') or st.query_params.get('lcia_job'))
+    if job is None:
+        return
+    if job.active:
+        st.progress(job.progress, text=job.message or "Running LCIA...")
+        if st.button("Cancel LCIA", key='cancel_lcia'):
+            cancel_job(job.id)
+    elif was_active:
+        # Job concluso dopo l'ultimo rerun completo: il risultato si raccoglie nello script principale
+        st.rerun()
+    elif job.status == JOB_ERROR:
+        st.error(f"LCIA error: {job.error}")
+    elif job.status == JOB_CANCELLED:
+        st.info("LCIA cancelled.")
+
+
+# Aggiornamento periodico dei soli riquadri di stato dei job, se disponibile
+_fragment = getattr(st, "fragment", None)
+_mostra_job_template = _fragment(run_every=1.0)(_stato_job_template) if _fragment else _stato_job_template
+_mostra_job_mc = _fragment(run_every=1.0)(_stato_job_mc) if _fragment else _stato_job_mc
+_mostra_job_lcia = _fragment(run_every=1.0)(_stato_job_lcia) if _fragment else _stato_job_lcia
+
 def get_options(flow_type, flow_direction):
     if flow_type == "energy":
         return ["-- Select category --", "Technosphere", "Biosphere", "Avoided Product"]
@@ -61,6 +144,7 @@ if uploaded_file is not None:
         st.session_state.energy_flows_data = []
         st.session_state.material_inputs_data = []
         st.session_state.material_outputs_data = []
+        st.session_state.pop("mappatura_libreria_applicata", None)
     extract_clicked = st.button("Extract Flows")
 else:
     st.info("Load an Aspen Plus .bkp file and press 'Extract Flows' to continue.")
@@ -72,8 +156,10 @@ if uploaded_file is not None and (st.session_state.get('flussi_estratti') or ('e
             with tempfile.NamedTemporaryFile(delete=False, suffix='.bkp') as tmp:
                 tmp.write(st.session_state.bkp_bytes)
                 tmp_path = tmp.name
-            energia, minput, moutput, errore = estrai_flussi(tmp_path, st)
+            topologia = {}
+            energia, minput, moutput, errore = estrai_flussi(tmp_path, st, topologia=topologia)
             if errore is None:
+                st.session_state.topologia = topologia
                 st.session_state.energy_flows_data = energia
                 st.session_state.material_inputs_data = minput
                 st.session_state.material_outputs_data = moutput
@@ -175,6 +261,7 @@ if st.session_state.get('flussi_estratti') and not st.session_state.get('error_e
         import pandas as pd
         df = normalizza_flussi(all_flows_data, ref_flow_data)
         st.session_state['lci_df'] = df
+        st.session_state['ref_flow_value'] = ref_flow_data['value']
 
         # Ricostruisci Category/Direction
         id_to_cat = {x['name']: x['category'] for x in all_flows_data}
@@ -253,22 +340,57 @@ if st.session_state.get('flussi_estratti') and not st.session_state.get('error_e
 
         # --- Opzione A: Creazione/attivazione nuovo progetto Brightway ---
         nome_nuovo_progetto = st.text_input("Name of the new Brightway project (e.g.: Aspen_BW)")
+        templates = carica_registro()
+        REMOTE_INSTALL = "(no template — install biosphere from remote)"
+        template_scelto = st.selectbox(
+            "Start from template (offline clone)", list(templates) + [REMOTE_INSTALL], key="sel_template",
+        )
         if st.button("Create and activate new project"):
-            bi.remote.install_project("ecoinvent-3.10-biosphere", nome_nuovo_progetto)
-            bd.projects.set_current(nome_nuovo_progetto)
-            st.success(f'The new project "{nome_nuovo_progetto}" was created and activated. Biosphere was imported')
-            
+            try:
+                if template_scelto == REMOTE_INSTALL:
+                    # Processo isolato: l'installazione non cambia il progetto attivo del server
+                    esegui_isolato(bi.remote.install_project, DEFAULT_REMOTE_PROJECT, nome_nuovo_progetto)
+                    st.session_state['sel_proj'] = nome_nuovo_progetto
+                    st.success(f'The new project "{nome_nuovo_progetto}" was created and activated. Biosphere was imported')
+                else:
+                    crea_da_template(template_scelto, nome_nuovo_progetto)
+                    st.session_state['sel_proj'] = nome_nuovo_progetto
+                    st.success(f'The new project "{nome_nuovo_progetto}" was cloned from template "{template_scelto}" and activated.')
+            except Exception as e:
+                st.error(f"Project creation error: {e}")
+
+        with st.expander("Project templates", expanded=False):
+            st.caption("Build a project once (biosphere, methods, optionally a local ecospold2 database); new projects clone it.")
+            tmpl_name = st.text_input("Template name", key="tmpl_name")
+            tmpl_remote = st.text_input("Remote project to install once", value=DEFAULT_REMOTE_PROJECT, key="tmpl_remote")
+            tmpl_spold = st.text_input("Optional local ecospold2 folder/archive", key="tmpl_spold")
+            tmpl_spold_db = st.text_input("Database name for the ecospold2 import", key="tmpl_spold_db")
+            tmpl_job = get_job(st.session_state.get('template_job'))
+            if st.button("Build template", disabled=not tmpl_name or bool(tmpl_job and tmpl_job.active)):
+                st.session_state['template_job'] = submit_job(
+                    "template", costruisci_template, tmpl_name, tmpl_remote or None, tmpl_spold or None, tmpl_spold_db or None,
+                )
+            _mostra_job_template()
+            for t_name, entry in templates.items():
+                st.write(f"- {t_name}: {', '.join(entry.get('databases', []))} ({entry.get('methods', 0)} methods)")
+
+
         # --- Opzione B: Selezione progetto esistente ---
         st.markdown("Or select and activate an existing project:")
-        progetti = [p.name for p in bd.projects]  # Ottieni solo nomi veri
+        progetti = [p.name for p in bd.projects if not p.name.startswith(TEMPLATE_PREFIX)]  # Ottieni solo nomi veri
         if progetti:
+            if st.session_state.get('sel_proj') not in progetti:
+                st.session_state['sel_proj'] = bd.projects.current if bd.projects.current in progetti else progetti[0]
             progetto_scelto = st.selectbox("Available projects:", progetti, key="sel_proj")
-            if progetto_scelto != bd.projects.current:
-                bd.projects.set_current(progetto_scelto)
+            # Progetto della sessione: metadati, ricerca, inventario e LCIA girano nei worker legati a questo
+            # progetto; il processo Streamlit non cambia mai il progetto attivo (condiviso tra le sessioni)
+            if progetto_scelto != st.session_state.get('progetto'):
+                st.session_state['progetto'] = progetto_scelto
                 st.info(f'Activated project: "{progetto_scelto}"')
-            st.write(f"✅ Currently active project: {bd.projects.current}")
+            st.write(f"✅ Project of this session: {progetto_scelto}")
         else:
             st.info("There are no Brightway projects available.")
+            st.stop()
             
         # --- Importazione database
         gestione_database_brightway()
@@ -278,7 +400,7 @@ if st.session_state.get('flussi_estratti') and not st.session_state.get('error_e
         st.markdown("## Mapping to Brightway activities")
 
         # Determina un database di default (preferisci ecoinvent se presente)
-        available_dbs = sorted(list(bd.databases))  # richiede: import bw2data as bd
+        available_dbs = elenco_database(st.session_state['progetto'])
         _default_db = next((d for d in available_dbs if str(d).startswith('ecoinvent')), available_dbs if available_dbs else None)
 
         # Sezione di mapping (container dedicato per evitare flicker del layout)
@@ -290,6 +412,10 @@ if st.session_state.get('flussi_estratti') and not st.session_state.get('error_e
         st.markdown('### Mapping summary')
         mostra_tabella_riepilogo(st.session_state['lci_df'], st.session_state['mappatura'])
 
+        # Libreria di mappature riutilizzabile tra flowsheet
+        with st.expander("Mapping library", expanded=False):
+            mostra_libreria_mappature(st.session_state['lci_df'], st.session_state['mappatura'])
+
 
         # === Build Inventory (foreground DB) ===
         st.markdown("---")
@@ -312,8 +438,56 @@ if st.session_state.get('flussi_estratti') and not st.session_state.get('error_e
         reference_product = st.text_input("Reference product", value=ref_name)
         reference_unit = st.text_input("Reference unit", value=ref_unit)
 
-        build_inventory_clicked = st.button("Build inventory", type="primary")
-        if build_inventory_clicked:
+        exploratory = st.checkbox(
+            "Exploratory mode (in-memory LCIA, the foreground process is not written to the database)",
+            key='exploratory_mode',
+        )
+        multi_block = st.checkbox(
+            "One process per Aspen block (multi-block foreground, block-level hotspots)",
+            key='multi_block_mode',
+            disabled=exploratory or not st.session_state.get('topologia', {}).get('blocks'),
+        )
+        build_inventory_clicked = False if exploratory else st.button("Build inventory", type="primary")
+        if build_inventory_clicked and multi_block:
+            with st.spinner("Building block-level foreground network..."):
+                flow_blocks = assegna_blocchi(
+                    st.session_state.energy_flows_data,
+                    st.session_state.material_inputs_data,
+                    st.session_state.material_outputs_data,
+                    st.session_state.get('topologia', {}),
+                )
+                res = esegui_nel_progetto(
+                    st.session_state['progetto'],
+                    build_foreground_network,
+                    df_lci=st.session_state['lci_df'],
+                    mapping=st.session_state.get('mappatura', {}),
+                    target_db=target_db,
+                    process_meta={
+                        'name': process_name,
+                        'location': location,
+                        'unit': reference_unit,
+                        'reference_product': reference_product,
+                        'flowsheet': st.session_state.get('last_file'),
+                    },
+                    topologia=st.session_state.get('topologia', {}),
+                    flow_blocks=flow_blocks,
+                    reference_value=st.session_state['ref_flow_value'],
+                )
+                st.session_state['target_db'] = res['database']
+                st.session_state['process_key'] = res['process']
+                st.session_state['foreground_network'] = res
+                st.session_state['inventory_built'] = True
+                rep = res['report']
+                st.success(
+                    f"Foreground network built in DB '{res['database']}' with {len(res['blocks'])} blocks "
+                    f"(inserted {rep['inserted']}, updated {rep['updated']}, deleted {rep['deleted']}, unchanged {rep['unchanged']})"
+                )
+                if rep['warnings']:
+                    with st.expander("Warnings", expanded=False):
+                        for w in rep['warnings']:
+                            st.warning(w)
+        elif build_inventory_clicked:
+            st.session_state.pop('foreground_network', None)
             with st.spinner("Building inventory..."):
                 process_meta = {
                     'name': process_name,
@@ -321,8 +495,11 @@ if st.session_state.get('flussi_estratti') and not st.session_state.get('error_e
                     'unit': reference_unit,
                     'reference_product': reference_product,
                     'chimaera': True,
+                    'flowsheet': st.session_state.get('last_file'),
                 }
-                res = build_inventory(
+                res = esegui_nel_progetto(
+                    st.session_state['progetto'],
+                    build_inventory,
                     df_lci=st.session_state['lci_df'],
                     mapping=st.session_state.get('mappatura', {}),
                     target_db=target_db,
@@ -331,39 +508,306 @@ if st.session_state.get('flussi_estratti') and not st.session_state.get('error_e
                 st.session_state['target_db'] = res['database']
                 st.session_state['process_key'] = res['process']
                 st.session_state['inventory_built'] = True
-                st.success(f"Inventory built in DB '{res['database']}'. Edges created: {res['report']['created_edges']}")
+                rep = res['report']
+                st.success(
+                    f"Inventory built in DB '{res['database']}'. Edges: {rep['created_edges']} "
+                    f"(inserted {rep['inserted']}, updated {rep['updated']}, deleted {rep['deleted']}, unchanged {rep['unchanged']})"
+                )
                 if res['report']['warnings']:
                     with st.expander("Warnings", expanded=False):
                         for w in res['report']['warnings']:
                             st.warning(w)
 
         # === LCIA selection and run ===
-        if st.session_state.get('inventory_built'):
+        if st.session_state.get('inventory_built') or exploratory:
             st.markdown("---")
             st.markdown("## Life Cycle Impact Assessment (LCIA)")
             show_lcia_selector()
-            if st.session_state.get('process_key') and st.session_state.get('lcia_selection_payload', {}).get('categories'):
-                run_lcia_clicked = st.button("Run LCIA", type="primary")
-                if run_lcia_clicked:
-                    with st.spinner("Running LCIA..."):
-                        proc = bd.get_node(**st.session_state['process_key']) if isinstance(st.session_state['process_key'], dict) else st.session_state['process_key']
-                        results = run_lcia(proc, st.session_state['lcia_selection_payload'])
-                        # Mappa metodo (stringa tupla) -> unità da metadata Brightway
-                        selected_methods = st.session_state['lcia_selection_payload']['categories']
-                        units = {}
-                        for cat in selected_methods:
-                            mt = tuple(cat)  # le categorie sono già tuple Brightway complete
+            if (st.session_state.get('process_key') or exploratory) and st.session_state.get('lcia_selection_payload', {}).get('categories'):
+                # LCIA come job in background: l'id resta in sessione e nei query params (rerun e riconnessioni)
+                job = get_job(st.session_state.get('lcia_job') or st.query_params.get('lcia_job'))
+                run_lcia_clicked = st.button("Run LCIA", type="primary", disabled=bool(job and job.active))
+                # Ricalcolo completo richiesto dai contributi quando i punteggi vengono dall'archivio
+                full_detail = st.session_state.pop('lcia_full_detail', False) and not (job and job.active)
+                if run_lcia_clicked or full_detail:
+                    if exploratory:
+                        job_id = job_nel_progetto(
+                            "lcia",
+                            st.session_state['progetto'],
+                            run_lcia_in_memory_detailed,
+                            st.session_state['lci_df'].copy(),
+                            dict(st.session_state.get('mappatura', {})),
+                            dict(st.session_state['lcia_selection_payload']),
+                            use_store=not full_detail,
+                            solver=True,
+                        )
+                    else:
+                        # Hotspot per blocco nello stesso job, se l'inventario è una rete multi-blocco
+                        job_id = job_nel_progetto(
+                            "lcia",
+                            st.session_state['progetto'],
+                            run_lcia_blocks,
+                            st.session_state['process_key'],
+                            dict(st.session_state['lcia_selection_payload']),
+                            network=st.session_state.get('foreground_network'),
+                            use_store=not full_detail,
+                            solver=True,
+                        )
+                    st.session_state['lcia_job'] = job_id
+                    st.query_params['lcia_job'] = job_id
+                    job = get_job(job_id)
+
+                if job is not None and job.status == JOB_DONE and st.session_state.get('lcia_job_collected') != job.id:
+                    # Risultato completo in sessione: i contributi riusano inventario e supply già risolti
+                    st.session_state['lcia_job_collected'] = job.id
+                    st.session_state['lcia_detailed'] = job.result
+                    st.session_state['block_hotspots'] = job.result.get('block_hotspots')
+                    # Albero della catena di fornitura ripartito dal nuovo risultato
+                    st.session_state['sc_children'] = {}
+                    st.session_state['sc_open'] = {"root"}
+                # Avanzamento e annullamento nel riquadro aggiornato periodicamente, senza rerun dell'intera pagina
+                _mostra_job_lcia(bool(job and job.active))
+
+                detailed = st.session_state.get('lcia_detailed')
+                if detailed is not None:
+                    results = detailed.get('results', {})
+                    # Mappa metodo (stringa tupla) -> unità dal catalogo dei metodi in cache
+                    catalog = metadati_progetto(st.session_state['progetto'])["methods"]
+                    units = {str(mt): method_unit(mt, catalog) for mt in detailed.get('methods', [])}
+
+                    if results:
+                        for m, score in results.items():
+                            unit = units.get(m, '')
+                            st.write(f"{m}: {score:.6g} {unit}")
+                    else:
+                        st.info("No LCIA results. Verify method/categories selection.")
+
+                    if st.session_state.get('block_hotspots'):
+                        st.markdown("### Block-level hotspots")
+                        st.dataframe(pd.DataFrame(st.session_state['block_hotspots']).T, use_container_width=True)
+
+                # === Contribution analysis (sul risultato dell'ultima LCIA, senza nuove risoluzioni) ===
+                if detailed and detailed.get('results') and detailed.get('from_store'):
+                    with st.expander("Contribution analysis", expanded=False):
+                        st.info("Scores were read from the result store, so no supply or contributions are available.")
+                        if st.button("Recompute with full detail", key='lcia_full_detail_btn'):
+                            st.session_state['lcia_full_detail'] = True
+                            st.rerun()
+                elif detailed and detailed.get('results'):
+                    with st.expander("Contribution analysis", expanded=False):
+                        top_k = st.slider("Top contributors", min_value=3, max_value=50, value=10, key='contrib_top_k')
+                        # Calcolato una volta per risultato e top-k: l'expander gira a ogni rerun
+                        contrib_key = (st.session_state.get('lcia_job_collected'), id(detailed), top_k)
+                        if st.session_state.get('contrib_cache', (None,))[0] != contrib_key:
+                            st.session_state['contrib_cache'] = (
+                                contrib_key,
+                                esegui_solver(st.session_state['progetto'], analizza_contributi, detailed, top_k=top_k),
+                            )
+                        contrib = st.session_state['contrib_cache'][1]
+                        contrib_method = st.selectbox("Impact category", list(contrib), key='contrib_method')
+                        if contrib_method:
+                            for label, part in (
+                                ("By foreground exchange", "exchanges"),
+                                ("By background process", "processes"),
+                                ("By elementary flow", "flows"),
+                            ):
+                                st.markdown(f"**{label}**")
+                                st.dataframe(pd.DataFrame(contrib[contrib_method][part]), use_container_width=True)
+
+                # === Monte Carlo (incertezza background + ±% sui flussi Aspen) ===
+                with st.expander("Monte Carlo (uncertainty)", expanded=False):
+                    if not (detailed and detailed.get('results')):
+                        st.info("Run LCIA first: the Monte Carlo starts from the deterministic solution.")
+                    else:
+                        mapping_now = st.session_state.get('mappatura', {})
+                        spread_default = st.number_input("Default foreground uncertainty (±%)", min_value=0.0, value=10.0, step=1.0, key='mc_spread')
+                        spread_df = st.data_editor(
+                            pd.DataFrame({
+                                'Flow': list(mapping_now),
+                                '±%': [float(spread_default)] * len(mapping_now),
+                            }),
+                            disabled=['Flow'],
+                            use_container_width=True,
+                            key='mc_spread_editor',
+                        )
+                        c1, c2, c3 = st.columns(3)
+                        with c1:
+                            mc_max = st.number_input("Max iterations", min_value=10, value=1000, step=100, key='mc_max')
+                        with c2:
+                            mc_tol = st.number_input("Stop when relative SEM < (%)", min_value=0.1, value=1.0, step=0.1, key='mc_tol')
+                        with c3:
+                            mc_workers = st.number_input("Worker processes", min_value=1, value=max(1, min(4, (os.cpu_count() or 2) - 1)), key='mc_workers')
+                        # Come job nel worker del progetto: avanzamento per batch, stop con statistiche parziali
+                        mc_job = get_job(st.session_state.get('mc_job'))
+                        if st.button("Start Monte Carlo", key='mc_start', disabled=bool(mc_job and mc_job.active)):
+                            spreads = {}
+                            for flow, pct in zip(spread_df['Flow'], spread_df['±%']):
+                                pair = mapping_pair(mapping_now.get(flow))
+                                if pair[0] and pair[1]:
+                                    spreads[tuple(pair)] = float(pct)
+                            st.session_state['mc_job'] = job_nel_progetto(
+                                "monte_carlo",
+                                st.session_state['progetto'],
+                                esegui_monte_carlo,
+                                detailed['exchanges'],
+                                detailed['process_key'],
+                                detailed['methods'],
+                                foreground_spread=spreads,
+                                max_iterations=int(mc_max),
+                                rel_tolerance=float(mc_tol) / 100.0,
+                                workers=int(mc_workers),
+                                solver=True,
+                            )
+                        _mostra_job_mc()
+
+                # === Sensitività one-at-a-time (tutti gli scenari in una sola risoluzione) ===
+                with st.expander("Sensitivity (one-at-a-time)", expanded=False):
+                    if not (detailed and detailed.get('results')):
+                        st.info("Run LCIA first.")
+                    else:
+                        mapping_now = st.session_state.get('mappatura', {})
+                        sens_flows = st.multiselect("Flows", list(mapping_now), default=list(mapping_now), key='sens_flows')
+                        sens_delta = st.number_input("Perturbation (±%)", min_value=0.1, value=10.0, step=1.0, key='sens_delta')
+                        if st.button("Run sensitivity", key='sens_run') and sens_flows:
+                            flow_keys = {}
+                            for flow in sens_flows:
+                                pair = mapping_pair(mapping_now.get(flow))
+                                if pair[0] and pair[1]:
+                                    flow_keys[tuple(pair)] = flow
                             try:
-                                units[str(mt)] = bd.Method(mt).metadata.get('unit', '')
-                            except Exception:
-                                units[str(mt)] = ''
-
-                        if results:
-                            for m, score in results.items():
-                                unit = units.get(m, '')
-                                st.write(f"{m}: {score:.6g} {unit}")
-                        else:
-                            st.info("No LCIA results. Verify method/categories selection.")
+                                sens = esegui_solver(
+                                    st.session_state['progetto'], one_at_a_time,
+                                    detailed['exchanges'], detailed['process_key'], detailed['methods'],
+                                    keys=list(flow_keys), delta=float(sens_delta) / 100.0,
+                                )
+                                st.markdown("**Elasticities** (relative score change / relative flow change)")
+                                st.dataframe(pd.DataFrame(
+                                    {flow_keys[k]: v for k, v in sens['elasticities'].items()},
+                                    index=[str(m) for m in sens['methods']],
+                                ).T, use_container_width=True)
+                                st.markdown("**Scenario scores**")
+                                st.dataframe(pd.DataFrame(
+                                    sens['scores'], index=sens['scenarios'], columns=[str(m) for m in sens['methods']],
+                                ), use_container_width=True)
+                            except ValueError as e:
+                                st.warning(str(e))
+
+                # === Esplorazione pigra della catena di fornitura (supply e punteggi per unità già in cache) ===
+                if detailed and detailed.get('results') and detailed.get('background') is not None:
+                    with st.expander("Supply-chain explorer", expanded=False):
+                        sc_method = st.selectbox(
+                            "Impact category", detailed['methods'], format_func=lambda m: " | ".join(map(str, m)), key='sc_method',
+                        )
+                        sc_cutoff = st.number_input("Cutoff (% of total score)", min_value=0.0, value=1.0, step=0.5, key='sc_cutoff') / 100.0
+                        sc_open = st.session_state.setdefault('sc_open', {"root"})
+                        sc_children = st.session_state.setdefault('sc_children', {})
+                        root_key = ('root', str(sc_method), st.session_state.get('lcia_job_collected'))
+                        if root_key not in sc_children:
+                            sc_children[root_key] = esegui_solver(st.session_state['progetto'], radice_catena, detailed, sc_method)
+                        stack_nodes = [(sc_children[root_key], 0)]
+                        while stack_nodes:
+                            node, depth = stack_nodes.pop()
+                            is_open = node['key'] in sc_open
+                            arrow = "·" if node.get('leaf') else ("▾" if is_open else "▸")
+                            label = (
+                                f"{' ' * depth}{arrow} {node['name']}"
+                                + (f" [{node['location']}]" if node.get('location') else "")
+                                + f" — {node['score']:.4g} ({100 * node['share']:.1f}%)"
+                            )
+                            if st.button(label, key=f"sc_{node['key']}", disabled=bool(node.get('leaf'))):
+                                sc_open.symmetric_difference_update({node['key']})
+                                st.rerun()
+                            if is_open and not node.get('leaf'):
+                                cache_key = (node['key'], str(sc_method), sc_cutoff, st.session_state.get('lcia_job_collected'))
+                                if cache_key not in sc_children:
+                                    sc_children[cache_key] = esegui_solver(
+                                        st.session_state['progetto'], espandi_nodo, detailed, sc_method, node, sc_cutoff,
+                                    )
+                                for child in reversed(sc_children[cache_key]):
+                                    stack_nodes.append((child, depth + 1))
+
+                # === LCIA comparativa su più background (database o progetti) ===
+                with st.expander("Comparative LCIA across backgrounds", expanded=False):
+                    st.caption(
+                        "The mapping is re-linked to equivalent activities (same name, reference product and unit; "
+                        "location, then GLO, then RoW) in each background and the LCIAs run in parallel."
+                    )
+                    cmp_dbs = st.multiselect("Databases in the current project", elenco_database(st.session_state['progetto']), key='cmp_dbs')
+                    cmp_other = st.text_area(
+                        "Other projects (one 'project::database' per line)", key='cmp_other', height=80,
+                    )
+                    if st.button("Run comparison", key='cmp_run'):
+                        cmp_targets = [(st.session_state['progetto'], d) for d in cmp_dbs]
+                        for line in (cmp_other or "").splitlines():
+                            if "::" in line:
+                                proj, dbn = line.split("::", 1)
+                                cmp_targets.append((proj.strip(), dbn.strip()))
+                        with st.spinner("Running comparative LCIA..."):
+                            # Metadati di partenza risolti nel worker del progetto della sessione
+                            st.session_state['cmp_result'] = esegui_nel_progetto(
+                                st.session_state['progetto'],
+                                confronta_background,
+                                st.session_state['lci_df'],
+                                st.session_state.get('mappatura', {}),
+                                cmp_targets,
+                                _as_method_tuples(st.session_state['lcia_selection_payload']),
+                            )
+                    cmp = st.session_state.get('cmp_result')
+                    if cmp:
+                        st.dataframe(cmp['table'], use_container_width=True)
+                        for label, err in cmp['errors'].items():
+                            st.warning(f"{label}: {err}")
+                        for label, warns in cmp.get('warnings', {}).items():
+                            for w in warns:
+                                st.warning(f"{label}: {w}")
+                        for label, rep in cmp['reports'].items():
+                            unmatched = [r['flow'] for r in rep if r['target'] is None]
+                            if unmatched:
+                                st.info(f"{label}: no equivalent activity for {', '.join(unmatched)}")
+
+                # === What-if: ricalcolo istantaneo (prodotto scalare con i punteggi per unità in cache) ===
+                with st.expander("What-if (instant recompute)", expanded=False):
+                    st.caption(
+                        "Edit the normalized amounts: scores are recomputed from cached per-unit scores "
+                        "of the mapped background activities, without running the LCA solver again."
+                    )
+                    base_df = st.session_state['lci_df']
+                    edited = st.data_editor(
+                        base_df[['Flow', 'Type', 'Unit', 'Amount_float']],
+                        disabled=['Flow', 'Type', 'Unit'],
+                        use_container_width=True,
+                        key='whatif_editor',
+                    )
+                    methods = _as_method_tuples(st.session_state['lcia_selection_payload'])
+                    whatif_df = base_df.copy()
+                    whatif_df['Amount_float'] = edited['Amount_float'].astype(float).values
+                    # Il corpo dell'expander gira a ogni rerun: si ricalcola solo su richiesta o se gli input cambiano
+                    whatif_key = (
+                        tuple(base_df['Amount_float'].astype(float)), tuple(whatif_df['Amount_float']),
+                        tuple(methods), repr(sorted(st.session_state.get('mappatura', {}).items(), key=lambda kv: str(kv[0]))),
+                    )
+                    whatif = st.session_state.get('whatif')
+                    if st.button("Compute what-if", key='whatif_run') or (whatif is not None and whatif['key'] != whatif_key):
+                        try:
+                            with st.spinner("Computing per-unit scores..."):
+                                progetto = st.session_state['progetto']
+                                baseline = esegui_solver(progetto, instant_lcia, base_df, st.session_state.get('mappatura', {}), methods)
+                                scenario = esegui_solver(progetto, instant_lcia, whatif_df, st.session_state.get('mappatura', {}), methods)
+                            whatif = {'key': whatif_key, 'table': pd.DataFrame({
+                                'Baseline': baseline['results'],
+                                'What-if': scenario['results'],
+                                'Δ %': {
+                                    m: (100.0 * (scenario['results'][m] - v) / v) if v else 0.0
+                                    for m, v in baseline['results'].items()
+                                },
+                            }), 'error': None}
+                        except Exception as e:
+                            whatif = {'key': whatif_key, 'table': None, 'error': f"{type(e).__name__}: {e}"}
+                        st.session_state['whatif'] = whatif
+                    if whatif is not None and whatif['error']:
+                        st.warning(whatif['error'])
+                    elif whatif is not None:
+                        st.dataframe(whatif['table'], use_container_width=True)
 
             else:
                 st.info("Build inventory and select at least one LCIA category to enable LCIA run.")
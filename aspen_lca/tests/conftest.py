@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Come gui/app_gui.py: i moduli si importano come `core.*` dalla cartella aspen_lca
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
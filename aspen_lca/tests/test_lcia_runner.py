@@ -0,0 +1,101 @@
+# tests/test_lcia_runner.py
+
+import pytest
+
+bd = pytest.importorskip("bw2data")
+bc = pytest.importorskip("bw2calc")
+from bw2data.tests import bw2test
+
+from core.background import background_system, flatten_foreground, stored_exchanges
+from core.lcia_runner import lcia_from_exchanges
+
+METHOD = ("test", "climate change", "GWP100")
+
+
+def _progetto():
+    """
+    Biosfera, un background di due processi con un ciclo e un foreground: tecnosfera + biosfera, sola biosfera,
+    flowsheet che consuma un processo di blocco dello stesso database.
+    """
+    bd.Database("bio").write({
+        ("bio", "co2"): {"name": "carbon dioxide", "type": "emission", "unit": "kilogram", "categories": ("air",)},
+        ("bio", "ch4"): {"name": "methane", "type": "emission", "unit": "kilogram", "categories": ("air",)},
+    })
+    bd.Database("bg").write({
+        ("bg", "a"): {"name": "a", "unit": "kilogram", "location": "GLO", "exchanges": [
+            {"input": ("bg", "a"), "amount": 1.0, "type": "production"},
+            {"input": ("bg", "b"), "amount": 0.5, "type": "technosphere"},
+            {"input": ("bio", "co2"), "amount": 2.0, "type": "biosphere"},
+        ]},
+        ("bg", "b"): {"name": "b", "unit": "kilogram", "location": "GLO", "exchanges": [
+            {"input": ("bg", "b"), "amount": 1.0, "type": "production"},
+            {"input": ("bg", "a"), "amount": 0.2, "type": "technosphere"},
+            {"input": ("bio", "ch4"), "amount": 0.1, "type": "biosphere"},
+        ]},
+    })
+    bd.Database("fg").write({
+        ("fg", "mixed"): {"name": "mixed", "unit": "kilogram", "location": "GLO", "exchanges": [
+            {"input": ("fg", "mixed"), "amount": 2.0, "type": "production"},
+            {"input": ("bg", "a"), "amount": 3.0, "type": "technosphere"},
+            {"input": ("bg", "b"), "amount": 1.0, "type": "technosphere"},
+            {"input": ("bio", "co2"), "amount": 1.5, "type": "biosphere"},
+        ]},
+        ("fg", "bio_only"): {"name": "bio only", "unit": "kilogram", "location": "GLO", "exchanges": [
+            {"input": ("fg", "bio_only"), "amount": 1.0, "type": "production"},
+            {"input": ("bio", "co2"), "amount": 0.7, "type": "biosphere"},
+            {"input": ("bio", "ch4"), "amount": 4.0, "type": "biosphere"},
+        ]},
+        ("fg", "block"): {"name": "block", "unit": "kilogram", "location": "GLO", "exchanges": [
+            {"input": ("fg", "block"), "amount": 2.0, "type": "production"},
+            {"input": ("bg", "a"), "amount": 1.0, "type": "technosphere"},
+            {"input": ("bio", "co2"), "amount": 0.3, "type": "biosphere"},
+        ]},
+        ("fg", "flowsheet"): {"name": "flowsheet", "unit": "kilogram", "location": "GLO", "exchanges": [
+            {"input": ("fg", "flowsheet"), "amount": 1.0, "type": "production"},
+            {"input": ("fg", "block"), "amount": 0.8, "type": "technosphere"},
+            {"input": ("bg", "b"), "amount": 0.5, "type": "technosphere"},
+        ]},
+    })
+    method = bd.Method(METHOD)
+    method.register(unit="kg CO2-Eq")
+    method.write([(("bio", "co2"), 1.0), (("bio", "ch4"), 28.0)])
+
+
+def _bw2calc_score(key):
+    lca = bc.LCA({bd.get_node(database=key[0], code=key[1]): 1.0}, method=METHOD)
+    lca.lci()
+    lca.lcia()
+    return lca.score
+
+
+@pytest.mark.parametrize("code", ["mixed", "bio_only", "flowsheet"])
+@bw2test
+def test_lcia_from_exchanges_matches_bw2calc(code):
+    _progetto()
+    key = ("fg", code)
+    res = lcia_from_exchanges(stored_exchanges(key), key, [METHOD], use_store=False)
+    assert res["results"][str(METHOD)] == pytest.approx(_bw2calc_score(key), rel=1e-8)
+
+
+@bw2test
+def test_background_without_technosphere_is_empty():
+    _progetto()
+    for databases in [(), ("bio",)]:
+        bg = background_system(databases)
+        assert bg.lu is None
+        assert bg.technosphere.shape == (0, 0)
+
+
+@bw2test
+def test_flatten_foreground_solves_blocks_as_foreground():
+    _progetto()
+    key = ("fg", "flowsheet")
+    flat = flatten_foreground(stored_exchanges(key), key)
+    # Supply del blocco per 1 kg di flowsheet: 0.8 / 2 = 0.4; il database foreground non resta tra gli input
+    amounts = {(ex["type"], tuple(ex["input"])): ex["amount"] for ex in flat}
+    assert amounts == pytest.approx({
+        ("production", key): 1.0,
+        ("technosphere", ("bg", "a")): 0.4,
+        ("biosphere", ("bio", "co2")): 0.12,
+        ("technosphere", ("bg", "b")): 0.5,
+    })